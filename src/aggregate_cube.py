@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+儀表板用的預先聚合次數 cube。
+
+儀表板每次重新執行都要對整份學生資料做 groupby / value_counts / crosstab。
+本模組改為在資料版本改變時只掃描一次資料，建立「分群 x 特徵選項」的次數 cube，
+之後的表格、圖表與檢定都只由 cube 推導：
+
+- 類別特徵：每個 (分群, 選項) 的次數，包含分群或選項為遺漏值的格子。
+- 數值特徵：每個分群內各個不同數值的次數 (值的直方圖)。
+  時數等特徵只有少數幾種取值，直方圖即可完整還原 count / mean / median / std、
+  盒鬚圖，以及 ANOVA (由 n、總和、平方和) 與 Kruskal-Wallis (由同值次數計算等級) 檢定。
+
+cube 為長格式 DataFrame：
+    feature, kind ('categorical' / 'numeric'), group, group_pos, level, level_pos, value, count
+group_pos / level_pos 為在分群順序 / 類別順序中的位置，-1 表示遺漏值；
+數值特徵的 level_pos 為不同數值的排序位置。
+
+cube 存於 data/cubes/{name}.parquet，旁邊的 {name}.json
+記錄來源檔的指紋與分析定義的雜湊；兩者任一改變時 load_cube 回傳 None，需重新建立。
+未安裝 pyarrow 時不寫出 cube (每次重新建立)。
+"""
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+
+from build_manifest import same_sources, source_fingerprints
+from labeled_store import pq
+
+CUBE_COLUMNS = ['feature', 'kind', 'group', 'group_pos', 'level', 'level_pos', 'value', 'count']
+MISSING_POS = -1
+
+
+# --- 建立 cube ---
+def _cross_counts(group_codes, group_count, value_codes, value_count):
+    """以 bincount 一次計算 (分群, 值) 次數矩陣；第 0 列 / 第 0 欄為遺漏值"""
+    flat = (group_codes + 1) * (value_count + 1) + (value_codes + 1)
+    return np.bincount(flat, minlength=(group_count + 1) * (value_count + 1)).reshape(group_count + 1, value_count + 1)
+
+def build_count_cube(df, group_col, categorical_cols, numerical_cols):
+    """
+    由預處理後的資料建立次數 cube (只掃描一次各欄位)。
+    group_col 與 categorical_cols 須為 categorical 欄位 (選項順序即 categories 順序)。
+    不存在於 df 的欄位會被略過。
+    """
+    group = df[group_col]
+    groups = list(group.cat.categories)
+    group_codes = group.cat.codes.to_numpy().astype(np.int64)
+    group_labels = np.array([None] + groups, dtype=object)
+    group_positions = np.arange(-1, len(groups))
+
+    parts = []
+    def add_part(feature, kind, counts, level_labels, level_positions, values, keep):
+        rows, cols = np.nonzero(keep)
+        parts.append(pd.DataFrame({
+            'feature': feature, 'kind': kind,
+            'group': group_labels[rows], 'group_pos': group_positions[rows],
+            'level': level_labels[cols], 'level_pos': level_positions[cols],
+            'value': values[cols], 'count': counts[rows, cols].astype(np.int64),
+        }))
+
+    for col in categorical_cols:
+        if col not in df.columns:
+            continue
+        levels = list(df[col].cat.categories)
+        counts = _cross_counts(group_codes, len(groups), df[col].cat.codes.to_numpy().astype(np.int64), len(levels))
+        # 類別特徵保留所有格子 (包含次數為 0 者)，以保存完整的選項清單
+        add_part(col, 'categorical', counts, np.array([None] + levels, dtype=object),
+                 np.arange(-1, len(levels)), np.full(len(levels) + 1, np.nan), np.ones(counts.shape, dtype=bool))
+
+    for col in numerical_cols:
+        if col not in df.columns:
+            continue
+        value_codes, distinct_values = pd.factorize(df[col], sort=True) # NaN 的 code 為 -1
+        distinct_values = np.asarray(distinct_values, dtype=float)
+        counts = _cross_counts(group_codes, len(groups), value_codes.astype(np.int64), len(distinct_values))
+        # 數值特徵只保留非 0 的格子 (值的直方圖)
+        add_part(col, 'numeric', counts, np.full(len(distinct_values) + 1, None, dtype=object),
+                 np.arange(-1, len(distinct_values)), np.concatenate([[np.nan], distinct_values]), counts > 0)
+
+    # 各分群的總人數 (不論特徵是否遺漏)，供判斷哪些分群實際出現在資料中
+    group_sizes = np.bincount(group_codes + 1, minlength=len(groups) + 1)
+    parts.append(pd.DataFrame({
+        'feature': group_col, 'kind': 'group', 'group': group_labels, 'group_pos': group_positions,
+        'level': None, 'level_pos': MISSING_POS, 'value': np.nan, 'count': group_sizes.astype(np.int64),
+    }))
+    return pd.concat(parts, ignore_index=True)[CUBE_COLUMNS]
+
+
+# --- 儲存與載入 ---
+def cube_paths(cube_dir, name):
+    """回傳 (cube 檔路徑, 版本紀錄 JSON 路徑)"""
+    return os.path.join(cube_dir, name + '.parquet'), os.path.join(cube_dir, name + '.json')
+
+def _load_cube_meta(meta_path):
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def load_cube(cube_dir, name, source_paths, config_key):
+    """
+    讀取 cube；未安裝 pyarrow、cube 不存在、來源檔內容或分析定義 (config_key) 改變時回傳 None。
+    來源檔大小與修改時間未變時不重新計算雜湊。
+    """
+    if pq is None:
+        return None
+    cube_path, meta_path = cube_paths(cube_dir, name)
+    meta = _load_cube_meta(meta_path)
+    if meta is None or not os.path.exists(cube_path) or meta.get('config_key') != config_key:
+        return None
+    if not same_sources(source_fingerprints(source_paths, meta.get('sources')), meta.get('sources', {})):
+        return None
+    return pd.read_parquet(cube_path)
+
+def save_cube(cube, cube_dir, name, source_paths, config_key):
+    """儲存 cube 與其版本紀錄，回傳 cube 檔路徑 (未安裝 pyarrow 時不寫出，回傳 None)"""
+    if pq is None:
+        return None
+    os.makedirs(cube_dir, exist_ok=True)
+    cube_path, meta_path = cube_paths(cube_dir, name)
+    cube.to_parquet(cube_path, index=False)
+    meta = {
+        'built_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'config_key': config_key,
+        'sources': source_fingerprints(source_paths),
+        'rows': int(len(cube)),
+    }
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return cube_path
+
+
+def cube_version_of(cube):
+    """cube 內容的雜湊 (資料版本)；內容相同的 cube 不論何時建立都得到相同的值"""
+    row_hashes = pd.util.hash_pandas_object(cube[CUBE_COLUMNS], index=False).to_numpy()
+    return hashlib.sha1(row_hashes.tobytes()).hexdigest()
+
+
+# --- 由 cube 推導表格與檢定 ---
+def _feature_cells(cube, feature):
+    return cube[cube['feature'] == feature]
+
+def observed_groups(cube):
+    """資料中實際出現的分群 (依分群順序)，對應 groupby(..., observed=True) 的分群"""
+    sizes = cube[(cube['kind'] == 'group') & (cube['group_pos'] != MISSING_POS) & (cube['count'] > 0)]
+    return sizes.sort_values('group_pos')['group'].tolist()
+
+def group_order(cube):
+    """分群變項的完整順序 (categories)"""
+    sizes = cube[(cube['kind'] == 'group') & (cube['group_pos'] != MISSING_POS)]
+    return sizes.sort_values('group_pos')['group'].tolist()
+
+def _group_index(cube, groups, group_col):
+    return pd.CategoricalIndex(groups, categories=group_order(cube), ordered=True, name=group_col)
+
+def count_matrix(cube, feature):
+    """
+    類別特徵的 (分群 x 選項) 次數矩陣，排除遺漏值；
+    列為所有分群、欄為所有選項 (依各自的順序)。
+    """
+    cells = _feature_cells(cube, feature)
+    cells = cells[(cells['group_pos'] != MISSING_POS) & (cells['level_pos'] != MISSING_POS)]
+    matrix = cells.pivot_table(index='group_pos', columns='level_pos', values='count', aggfunc='sum', fill_value=0)
+    levels = cells.drop_duplicates('level_pos').set_index('level_pos')['level']
+    groups = group_order(cube)
+    matrix = matrix.reindex(index=range(len(groups)), columns=sorted(levels.index), fill_value=0)
+    matrix.index = groups
+    matrix.columns = levels.loc[matrix.columns].tolist()
+    return matrix.astype(np.int64)
+
+def category_percentages(cube, feature, group_col):
+    """
+    各分群在類別特徵上的選項百分比 (0-100，基於有效回答者，未四捨五入)。
+    等同 df.groupby(group_col, observed=True)[feature].value_counts(normalize=True).mul(100).unstack()。
+    """
+    matrix = count_matrix(cube, feature)
+    groups = observed_groups(cube)
+    matrix = matrix.loc[groups]
+    totals = matrix.sum(axis=1)
+    percentages = matrix.div(totals.where(totals > 0), axis=0).mul(100).fillna(0.0) # 沒有有效回答的分群為 0
+    percentages.index = _group_index(cube, groups, group_col)
+    percentages.columns = pd.CategoricalIndex(matrix.columns, categories=list(matrix.columns), ordered=True,
+                                              name=feature)
+    return percentages
+
+def category_plot_data(cube, feature, group_col):
+    """長格式的百分比資料 (group_col, feature, 'percentage')，供長條圖使用"""
+    percentages = category_percentages(cube, feature, group_col)
+    return percentages.stack(future_stack=True).rename('percentage').reset_index()
+
+def contingency_table(cube, feature, group_col):
+    """卡方檢定用的列聯表 (等同 pd.crosstab(df[group_col], df[feature]))"""
+    matrix = count_matrix(cube, feature)
+    table = matrix.loc[matrix.sum(axis=1) > 0, matrix.sum(axis=0) > 0]
+    table.index = pd.CategoricalIndex(table.index, categories=group_order(cube), ordered=True, name=group_col)
+    table.columns = pd.CategoricalIndex(table.columns, categories=list(matrix.columns), ordered=True, name=feature)
+    return table
+
+def numeric_histograms(cube, feature):
+    """
+    數值特徵各分群的值直方圖：回傳 (不同數值 ndarray, {分群: 次數 ndarray})，排除遺漏值；
+    只包含實際出現的分群 (依分群順序)。
+    """
+    cells = _feature_cells(cube, feature)
+    cells = cells[(cells['group_pos'] != MISSING_POS) & (cells['level_pos'] != MISSING_POS)]
+    values = cells.drop_duplicates('level_pos').sort_values('level_pos')['value'].to_numpy(dtype=float)
+    positions = np.searchsorted(values, cells['value'].to_numpy(dtype=float))
+    histograms = {}
+    for group in observed_groups(cube):
+        in_group = (cells['group'] == group).to_numpy()
+        histograms[group] = np.bincount(positions[in_group], weights=cells['count'].to_numpy()[in_group],
+                                        minlength=len(values)).astype(np.int64)
+    return values, histograms
+
+def _weighted_median(values, counts):
+    n = counts.sum()
+    if n == 0:
+        return np.nan
+    cumulative = np.cumsum(counts)
+    lower = values[np.searchsorted(cumulative, (n - 1) // 2, side='right')]
+    upper = values[np.searchsorted(cumulative, n // 2, side='right')]
+    return (lower + upper) / 2
+
+def numeric_summary(cube, feature, group_col):
+    """
+    各分群的 count / mean / median / std (未四捨五入)。
+    等同 df.groupby(group_col, observed=True)[feature].agg(['count', 'mean', 'median', 'std'])。
+    """
+    values, histograms = numeric_histograms(cube, feature)
+    records = []
+    for group, counts in histograms.items():
+        n = int(counts.sum())
+        mean = (values * counts).sum() / n if n else np.nan
+        std = np.sqrt((counts * (values - mean) ** 2).sum() / (n - 1)) if n > 1 else np.nan
+        records.append({'count': n, 'mean': mean, 'median': _weighted_median(values, counts), 'std': std})
+    summary = pd.DataFrame(records, columns=['count', 'mean', 'median', 'std'])
+    summary.index = _group_index(cube, list(histograms), group_col)
+    return summary
+
+def numeric_long_frame(cube, feature, group_col):
+    """由直方圖還原 (分群, 數值) 的長格式資料 (排除遺漏值)，供盒鬚圖等需要個別觀測值的圖表使用"""
+    values, histograms = numeric_histograms(cube, feature)
+    groups = list(histograms)
+    group_repeats = [counts.sum() for counts in histograms.values()]
+    frame = pd.DataFrame({
+        group_col: pd.Categorical(np.repeat(groups, group_repeats), categories=group_order(cube), ordered=True),
+        feature: np.concatenate([np.repeat(values, counts) for counts in histograms.values()]) if groups else [],
+    })
+    return frame
+
+def anova_from_cube(cube, feature):
+    """
+    以各分群的 n、總和與平方和計算單因子 ANOVA (與 scipy.stats.f_oneway 相同)。
+    只使用有資料的分群；回傳 (F 統計量, p-value)。有效分群少於 2 組時拋出 ValueError。
+    """
+    values, histograms = numeric_histograms(cube, feature)
+    counts = np.array([h for h in histograms.values() if h.sum() > 0], dtype=float).reshape(-1, len(values))
+    if len(counts) < 2:
+        raise ValueError("有效數據組別少於2組")
+    n = counts.sum(axis=1)
+    sums = counts @ values
+    total_n = n.sum()
+    grand_mean = sums.sum() / total_n
+    ss_between = (n * (sums / n - grand_mean) ** 2).sum()
+    ss_within = (counts * (values[None, :] - (sums / n)[:, None]) ** 2).sum()
+    df_between, df_within = len(n) - 1, total_n - len(n)
+    f_statistic = (ss_between / df_between) / (ss_within / df_within)
+    return f_statistic, stats.f.sf(f_statistic, df_between, df_within)
+
+def kruskal_from_cube(cube, feature):
+    """
+    以同值次數計算等級 (含同值校正) 的 Kruskal-Wallis H 檢定 (與 scipy.stats.kruskal 相同)。
+    回傳 (H 統計量, p-value)。有效分群少於 2 組或所有數值都相同時拋出 ValueError。
+    """
+    values, histograms = numeric_histograms(cube, feature)
+    counts = np.array([h for h in histograms.values() if h.sum() > 0], dtype=float).reshape(-1, len(values))
+    if len(counts) < 2:
+        raise ValueError("有效數據組別少於2組")
+    ties = counts.sum(axis=0)
+    total_n = ties.sum()
+    mean_ranks = np.cumsum(ties) - (ties - 1) / 2 # 同值取平均等級
+    rank_sums = counts @ mean_ranks
+    n = counts.sum(axis=1)
+    h_statistic = 12.0 / (total_n * (total_n + 1)) * (rank_sums ** 2 / n).sum() - 3 * (total_n + 1)
+    tie_correction = 1 - (ties ** 3 - ties).sum() / (total_n ** 3 - total_n)
+    if tie_correction == 0:
+        raise ValueError("All numbers are identical in kruskal")
+    h_statistic /= tie_correction
+    return h_statistic, stats.chi2.sf(h_statistic, len(n) - 1)
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+題目兩兩之間的關聯矩陣 (Spearman ρ、Kendall τ-b、Cramér's V)。
+
+target4 對每一組題目各自以 pd.crosstab 製表、手動把標籤對應為順序數值後呼叫 spearmanr / kendalltau。
+本模組改為一次計算整份問卷所有順序題 (李克特量表、頻率題等) 的關聯矩陣：
+
+1. 每個題目的選項位置展開成 one-hot 矩陣 X (列數 x 所有題目的選項總數)，
+   X.T @ X (BLAS 矩陣乘法，依列分段累加) 即為所有題目兩兩之間的列聯表。
+2. 只有兩題都有效回答的學生會出現在該組的列聯表中，因此遺漏值為逐對排除 (pairwise complete)。
+3. 三種係數都只由列聯表推導，與 scipy 對逐對排除遺漏後的資料計算的結果相同：
+   - Spearman ρ：同一選項的回答者取平均等級 (等級依該組的有效回答計算)，再算加權的 Pearson 相關。
+   - Kendall τ-b：以列聯表的累積和計算一致 / 不一致的配對數，含同值校正 (非近似值)。
+   - Cramér's V：未經 Yates 校正的卡方統計量，只使用有次數的選項。
+
+題目為有特定 value map、且實質選項 (非負代碼) 數在 MIN_LEVELS 到 MAX_LEVELS 之間的欄位
+(feature_screening.screening_items)；選項依代碼大小排序，負數代碼視為遺漏值。
+Spearman / Kendall 假設代碼大小即為選項順序，名目題目只適合看 Cramér's V。
+
+用法 (在 src/ 目錄下執行):
+    python association_matrix.py [資料集前綴 ...]      (預設為 s)
+輸出 data/association/TIGPSw1_{前綴}_{spearman,kendall,cramers_v,n}.csv (列與欄皆為變項代碼)
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from feature_screening import MAX_LEVELS, screening_items
+from map_registry import open_registry
+from value_mapping import code_positions
+
+MIN_LEVELS = 2 # 二分題 (例如「不曾 / 曾經有」) 也納入
+ROW_CHUNK = 20_000 # 每次展開成 one-hot 的列數 (限制記憶體用量)
+ITEM_BLOCK = 64 # 每次由列聯表計算係數的題目數
+METHODS = ['spearman', 'kendall', 'cramers_v']
+TOP_PAIRS = 10
+
+
+# --- 列聯表 ---
+def level_offsets(level_counts):
+    """各題目的選項在 one-hot 矩陣中的起始欄位 (最後一個值為選項總數)"""
+    return np.concatenate([[0], np.cumsum(level_counts)]).astype(np.int64)
+
+def joint_counts(level_codes, level_counts, row_chunk=ROW_CHUNK):
+    """
+    所有題目兩兩之間的列聯表，回傳 (選項總數, 選項總數) 的 float64 矩陣。
+    level_codes: (列數, 題目數) 的選項位置，-1 表示遺漏；level_counts: 各題目的選項數。
+    """
+    offsets = level_offsets(level_counts)
+    total_levels = int(offsets[-1])
+    joint = np.zeros((total_levels, total_levels))
+    for start in range(0, len(level_codes), row_chunk):
+        chunk = level_codes[start:start + row_chunk]
+        rows, items = np.nonzero(chunk >= 0)
+        one_hot = np.zeros((len(chunk), total_levels), dtype=np.float32) # 次數在 2^24 以內時 float32 為精確值
+        one_hot[rows, offsets[items] + chunk[rows, items]] = 1
+        joint += one_hot.T @ one_hot
+    return joint
+
+def _pair_tables(joint, level_counts, block):
+    """由 joint_counts 取出 block 中各題目與所有題目的列聯表，補零成 (len(block), 題目數, L, L)"""
+    offsets = level_offsets(level_counts)
+    max_levels = int(max(level_counts))
+    padded = np.pad(joint, ((0, 1), (0, 1))) # 最後一列 / 欄為 0，供選項數較少的題目補齊
+    positions = offsets[:-1, None] + np.arange(max_levels)
+    positions = np.where(np.arange(max_levels) < np.asarray(level_counts)[:, None], positions, len(joint))
+    return padded[positions[block][:, None, :, None], positions[None, :, None, :]]
+
+
+# --- 由列聯表計算係數 ---
+def _mid_ranks(totals):
+    """各選項的平均等級 (同一選項的回答者取平均)"""
+    return np.cumsum(totals, axis=-1) - (totals - 1) / 2
+
+def spearman_from_tables(tables):
+    """列聯表 (..., L, L) 的 Spearman ρ (以平均等級計算的 Pearson 相關)"""
+    row_totals, col_totals = tables.sum(axis=-1), tables.sum(axis=-2)
+    n = row_totals.sum(axis=-1)
+    mean_rank = ((n + 1) / 2)[..., None]
+    row_dev = _mid_ranks(row_totals) - mean_rank
+    col_dev = _mid_ranks(col_totals) - mean_rank
+    covariance = np.einsum('...ab,...a,...b->...', tables, row_dev, col_dev)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return covariance / np.sqrt((row_totals * row_dev ** 2).sum(axis=-1) * (col_totals * col_dev ** 2).sum(axis=-1))
+
+def kendall_from_tables(tables):
+    """列聯表 (..., L, L) 的 Kendall τ-b (含同值校正)"""
+    # 右下方 (兩題選項都較大) 與左下方 (第一題較大、第二題較小) 的累積次數
+    lower = np.cumsum(tables[..., ::-1, :], axis=-2)[..., ::-1, :]
+    lower = np.pad(lower[..., 1:, :], [(0, 0)] * (tables.ndim - 2) + [(0, 1), (0, 0)])
+    lower_right = np.pad(np.cumsum(lower[..., :, ::-1], axis=-1)[..., :, ::-1][..., :, 1:],
+                         [(0, 0)] * (tables.ndim - 2) + [(0, 0), (0, 1)])
+    lower_left = np.pad(np.cumsum(lower, axis=-1)[..., :, :-1], [(0, 0)] * (tables.ndim - 2) + [(0, 0), (1, 0)])
+    concordant = (tables * lower_right).sum(axis=(-2, -1))
+    discordant = (tables * lower_left).sum(axis=(-2, -1))
+    row_totals, col_totals = tables.sum(axis=-1), tables.sum(axis=-2)
+    n = row_totals.sum(axis=-1)
+    pairs = n * (n - 1) / 2
+    row_ties = (row_totals * (row_totals - 1) / 2).sum(axis=-1)
+    col_ties = (col_totals * (col_totals - 1) / 2).sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (concordant - discordant) / np.sqrt((pairs - row_ties) * (pairs - col_ties))
+
+def cramers_v_from_tables(tables):
+    """列聯表 (..., L, L) 的 Cramér's V (未經 Yates 校正，只使用有次數的選項)"""
+    row_totals, col_totals = tables.sum(axis=-1), tables.sum(axis=-2)
+    n = row_totals.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = row_totals[..., :, None] * col_totals[..., None, :] / n[..., None, None]
+        chi2 = np.where(expected > 0, (tables - expected) ** 2 / expected, 0.0).sum(axis=(-2, -1))
+        k = np.minimum((row_totals > 0).sum(axis=-1), (col_totals > 0).sum(axis=-1)) - 1
+        return np.where(k >= 1, np.sqrt(chi2 / (n * k)), np.nan)
+
+def association_matrices(level_codes, level_counts, item_block=ITEM_BLOCK):
+    """
+    所有題目兩兩之間的關聯矩陣。
+    回傳 {'spearman', 'kendall', 'cramers_v', 'n'}，各為 (題目數, 題目數) 的陣列；
+    n 為兩題都有效回答的人數，無法計算的係數 (例如某題在該組只有一個選項) 為 NaN。
+    """
+    joint = joint_counts(level_codes, level_counts)
+    items = len(level_counts)
+    results = {name: np.empty((items, items)) for name in METHODS + ['n']}
+    for start in range(0, items, item_block):
+        block = np.arange(start, min(start + item_block, items))
+        tables = _pair_tables(joint, level_counts, block)
+        results['spearman'][block] = spearman_from_tables(tables)
+        results['kendall'][block] = kendall_from_tables(tables)
+        results['cramers_v'][block] = cramers_v_from_tables(tables)
+        results['n'][block] = tables.sum(axis=(-2, -1))
+    return results
+
+
+# --- 資料集 ---
+def dataset_associations(prefix, registry, data_dir, min_levels=MIN_LEVELS, max_levels=MAX_LEVELS):
+    """計算單一資料集所有順序題的關聯矩陣，回傳 {方法: DataFrame (列與欄為變項代碼)} 與題目說明表"""
+    items = screening_items(registry, prefix, min_levels=min_levels, max_levels=max_levels)
+    csv_path = os.path.join(data_dir, f'TIGPSw1_{prefix}.csv')
+    header = pd.read_csv(csv_path, nrows=0).columns
+    items = {variable: codes for variable, codes in items.items() if variable in header}
+    df = pd.read_csv(csv_path, usecols=list(items), dtype=str, keep_default_na=False, encoding='utf-8-sig')
+
+    level_codes = np.empty((len(df), len(items)), dtype=np.int64)
+    for i, (variable, codes) in enumerate(items.items()):
+        level_codes[:, i] = code_positions(df[variable], codes)
+    matrices = association_matrices(level_codes, [len(codes) for codes in items.values()])
+
+    variables = list(items)
+    id_map = registry.id_map(prefix)
+    item_table = pd.DataFrame({
+        'variable': variables,
+        'description': [id_map.get(variable, '') for variable in variables],
+        'levels': [len(codes) for codes in items.values()],
+        'valid_n': np.diag(matrices['n']).astype(np.int64),
+    })
+    frames = {name: pd.DataFrame(matrix, index=variables, columns=variables) for name, matrix in matrices.items()}
+    return frames, item_table
+
+def strongest_pairs(matrix, item_table, limit=TOP_PAIRS):
+    """關聯矩陣中絕對值最大的題目組合 (不含對角線，每組只列一次)"""
+    upper = np.triu(np.ones(matrix.shape, dtype=bool), k=1)
+    pairs = matrix.where(upper).stack().rename('value').reset_index()
+    pairs.columns = ['variable_1', 'variable_2', 'value']
+    pairs = pairs.reindex(pairs['value'].abs().sort_values(ascending=False).index).head(limit)
+    descriptions = item_table.set_index('variable')['description']
+    pairs['description_1'] = pairs['variable_1'].map(descriptions)
+    pairs['description_2'] = pairs['variable_2'].map(descriptions)
+    return pairs.reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    prefixes = sys.argv[1:] or ['s']
+    data_dir = '../data/'
+    map_dir = '../maps/'
+    output_dir = os.path.join(data_dir, 'association')
+    registry = open_registry(map_dir)
+    if registry is None:
+        raise RuntimeError("關聯矩陣需要 pyarrow 編譯的 map registry (請安裝 pyarrow)。")
+    os.makedirs(output_dir, exist_ok=True)
+    for prefix in prefixes:
+        start_time = time.time()
+        frames, item_table = dataset_associations(prefix, registry, data_dir)
+        for name, frame in frames.items():
+            frame.to_csv(os.path.join(output_dir, f'TIGPSw1_{prefix}_{name}.csv'), encoding='utf-8-sig')
+        item_table.to_csv(os.path.join(output_dir, f'TIGPSw1_{prefix}_items.csv'), index=False, encoding='utf-8-sig')
+        print(f"資料集 {prefix}: {len(item_table)} 個題目、{len(item_table) * (len(item_table) - 1) // 2} 組配對，"
+              f"耗時 {time.time() - start_time:.2f} 秒")
+        print(f"--- Spearman ρ 絕對值最大的 {TOP_PAIRS} 組 ---")
+        for _, row in strongest_pairs(frames['spearman'], item_table).iterrows():
+            print(f"  ρ = {row['value']:.3f}  {row['variable_1']} ({row['description_1']}) x "
+                  f"{row['variable_2']} ({row['description_2']})")
+    print(f"已寫出: {output_dir}")
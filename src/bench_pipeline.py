@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+轉換流程與儀表板預處理的規模化效能基準。
+
+以 synthetic_tigps.py 產生的合成原始資料 (預設 10k、100k、1M 位學生)，
+依序量測各階段的耗時、吞吐量與尖峰記憶體：
+
+    load             map_test.load_csv 讀入原始 CSV
+    map_all_values   值轉換
+    rename           rename_and_check_duplicates
+    save_csv         save_csv 寫出標註 CSV
+    save_columnar    save_columnar 寫出 parquet
+    preprocess_labels  (只有 s) 儀表板標籤流程：read_labeled_table + preprocess_student_data
+    preprocess_codes   (只有 s) 儀表板代碼流程：read_raw_codes + preprocess_student_codes
+    build_cube         (只有 s) build_count_cube
+
+耗時與記憶體分兩次執行量測：第一次只計時；第二次以 tracemalloc 記錄各階段相對於開始前的
+尖峰配置量 (numpy / pandas 的配置也會被追蹤)，避免追蹤的額外負擔影響耗時。
+--no-memory 可略過第二次執行。
+
+結果附加寫入 data/benchmarks/pipeline_benchmark.csv (每個規模 x 階段一列)，
+以 --label 標記每次執行，方便比較各項最佳化前後的結果。
+
+用法 (在 src/ 目錄下執行)：
+    python bench_pipeline.py                          # s，10k / 100k / 1M
+    python bench_pipeline.py --rows 10000 100000 --prefix p --label baseline
+合成資料存於 ../data/synthetic/{rows}/，已存在時直接沿用。
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+import tracemalloc
+
+import pandas as pd
+
+from aggregate_cube import build_count_cube
+from labeled_store import labeled_csv_path, labeled_parquet_path, read_labeled_table, read_raw_codes
+from map_test import load_csv, load_json, map_all_values, rename_and_check_duplicates, save_columnar, save_csv
+from objective1 import (all_selected_cols_for_processing, categorical_feature_cols_all, grouping_col_name,
+                        numerical_feature_cols_all, preprocess_student_codes, preprocess_student_data)
+from synthetic_tigps import dataset_rows, generate_dataset
+
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000]
+RESULT_COLUMNS = ['run_at', 'label', 'prefix', 'students', 'rows', 'columns', 'stage', 'seconds',
+                  'rows_per_second', 'cells_per_second', 'peak_mb']
+
+
+def pipeline_stages(prefix, data_dir, map_dir):
+    """回傳 [(階段名稱, 函式)]；各函式接收並更新共用的 state dict"""
+    csv_path = os.path.join(data_dir, f'TIGPSw1_{prefix}.csv')
+    id_map_path = os.path.join(map_dir, f'tigps_w1_{prefix}_id_map.json')
+    value_map_path = os.path.join(map_dir, f'tigps_w1_{prefix}_value_maps.json')
+    output_path = labeled_csv_path(data_dir, prefix)
+    value_maps = load_json(value_map_path) or {}
+    id_map = load_json(id_map_path) or {}
+
+    def load(state):
+        state['raw'] = load_csv(csv_path)
+
+    def map_values(state):
+        state['mapped'] = map_all_values(state['raw'], value_maps.get('general_options', {}),
+                                         value_maps.get('value_maps', {}))
+
+    def rename(state):
+        state['labeled'] = rename_and_check_duplicates(state['mapped'], id_map)
+
+    def write_csv(state):
+        save_csv(state['labeled'], output_path)
+
+    def write_columnar(state):
+        save_columnar(state['labeled'], labeled_parquet_path(data_dir, prefix))
+
+    def preprocess_labels(state):
+        df_raw = read_labeled_table(output_path, columns=all_selected_cols_for_processing, as_category=False)
+        state['processed'], _ = preprocess_student_data(df_raw)
+
+    def preprocess_codes(state):
+        df_codes, column_maps = read_raw_codes(csv_path, id_map_path, value_map_path, all_selected_cols_for_processing)
+        state['processed'], _ = preprocess_student_codes(df_codes, column_maps)
+
+    def build_cube(state):
+        state['cube'] = build_count_cube(state['processed'], grouping_col_name, categorical_feature_cols_all,
+                                         numerical_feature_cols_all)
+
+    stages = [('load', load), ('map_all_values', map_values), ('rename', rename),
+              ('save_csv', write_csv), ('save_columnar', write_columnar)]
+    if prefix == 's':
+        stages += [('preprocess_labels', preprocess_labels), ('preprocess_codes', preprocess_codes),
+                   ('build_cube', build_cube)]
+    return stages
+
+def run_stages(stages, trace_memory=False):
+    """依序執行各階段 (隱藏各階段的輸出訊息)，回傳 ({階段: 秒數或尖峰 MB}, 最後的 state)"""
+    state = {}
+    measurements = {}
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        for name, stage in stages:
+            if trace_memory:
+                tracemalloc.reset_peak()
+                baseline, _ = tracemalloc.get_traced_memory()
+            start_time = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                stage(state)
+            elapsed = time.perf_counter() - start_time
+            if trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                measurements[name] = (peak - baseline) / 1e6
+            else:
+                measurements[name] = elapsed
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return measurements, state
+
+def benchmark(prefix, student_rows, map_dir, synthetic_root, measure_memory=True, label=''):
+    """量測單一規模的所有階段，回傳結果表"""
+    data_dir = os.path.join(synthetic_root, str(student_rows))
+    csv_path = os.path.join(data_dir, f'TIGPSw1_{prefix}.csv')
+    if not os.path.exists(csv_path):
+        print(f"產生合成資料 {csv_path} ...")
+        generate_dataset(prefix, student_rows, map_dir, data_dir)
+
+    stages = pipeline_stages(prefix, data_dir, map_dir)
+    seconds, state = run_stages(stages)
+    peaks = run_stages(stages, trace_memory=True)[0] if measure_memory else {}
+    rows = dataset_rows(prefix, student_rows)
+    columns = state['raw'].shape[1]
+    run_at = time.strftime('%Y-%m-%d %H:%M:%S')
+    return pd.DataFrame([{
+        'run_at': run_at, 'label': label, 'prefix': prefix, 'students': student_rows, 'rows': rows,
+        'columns': columns, 'stage': name, 'seconds': round(seconds[name], 4),
+        'rows_per_second': round(rows / seconds[name]) if seconds[name] else None,
+        'cells_per_second': round(rows * columns / seconds[name]) if seconds[name] else None,
+        'peak_mb': round(peaks[name], 1) if name in peaks else None,
+    } for name, _ in stages], columns=RESULT_COLUMNS)
+
+def append_results(results, output_path):
+    """附加寫入結果檔 (不存在時建立並寫出標題列)"""
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    results.to_csv(output_path, mode='a', header=not os.path.exists(output_path), index=False, encoding='utf-8')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="轉換流程與儀表板預處理的規模化效能基準")
+    parser.add_argument('--prefix', default='s', help="資料集前綴 (預設: s)")
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help="學生人數 (可指定多個規模)")
+    parser.add_argument('--label', default='', help="本次執行的標記 (例如最佳化名稱)")
+    parser.add_argument('--no-memory', action='store_true', help="不量測尖峰記憶體 (只執行一次)")
+    args = parser.parse_args()
+
+    data_dir = '../data/'
+    map_dir = '../maps/'
+    output_path = os.path.join(data_dir, 'benchmarks', 'pipeline_benchmark.csv')
+    for student_rows in args.rows:
+        results = benchmark(args.prefix, student_rows, map_dir, os.path.join(data_dir, 'synthetic'),
+                            measure_memory=not args.no_memory, label=args.label)
+        append_results(results, output_path)
+        print(f"\n資料集 {args.prefix}，{results['rows'].iloc[0]} 列 x {results['columns'].iloc[0]} 欄：")
+        print(results[['stage', 'seconds', 'rows_per_second', 'peak_mb']].to_string(index=False))
+    print(f"\n結果已附加至 {output_path}")
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+比較新舊值轉換引擎的效能，並確認兩者的輸出只有預期的差異。
+
+舊版引擎以 str(值) 查表，新版引擎以代碼字串 (value_mapping.code_strings) 查表，
+因此兩者只在「str(值) 與代碼字串不同」的格子上可能不同 (例如含空白而被讀成浮點數的 4.0：
+舊版為未對應的 '4.0'，新版對應到代碼 '4' 的標籤)；其他格子必須完全相同。
+
+用法 (於 src/ 目錄下執行)：
+    python bench_value_mapping.py            # 預設使用學生問卷 s
+    python bench_value_mapping.py --prefix p --repeat 3
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from map_test import DATA_DIR, MAP_DIR, load_csv, load_json, map_all_values, map_all_values_legacy
+from value_mapping import code_strings
+
+
+def time_engine(engine, df, general_options, specific_maps, repeat):
+    """執行 engine repeat 次，回傳 (最短耗時, 最後一次的輸出)；引擎本身的輸出訊息不顯示"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            result = engine(df, general_options, specific_maps)
+            elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def compare_outputs(raw_df, legacy_df, compiled_df):
+    """
+    比對兩個引擎的輸出，回傳 {欄位: 差異格數} (只含有差異的欄位)。
+    差異只允許出現在 str(值) 與代碼字串不同的格子上，否則引發 AssertionError。
+    """
+    pd.testing.assert_index_equal(legacy_df.columns, compiled_df.columns)
+    differences = {}
+    for column in raw_df.columns:
+        differs = legacy_df[column].to_numpy(dtype=object) != compiled_df[column].to_numpy(dtype=object)
+        if not differs.any():
+            continue
+        raw_values = raw_df[column].to_numpy()
+        key_changed = raw_df[column].astype(str).to_numpy(dtype=object) != code_strings(raw_values)
+        unexpected = np.flatnonzero(differs & ~key_changed)
+        if len(unexpected):
+            row = unexpected[0]
+            raise AssertionError(f"欄位 {column} 第 {row} 列的輸出不同 (原始值 {raw_values[row]!r}: "
+                                 f"舊版 {legacy_df[column].iloc[row]!r}，新版 {compiled_df[column].iloc[row]!r})")
+        differences[column] = int(differs.sum())
+    return differences
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="值轉換引擎效能比較")
+    parser.add_argument('--prefix', default='s', help="資料集前綴 (預設: s)")
+    parser.add_argument('--repeat', type=int, default=1, help="每個引擎重複執行次數，取最短耗時")
+    args = parser.parse_args()
+
+    csv_path = os.path.join(DATA_DIR, f'TIGPSw1_{args.prefix}.csv')
+    value_map_path = os.path.join(MAP_DIR, f'tigps_w1_{args.prefix}_value_maps.json')
+    raw_data_df = load_csv(csv_path)
+    loaded_value_maps = load_json(value_map_path) or {}
+    if raw_data_df is None:
+        raise SystemExit(f"無法載入 {csv_path}")
+    general_options = loaded_value_maps.get('general_options', {})
+    specific_value_maps = loaded_value_maps.get('value_maps', {})
+
+    legacy_time, legacy_df = time_engine(map_all_values_legacy, raw_data_df, general_options,
+                                         specific_value_maps, args.repeat)
+    compiled_time, compiled_df = time_engine(map_all_values, raw_data_df, general_options,
+                                             specific_value_maps, args.repeat)
+
+    differences = compare_outputs(raw_data_df, legacy_df, compiled_df)
+    print(f"\n資料集 {args.prefix}: {raw_data_df.shape[0]} 列 x {raw_data_df.shape[1]} 欄")
+    print(f"舊版 astype(str).replace 引擎: {legacy_time:.3f} 秒")
+    print(f"編譯式查表引擎:               {compiled_time:.3f} 秒")
+    print(f"加速倍數: {legacy_time / compiled_time:.1f}x")
+    if differences:
+        print(f"輸出差異: {len(differences)} 個欄位、{sum(differences.values())} 格，"
+              f"皆為代碼字串與 str(值) 不同的值 (例如浮點數欄位的 4.0 → '4')")
+    else:
+        print("兩者輸出完全相同")
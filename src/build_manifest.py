@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+轉換流程的增量建置紀錄 (build manifest)。
+
+每個資料集在 data/manifests/TIGPSw1_{prefix}.manifest.json 記錄：
+- 輸入檔 (原始 CSV、id_map、value map) 與輸出檔 (標註 CSV、parquet) 的內容雜湊
+- 每個原始欄位所用 value map (general + 特定) 的指紋
+- 建置設定 (settings)：值轉換規則的版本 (value_mapping.VALUE_RULE) 與讀取模式 (一般 / 串流)
+
+map_test.process_dataset 依此判斷：
+- 'up_to_date'：輸入與輸出都沒變，直接略過
+- 'remap_columns'：只有部分欄位的 value map 改變，只重新轉換這些欄位
+- 'rebuild'：其他情況 (第一次建置、原始 CSV 或 id_map 改變、輸出被修改或刪除、建置設定改變…)
+
+每個資料集各自一個紀錄檔，平行處理時不會互相覆寫。
+檔案大小與修改時間都沒變時沿用上次的雜湊，不必重新讀取整個檔案。
+"""
+import hashlib
+import json
+import os
+import time
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def manifest_path_for(data_dir, prefix):
+    return os.path.join(data_dir, 'manifests', f'TIGPSw1_{prefix}.manifest.json')
+
+def load_manifest(filepath):
+    """讀取建置紀錄；不存在或無法解析時回傳 None (視為需要完整建置)"""
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def save_manifest(filepath, manifest):
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    temp_path = filepath + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, filepath) # 寫完才取代，避免中斷時留下半個檔案
+
+
+def file_fingerprint(filepath, previous=None):
+    """
+    回傳檔案的 {size, mtime_ns, sha256}；檔案不存在時回傳 None。
+    若 previous 的大小與修改時間和目前相同，沿用其 sha256 而不重新計算。
+    """
+    if not os.path.exists(filepath):
+        return None
+    stat = os.stat(filepath)
+    if previous and previous.get('size') == stat.st_size and previous.get('mtime_ns') == stat.st_mtime_ns:
+        return dict(previous)
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+
+def _same_content(current, previous):
+    if current is None or previous is None:
+        return current is None and previous is None
+    return current['sha256'] == previous['sha256']
+
+def source_fingerprints(source_paths, previous=None):
+    """多個來源檔的指紋 {路徑: file_fingerprint}；previous 為上次的結果，用來沿用未變動檔案的雜湊"""
+    previous = previous or {}
+    return {path: file_fingerprint(path, previous.get(path)) for path in source_paths}
+
+def same_sources(current, previous):
+    """兩次 source_fingerprints 的結果是否包含相同的檔案且內容都沒變"""
+    previous = previous or {}
+    if set(current) != set(previous):
+        return False
+    return all(_same_content(current[path], previous[path]) for path in current)
+
+
+def column_map_fingerprints(general_options, specific_maps):
+    """
+    每個有特定 value map 的欄位對應一個指紋 (general + 特定對應表內容的雜湊)；
+    '*' 為只使用 general_options 的欄位所共用的指紋。
+    """
+    general = {str(k): str(v) for k, v in (general_options or {}).items()}
+
+    def fingerprint(mapping):
+        payload = json.dumps(sorted(mapping.items()), ensure_ascii=False)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    fingerprints = {'*': fingerprint(general)}
+    for column, specific_map in (specific_maps or {}).items():
+        if isinstance(specific_map, dict) and specific_map:
+            combined = dict(general)
+            combined.update({str(k): str(v) for k, v in specific_map.items()})
+            fingerprints[str(column)] = fingerprint(combined)
+    return fingerprints
+
+def changed_columns(current_fingerprints, previous_fingerprints, raw_columns):
+    """比較兩次建置的欄位指紋，回傳 value map 有改變的原始欄位代碼 (依 raw_columns 順序)"""
+    changed = []
+    for column in raw_columns:
+        current = current_fingerprints.get(column, current_fingerprints['*'])
+        previous = previous_fingerprints.get(column, previous_fingerprints.get('*'))
+        if current != previous:
+            changed.append(column)
+    return changed
+
+
+def check_build_status(manifest, input_paths, output_paths, column_fingerprints, settings=None):
+    """
+    判斷資料集是否需要重建。
+    input_paths / output_paths: {'raw_csv': ..., 'id_map': ..., 'value_map': ...} / {'csv': ..., 'parquet': ...}
+    settings: 本次的建置設定 (例如 {'value_rule': ..., 'read_mode': ...})，與紀錄不同時需要完整重建。
+    回傳 (status, detail)：status 為 'up_to_date'、'remap_columns' 或 'rebuild'；
+    detail 在 'rebuild' 時為原因說明，在 'remap_columns' 時為需重新轉換的原始欄位代碼列表。
+    """
+    if manifest is None:
+        return 'rebuild', "沒有先前的建置紀錄"
+    if (settings or {}) != manifest.get('settings', {}):
+        return 'rebuild', f"建置設定改變 ({manifest.get('settings', {})} -> {settings or {}})"
+
+    previous_outputs = manifest.get('outputs', {})
+    for name, path in output_paths.items():
+        current = file_fingerprint(path, previous_outputs.get(name))
+        if not _same_content(current, previous_outputs.get(name)):
+            return 'rebuild', f"輸出檔 {path} 不存在或已被修改"
+
+    previous_inputs = manifest.get('inputs', {})
+    for name in ('raw_csv', 'id_map'):
+        current = file_fingerprint(input_paths[name], previous_inputs.get(name))
+        if not _same_content(current, previous_inputs.get(name)):
+            return 'rebuild', f"輸入檔 {input_paths[name]} 已改變"
+
+    current = file_fingerprint(input_paths['value_map'], previous_inputs.get('value_map'))
+    if _same_content(current, previous_inputs.get('value_map')):
+        return 'up_to_date', None
+
+    previous_fingerprints = manifest.get('column_maps')
+    if not previous_fingerprints:
+        return 'rebuild', "建置紀錄缺少欄位層級的對應表指紋"
+    return 'remap_columns', changed_columns(column_fingerprints, previous_fingerprints,
+                                            manifest.get('raw_columns', []))
+
+
+def record_build(manifest_path, input_paths, output_paths, column_fingerprints, raw_columns, previous=None,
+                 settings=None):
+    """建置成功後寫入新的建置紀錄 (settings 為本次的建置設定，見 check_build_status)"""
+    previous = previous or {}
+    previous_inputs = previous.get('inputs', {})
+    previous_outputs = previous.get('outputs', {})
+    manifest = {
+        'built_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'inputs': {name: file_fingerprint(path, previous_inputs.get(name)) for name, path in input_paths.items()},
+        'outputs': {name: file_fingerprint(path) for name, path in output_paths.items()},
+        'raw_columns': [str(col) for col in raw_columns],
+        'column_maps': column_fingerprints,
+        'settings': settings or {},
+    }
+    save_manifest(manifest_path, manifest)
+    return manifest
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+標註資料集的精簡型別層與記憶體報告。
+
+map_all_values 的輸出與 pd.read_csv(..., low_memory=False) 讀回的標註檔，
+標籤欄位都是存放 Python str 的 object 欄位，每一格都是獨立的字串物件。
+本模組將整份資料轉為精簡的型別：
+
+- 標籤欄位轉為 categorical，選項順序取自 value map：
+  實質選項 (非負代碼) 依代碼遞增，接著是遺漏原因 (general_options 的負數代碼，依 -4、-5 … -999)；
+  遺漏原因因此與一般選項一樣只佔一個小整數代碼，不再重複存放字串。
+  資料中出現、但 value map 沒有的值 (未對應的原始值) 接在最後。
+- 數值欄位 (時數、年份、ID 等) 縮小為能無損表示所有值的最小整數 / 浮點數型別。
+
+categorical 為無序 (ordered=False)：選項順序只決定 categories 的排列，
+各分析仍依自己的需求設定有序的 CategoricalDtype。
+
+用法 (在 src/ 目錄下執行):
+    python compact_dtypes.py [資料集前綴 ...]      (預設為 s p f t st sc)
+對每個資料集比較 read_csv 讀回的 object 欄位與精簡型別的記憶體用量，
+寫出 data/reports/TIGPSw1_{prefix}_memory.csv (每個欄位一列)。
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from labeled_store import labeled_csv_path, read_labeled_table
+from map_registry import load_map_json
+from value_mapping import code_table
+
+MEMORY_REPORT_COLUMNS = ['column', 'dtype_before', 'dtype_after', 'bytes_before', 'bytes_after']
+
+
+# --- 選項順序 ---
+def label_order(combined_map):
+    """單一欄位 (general + 特定組合後) 的選項順序：實質選項依代碼遞增，接著遺漏原因 (負代碼由 -1 往下)"""
+    codes, labels = code_table(combined_map)
+    substantive = labels[codes >= 0]
+    reasons = labels[codes < 0][::-1]
+    return list(dict.fromkeys(list(substantive) + list(reasons))) # 同一標籤對應多個代碼時只保留第一次
+
+def label_orders(id_map, value_maps):
+    """
+    {說明文字: 選項順序}，只包含有特定 value map 的欄位。
+    value_maps 為 {'general_options': ..., 'value_maps': ...} (與 value map JSON 相同)。
+    """
+    general_options = value_maps.get('general_options', {}) or {}
+    orders = {}
+    for variable, specific_map in (value_maps.get('value_maps', {}) or {}).items():
+        if isinstance(specific_map, dict) and specific_map:
+            orders[id_map.get(variable, variable)] = label_order({**general_options, **specific_map})
+    return orders
+
+def dataset_label_orders(map_dir, prefix):
+    """資料集所有欄位的選項順序 (讀取 tigps_w1_{prefix}_id_map.json 與 value_maps.json)"""
+    id_map = load_map_json(os.path.join(map_dir, f'tigps_w1_{prefix}_id_map.json'))
+    value_maps = load_map_json(os.path.join(map_dir, f'tigps_w1_{prefix}_value_maps.json'))
+    return label_orders(id_map, value_maps)
+
+
+# --- 型別轉換 ---
+def _compact_numeric(series):
+    """縮小數值欄位的型別；只在所有值都能無損表示時才縮小"""
+    values = series.to_numpy()
+    if series.dtype.kind in 'iu':
+        return pd.to_numeric(series, downcast='integer')
+    if series.dtype.kind != 'f':
+        return series
+    if not series.isna().any() and np.array_equal(values, np.round(values)):
+        return pd.to_numeric(series.astype(np.int64), downcast='integer')
+    float32_values = values.astype(np.float32)
+    if np.array_equal(float32_values.astype(values.dtype), values, equal_nan=True):
+        return pd.Series(float32_values, index=series.index, name=series.name)
+    return series
+
+def _compact_labels(series, order=None):
+    """標籤欄位轉為 categorical；categories 依 order 排列，其餘出現過的值接在最後"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        observed = list(series.cat.categories)
+        series = series.astype(object)
+    else:
+        observed = list(pd.unique(series.dropna()))
+    order = list(order or [])
+    known = set(order)
+    extra = sorted((value for value in observed if value not in known), key=str)
+    return series.astype(pd.CategoricalDtype(categories=order + extra, ordered=False))
+
+def compact_frame(df, orders=None):
+    """
+    回傳精簡型別的 DataFrame (內容與 df 相同)。
+    orders 為 {欄位名稱: 選項順序} (見 label_orders)；沒有順序的 object 欄位依值排序。
+    全為數值的 object 欄位 (例如讀成字串的時數) 先轉為數值再縮小。
+    """
+    orders = orders or {}
+    compact_columns = {}
+    for column in df.columns:
+        series = df[column]
+        if series.dtype == object:
+            numeric = pd.to_numeric(series, errors='coerce')
+            if numeric.notna().sum() == series.notna().sum() and column not in orders:
+                series = numeric
+        if series.dtype == object or isinstance(series.dtype, pd.CategoricalDtype):
+            compact_columns[column] = _compact_labels(series, orders.get(column))
+        else:
+            compact_columns[column] = _compact_numeric(series)
+    compact_df = pd.DataFrame(compact_columns, index=df.index)
+    compact_df.columns = df.columns
+    return compact_df
+
+def read_compact_table(data_dir, map_dir, prefix, columns=None):
+    """讀取標註資料集 (只載入 columns 指定的欄位) 並轉為精簡型別"""
+    df = read_labeled_table(labeled_csv_path(data_dir, prefix), columns=columns)
+    return compact_frame(df, dataset_label_orders(map_dir, prefix))
+
+
+# --- 記憶體報告 ---
+def memory_report(before, after):
+    """每個欄位轉換前後的型別與記憶體用量 (bytes，含字串物件本身)"""
+    bytes_before = before.memory_usage(index=False, deep=True)
+    bytes_after = after.memory_usage(index=False, deep=True)
+    return pd.DataFrame({
+        'column': before.columns,
+        'dtype_before': [str(dtype) for dtype in before.dtypes],
+        'dtype_after': [str(dtype) for dtype in after.dtypes],
+        'bytes_before': bytes_before.to_numpy(),
+        'bytes_after': bytes_after.to_numpy(),
+    }, columns=MEMORY_REPORT_COLUMNS)
+
+def memory_report_path(data_dir, prefix):
+    return os.path.join(data_dir, 'reports', f'TIGPSw1_{prefix}_memory.csv')
+
+def write_memory_report(report, data_dir, prefix):
+    """寫出記憶體報告並印出摘要，回傳報告路徑"""
+    report_path = memory_report_path(data_dir, prefix)
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    report.to_csv(report_path, index=False, encoding='utf-8-sig')
+    total_before = report['bytes_before'].sum()
+    total_after = report['bytes_after'].sum()
+    ratio = total_before / total_after if total_after else float('nan')
+    print(f"資料集 {prefix}: {len(report)} 個欄位，記憶體 {total_before / 1e6:.1f} MB -> {total_after / 1e6:.1f} MB "
+          f"(縮小為 1/{ratio:.1f})")
+    print(f"已寫出: {report_path}")
+    return report_path
+
+
+if __name__ == "__main__":
+    prefixes = sys.argv[1:] or ['s', 'p', 'f', 't', 'st', 'sc']
+    data_dir = '../data/'
+    map_dir = '../maps/'
+    for prefix in prefixes:
+        csv_path = labeled_csv_path(data_dir, prefix)
+        if not os.path.exists(csv_path):
+            print(f"略過資料集 {prefix}：找不到 {csv_path}")
+            continue
+        start_time = time.time()
+        original_df = pd.read_csv(csv_path, low_memory=False) # 與各分析筆記本讀入的型別相同
+        compact_df = compact_frame(original_df, dataset_label_orders(map_dir, prefix))
+        write_memory_report(memory_report(original_df, compact_df), data_dir, prefix)
+        print(f"耗時 {time.time() - start_time:.2f} 秒")
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+稀疏列聯表的置換檢定 (Monte Carlo) 與精確檢定。
+
+卡方檢定的 p-value 需要足夠大的期望頻率 (Cochran 準則：期望頻率皆 >= 1，且小於 5 的格子不超過 20%)。
+「沒有這項設備」、「我落後很多」等選項人數很少時經常不符合，此時改用：
+
+- 2x2 表：Fisher 精確檢定 (scipy.stats.fisher_exact)。
+- 其他：固定列 / 欄邊際的置換檢定。在獨立假設下，隨機打亂分群與選項的配對等同於
+  由「邊際固定的列聯表」的條件分佈 (多變量超幾何分佈) 抽樣。每張表依序以超幾何分佈抽出每一格：
+      第 (i, j) 格 ~ Hypergeometric(欄 j 剩餘人數, 欄 j 之後剩餘人數, 列 i 剩餘人數)
+  numpy 的 hypergeometric 可對整批表同時抽樣，每批只需 (列數 - 1) x (欄數 - 1) 次向量化呼叫，
+  耗時與樣本數無關。p-value 為 (1 + 卡方統計量不小於觀察值的表數) / (1 + 抽樣表數)。
+
+每批使用由 SeedSequence(seed).spawn 產生的獨立亂數，結果只與 seed、抽樣數與批次大小有關，
+與是否使用多個行程 (max_workers) 無關。
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.stats as stats
+
+DEFAULT_RESAMPLES = 10_000
+DEFAULT_SEED = 20240601
+BATCH_SIZE = 5_000
+TIE_TOLERANCE = 1e-7 # 與觀察值相差在此比例內的統計量視為相同 (浮點誤差)
+
+
+def _drop_empty_margins(table):
+    """移除總和為 0 的列與欄 (期望頻率為 0，不影響檢定)"""
+    table = np.asarray(table, dtype=np.int64)
+    return table[table.sum(axis=1) > 0][:, table.sum(axis=0) > 0]
+
+def expected_frequencies(table):
+    """獨立假設下的期望頻率 (列總和 x 欄總和 / 總數)"""
+    table = np.asarray(table, dtype=float)
+    return np.outer(table.sum(axis=1), table.sum(axis=0)) / table.sum()
+
+def cochran_rule_fails(expected_freq):
+    """期望頻率有小於 1 的格子，或超過 20% 的格子小於 5 時，卡方近似不可靠"""
+    expected_freq = np.asarray(expected_freq)
+    return bool(expected_freq.min() < 1 or (expected_freq < 5).sum() / expected_freq.size > 0.2)
+
+def chi2_statistics(tables, expected_freq):
+    """一批列聯表 (..., 列, 欄) 的 Pearson 卡方統計量"""
+    return (((tables - expected_freq) ** 2) / expected_freq).sum(axis=(-2, -1))
+
+def random_tables(row_totals, col_totals, size, rng):
+    """由邊際固定的列聯表條件分佈 (多變量超幾何) 抽出 size 張表，回傳 (size, 列, 欄) 的 int64 陣列"""
+    row_totals = np.asarray(row_totals, dtype=np.int64)
+    col_totals = np.asarray(col_totals, dtype=np.int64)
+    tables = np.zeros((size, len(row_totals), len(col_totals)), dtype=np.int64)
+    remaining_cols = np.tile(col_totals, (size, 1))
+    for i, row_total in enumerate(row_totals[:-1]):
+        left_in_row = np.full(size, row_total, dtype=np.int64)
+        remaining_after = remaining_cols.sum(axis=1)
+        for j in range(len(col_totals) - 1):
+            remaining_after = remaining_after - remaining_cols[:, j]
+            cell = rng.hypergeometric(remaining_cols[:, j], remaining_after, left_in_row)
+            tables[:, i, j] = cell
+            left_in_row -= cell
+        tables[:, i, -1] = left_in_row
+        remaining_cols -= tables[:, i, :]
+    tables[:, -1, :] = remaining_cols # 最後一列為剩餘的人數
+    return tables
+
+def _count_extreme(row_totals, col_totals, expected_freq, threshold, size, seed_sequence):
+    """抽出一批表，回傳卡方統計量不小於 threshold 的表數"""
+    rng = np.random.default_rng(seed_sequence)
+    tables = random_tables(row_totals, col_totals, size, rng)
+    return int((chi2_statistics(tables, expected_freq) >= threshold).sum())
+
+def monte_carlo_chi2(table, n_resamples=DEFAULT_RESAMPLES, seed=DEFAULT_SEED, batch_size=BATCH_SIZE, max_workers=1):
+    """
+    固定邊際的置換 (Monte Carlo) 卡方檢定，回傳 (卡方統計量, p-value, 自由度)。
+    max_workers > 1 時各批分散到行程池計算 (結果與依序計算相同)。
+    """
+    table = _drop_empty_margins(table)
+    dof = (table.shape[0] - 1) * (table.shape[1] - 1)
+    if dof == 0:
+        return 0.0, 1.0, 0
+    expected_freq = expected_frequencies(table)
+    observed = float(chi2_statistics(table, expected_freq))
+    threshold = observed * (1 - TIE_TOLERANCE)
+    row_totals, col_totals = table.sum(axis=1), table.sum(axis=0)
+
+    batch_sizes = [batch_size] * (n_resamples // batch_size)
+    if n_resamples % batch_size:
+        batch_sizes.append(n_resamples % batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+    if max_workers == 1 or len(batch_sizes) == 1:
+        extreme = sum(_count_extreme(row_totals, col_totals, expected_freq, threshold, size, seed_sequence)
+                      for size, seed_sequence in zip(batch_sizes, seeds))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            extreme = sum(executor.map(_count_extreme, *zip(*[(row_totals, col_totals, expected_freq, threshold,
+                                                                size, seed_sequence)
+                                                               for size, seed_sequence in zip(batch_sizes, seeds)])))
+    return observed, (1 + extreme) / (1 + n_resamples), dof
+
+def sparse_table_test(table, n_resamples=DEFAULT_RESAMPLES, seed=DEFAULT_SEED, max_workers=1):
+    """
+    期望頻率不足時的替代檢定：2x2 表為 Fisher 精確檢定，其他為置換卡方檢定。
+    回傳 (檢定名稱, p-value)。
+    """
+    table = _drop_empty_margins(table)
+    if table.shape == (2, 2):
+        return "Fisher 精確檢定", float(stats.fisher_exact(table)[1])
+    _, p_value, _ = monte_carlo_chi2(table, n_resamples, seed, max_workers=max_workers)
+    return f"置換檢定 (固定邊際，{n_resamples} 次抽樣)", p_value
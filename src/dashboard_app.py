@@ -1,149 +1,190 @@
 # src/dashboard_app.py
 
 import streamlit as st
-import pandas as pd
-import numpy as np
 import matplotlib.pyplot as plt
-import seaborn as sns
-import scipy.stats as stats
 import os
 
-# --- 0. 基本設定與中文字體 ---
-try:
-    # 嘗試設定多種常見中文字體，增加通用性
-    plt.rcParams['font.sans-serif'] = [
-        'Microsoft JhengHei', 'Arial Unicode MS', 'Microsoft YaHei', 
-        'SimHei', 'PingFang HK', 'Heiti TC', 'sans-serif'
-    ]
-    plt.rcParams['axes.unicode_minus'] = False
-    # st.sidebar.success("已嘗試設定Matplotlib中文字體。") # 稍後在主應用中顯示
-except Exception as e:
-    # st.sidebar.error(f"設定Matplotlib中文字體時發生錯誤: {e}") # 稍後在主應用中顯示
-    pass
+# 欄位、選項順序與預處理定義在 objective1.py (與 cube 的預先計算共用)
+from labeled_store import columnar_path_for, read_labeled_table, read_raw_codes
+from objective1 import (
+    grouping_col_name, numerical_feature_cols_all, categorical_feature_cols_all,
+    all_selected_cols_for_processing, analysis_config_key, preprocess_student_data, preprocess_student_codes,
+)
+from aggregate_cube import build_count_cube, load_cube, save_cube, cube_version_of
+from figure_cache import cached_png, figure_key
+# 圖表、表格與檢定文字定義在 objective1_views.py (與靜態報告 report_export.py 共用；匯入時一併設定中文字體)
+from objective1_views import (
+    draw_numeric_boxplot, draw_category_barplot, category_palette, ordered_category_table,
+    numeric_section, chi2_test_lines,
+)
+from subgroup_index import FILTER_COLUMNS, BitmapIndex, load_filter_frame
+from shared_snapshot import attach_snapshot, publish_snapshot
 
 # --- 檔案路徑定義 (相對於專案根目錄 tigps_analysis/) ---
 # 假設您是從 tigps_analysis/ 目錄下執行 streamlit run src/dashboard_app.py
 RAW_STUDENT_DATA_PATH = 'data/TIGPSw1_s_descriptive_labeled.csv'
-
-# --- 常量與順序定義 (從分析腳本複製過來) ---
-grouping_col_name = "你上學期的平均成績大約如何?"
-
-# 數值型特徵列表
-numerical_feature_cols_all = [
-    "完成學校功課(查找完成作業需要的資料)",  # as35a
-    "課外的學習(各種線上付費或免費的課程)"   # as35b
-]
-# 類別型特徵列表
-categorical_feature_cols_all = [
-    "電腦(含桌機或筆電)",                         # as56a
-    "智慧型手機",                                 # as56b
-    "平板或電子書閱讀器(iPad, Kindle...)",        # as56d
-    "讀書或寫作業時,我會先將無關的網站、即時通訊、手機APP或提醒聲音關掉", # as59a
-    "我能要求自己先完成作業或讀書進度後,才能去看我喜歡的網站或玩手機。",       # as59b
-    "我會運用學習平台上的儀表板,了解自己的認真或表現情況(...)",             # as59c
-    "我會運用學習平台以外的軟體(如:Google日曆、Forrest、Notion、Anki等),安排我的學習進度。", # as59d
-    "我喜歡學校。",                                 # as14a
-    "你跟得上學校課業進度嗎?"                       # as19
-]
-
-all_selected_cols_for_processing = [grouping_col_name] + numerical_feature_cols_all + categorical_feature_cols_all
-
-# 順序定義
-grade_order = ['全班五名以內', '全班六至十名', '全班十一至二十名', '全班二十一至三十名', '全班三十名以後']
-time_mapping = { "沒有": 0.0, "0.5小時以內": 0.25, "0.5-1小時": 0.75, "1-1.5小時": 1.25, "1.5-2小時": 1.75, "2-2.5小時": 2.25, "2.5-3小時": 2.75, "3-3.5小時": 3.25, "3.5-4小時": 3.75, "4-4.5小時": 4.25, "4.5-5小時": 4.75, "5小時以上": 5.5 }
-values_to_replace_time = ["此卷未答", "跳答", "系統遺漏值"]
-comp_freq_order = ['幾乎每天', '每週三四次', '每週一兩次', '每月三四次', '每月一兩次', '一年幾次', '幾乎沒有', '沒有這項設備']
-values_to_replace_freq = ["此卷未答", "系統遺漏值"]
-agreement_order_s59 = ['很符合', '符合', '不符合', '很不符合']
-values_to_replace_manage = ["系統遺漏值", "此卷未答"] # 通用遺失值
-agreement_order_s14a = ['很同意', '同意', '不同意', '很不同意']
-progress_order_s19 = ['我的進度超前', '大部分都跟得上', '只落後一點點,很快就跟上了', '我有點落後,可能跟得上', '我落後很多,很難跟得上']
-
-category_orders_map = {
-    "電腦(含桌機或筆電)": comp_freq_order, "智慧型手機": comp_freq_order, "平板或電子書閱讀器(iPad, Kindle...)": comp_freq_order,
-    "讀書或寫作業時,我會先將無關的網站、即時通訊、手機APP或提醒聲音關掉": agreement_order_s59,
-    "我能要求自己先完成作業或讀書進度後,才能去看我喜歡的網站或玩手機。": agreement_order_s59,
-    "我會運用學習平台上的儀表板,了解自己的認真或表現情況(...)": agreement_order_s59,
-    "我會運用學習平台以外的軟體(如:Google日曆、Forrest、Notion、Anki等),安排我的學習進度。": agreement_order_s59,
-    "我喜歡學校。": agreement_order_s14a, "你跟得上學校課業進度嗎?": progress_order_s19
-}
-palettes_for_categorical = ["muted", "pastel", "deep", "colorblind", "bright", "tab10"] # Corrected here
+# 原始代碼 CSV 與對應表：直接由整數代碼預處理 (不經過標籤字串)，標註檔不存在時也使用
+RAW_STUDENT_CODES_PATH = 'data/TIGPSw1_s.csv'
+STUDENT_ID_MAP_PATH = 'maps/tigps_w1_s_id_map.json'
+STUDENT_VALUE_MAP_PATH = 'maps/tigps_w1_s_value_maps.json'
+DATA_DIR = 'data'
+MAP_DIR = 'maps'
+# 原始代碼 CSV 存在時優先由代碼預處理；False 則優先讀取標註檔 (兩種預處理的結果相同，見 objective1.py)
+PREPROCESS_FROM_CODES = True
+
+# 預先聚合的次數 cube 存放位置 (資料或分析定義改變時自動重建)
+CUBE_DIR = 'data/cubes'
+CUBE_NAME = 'objective1_s'
+# 預處理後學生資料的共用唯讀快照 (Arrow IPC，以 memory map 讀取；所有 session 與 worker 程序共用)
+SNAPSHOT_DIR = 'data/snapshots'
+SNAPSHOT_NAME = 'objective1_s'
 
 
 # --- 1. 數據載入與預處理函數 ---
-@st.cache_data # Streamlit 快取機制，加速數據載入和預處理
+def uses_raw_codes(raw_file_path):
+    """是否由原始代碼預處理：啟用代碼模式且原始代碼 CSV 存在，或標註檔不存在時"""
+    labeled_exists = os.path.exists(raw_file_path) or os.path.exists(columnar_path_for(raw_file_path))
+    return (PREPROCESS_FROM_CODES and os.path.exists(RAW_STUDENT_CODES_PATH)) or not labeled_exists
+
 def load_and_preprocess_data(raw_file_path):
+    # 只讀取分析需要的欄位 (all_selected_cols_for_processing)，不解析整份約 764 欄的檔案
     try:
-        df_raw = pd.read_csv(raw_file_path, low_memory=False)
-        st.sidebar.success(f"成功從 {raw_file_path} 載入原始數據。")
+        if uses_raw_codes(raw_file_path):
+            df_codes, column_maps = read_raw_codes(RAW_STUDENT_CODES_PATH, STUDENT_ID_MAP_PATH, STUDENT_VALUE_MAP_PATH,
+                                                   all_selected_cols_for_processing)
+            st.sidebar.success(f"成功從 {RAW_STUDENT_CODES_PATH} 讀取 {df_codes.shape[1]} 個所需欄位的原始代碼。")
+            st.sidebar.info("正在由原始代碼進行數據預處理...")
+            df_processed, missing_cols_in_raw = preprocess_student_codes(df_codes, column_maps)
+        else:
+            df_raw = read_labeled_table(raw_file_path, columns=all_selected_cols_for_processing, as_category=False)
+            st.sidebar.success(f"成功從 {raw_file_path} 載入原始數據 ({df_raw.shape[1]} 個所需欄位)。")
+            st.sidebar.info("正在進行數據預處理...")
+            df_processed, missing_cols_in_raw = preprocess_student_data(df_raw)
     except FileNotFoundError:
-        st.error(f"錯誤：找不到原始數據檔案 {raw_file_path}。請確保檔案路徑正確。")
+        st.error(f"錯誤：找不到原始數據檔案 {raw_file_path} 或 {RAW_STUDENT_CODES_PATH}。請確保檔案路徑正確。")
         return None
 
-    st.sidebar.info("正在進行數據預處理...")
-    # 確保只選取我們定義好的欄位，避免潛在的额外欄位問題
-    cols_to_select_initially = [col for col in all_selected_cols_for_processing if col in df_raw.columns]
-    if len(cols_to_select_initially) != len(all_selected_cols_for_processing):
+    if missing_cols_in_raw:
         st.sidebar.warning("部分定義的欄位在原始數據中缺失，將只處理存在的欄位。")
-        missing_cols_in_raw = [col for col in all_selected_cols_for_processing if col not in df_raw.columns]
         st.sidebar.json({"定義的欄位但原始數據中缺失": missing_cols_in_raw})
-
-
-    df_processed = df_raw[cols_to_select_initially].copy()
-
-    # A. 處理分群變項
-    if grouping_col_name in df_processed.columns:
-        df_processed[grouping_col_name] = df_processed[grouping_col_name].replace(["系統遺漏值", "此卷未答", "我不知道"], np.nan)
-        grade_dtype = pd.CategoricalDtype(categories=grade_order, ordered=True)
-        df_processed[grouping_col_name] = df_processed[grouping_col_name].astype(grade_dtype)
-
-    # B. 處理時間型數值特徵
-    for col in numerical_feature_cols_all:
-        if col in df_processed.columns:
-            df_processed[col] = df_processed[col].replace(values_to_replace_time, np.nan)
-            mapped_col = df_processed[col].map(time_mapping)
-            # combine_first 用於保留那些不在 mapping 中的值 (例如已經是 NaN 的)
-            df_processed[col] = mapped_col.combine_first(df_processed[col])
-            df_processed[col] = pd.to_numeric(df_processed[col], errors='coerce')
-
-    # C. 處理設備使用頻率類別特徵
-    freq_cols_to_process = ["電腦(含桌機或筆電)", "智慧型手機", "平板或電子書閱讀器(iPad, Kindle...)"]
-    for col in freq_cols_to_process:
-        if col in df_processed.columns:
-            df_processed[col] = df_processed[col].replace(values_to_replace_freq, np.nan)
-            comp_freq_dtype = pd.CategoricalDtype(categories=comp_freq_order, ordered=True)
-            df_processed[col] = df_processed[col].astype(comp_freq_dtype)
-    
-    # D. 處理線上學習自我管理類別特徵 (as59系列)
-    s59_cols_to_process = [
-        "讀書或寫作業時,我會先將無關的網站、即時通訊、手機APP或提醒聲音關掉",
-        "我能要求自己先完成作業或讀書進度後,才能去看我喜歡的網站或玩手機。",
-        "我會運用學習平台上的儀表板,了解自己的認真或表現情況(...)",
-        "我會運用學習平台以外的軟體(如:Google日曆、Forrest、Notion、Anki等),安排我的學習進度。"
-    ]
-    for col in s59_cols_to_process:
-         if col in df_processed.columns:
-            df_processed[col] = df_processed[col].replace(values_to_replace_manage, np.nan)
-            agreement_dtype_s59 = pd.CategoricalDtype(categories=agreement_order_s59, ordered=True)
-            df_processed[col] = df_processed[col].astype(agreement_dtype_s59)
-
-    # E. 處理 "我喜歡學校。" (as14a)
-    col_as14a = "我喜歡學校。"
-    if col_as14a in df_processed.columns:
-        df_processed[col_as14a] = df_processed[col_as14a].replace(values_to_replace_manage, np.nan)
-        agreement_dtype_s14a = pd.CategoricalDtype(categories=agreement_order_s14a, ordered=True)
-        df_processed[col_as14a] = df_processed[col_as14a].astype(agreement_dtype_s14a)
-
-    # F. 處理 "你跟得上學校課業進度嗎?" (as19)
-    col_as19 = "你跟得上學校課業進度嗎?"
-    if col_as19 in df_processed.columns:
-        df_processed[col_as19] = df_processed[col_as19].replace(values_to_replace_manage, np.nan)
-        progress_dtype_s19 = pd.CategoricalDtype(categories=progress_order_s19, ordered=True)
-        df_processed[col_as19] = df_processed[col_as19].astype(progress_dtype_s19)
-    
     st.sidebar.success("數據預處理完畢。")
     return df_processed
 
+def cube_source_paths(raw_file_path):
+    """cube 所依據的來源檔 (由代碼預處理時為原始代碼 CSV 與對應表，否則為標註檔)"""
+    if uses_raw_codes(raw_file_path):
+        return [RAW_STUDENT_CODES_PATH, STUDENT_ID_MAP_PATH, STUDENT_VALUE_MAP_PATH]
+    return [path for path in (raw_file_path, columnar_path_for(raw_file_path)) if os.path.exists(path)]
+
+@st.cache_resource(show_spinner="正在載入共用的學生資料快照...") # 同一程序內共用一個唯讀的 DataFrame，不為每個 session 複製
+def load_student_frame(raw_file_path, cache_key):
+    """
+    預處理後的學生資料 (唯讀，見 shared_snapshot.py)；無法載入資料時為 None。
+    快照仍有效時直接以 memory map 讀取，否則預處理後發布新的快照。
+    """
+    source_paths = cube_source_paths(raw_file_path)
+    df_processed = attach_snapshot(SNAPSHOT_DIR, SNAPSHOT_NAME, source_paths, analysis_config_key())
+    if df_processed is not None:
+        st.sidebar.success(f"已載入共用的學生資料快照 ({len(df_processed)} 列)。")
+        return df_processed
+
+    df_processed = load_and_preprocess_data(raw_file_path)
+    if df_processed is None:
+        return None
+    try:
+        snapshot_path = publish_snapshot(df_processed, SNAPSHOT_DIR, SNAPSHOT_NAME, source_paths,
+                                         analysis_config_key())
+        if snapshot_path is not None:
+            st.sidebar.info(f"已發布學生資料快照 {snapshot_path}。")
+            # 改用快照中的唯讀資料，本程序不再另外持有預處理時的複本
+            df_shared = attach_snapshot(SNAPSHOT_DIR, SNAPSHOT_NAME, source_paths, analysis_config_key())
+            if df_shared is not None:
+                df_processed = df_shared
+    except OSError as e:
+        st.sidebar.warning(f"無法儲存學生資料快照 ({e})，本次僅在記憶體中使用。")
+    return df_processed
+
+@st.cache_data # Streamlit 快取機制；來源檔或分析定義改變時 cache_key 不同，會重新載入
+def load_analysis_cube(raw_file_path, cache_key):
+    """
+    載入預先聚合的次數 cube；cube 不存在或已過期時才讀取並預處理資料、重建 cube。
+    回傳 cube (無法載入資料時為 None)。
+    """
+    source_paths = cube_source_paths(raw_file_path)
+    cube = load_cube(CUBE_DIR, CUBE_NAME, source_paths, analysis_config_key())
+    if cube is not None:
+        st.sidebar.success(f"已載入預先聚合的次數表 ({len(cube)} 列)。")
+        return cube
+
+    df_processed = load_student_frame(raw_file_path, cache_key)
+    if df_processed is None:
+        return None
+    cube = build_count_cube(df_processed, grouping_col_name, categorical_feature_cols_all, numerical_feature_cols_all)
+    try:
+        cube_path = save_cube(cube, CUBE_DIR, CUBE_NAME, source_paths, analysis_config_key())
+        if cube_path is None:
+            st.sidebar.info(f"已建立次數表 ({len(cube)} 列)；未安裝 pyarrow，本次僅在記憶體中使用。")
+        else:
+            st.sidebar.info(f"已建立次數表 {cube_path} ({len(cube)} 列)。")
+    except OSError as e:
+        st.sidebar.warning(f"無法儲存次數表 ({e})，本次僅在記憶體中使用。")
+    return cube
+
+def cube_cache_key(raw_file_path):
+    """來源檔的修改時間與大小 + 分析定義的雜湊，作為 st.cache_data / st.cache_resource 的鍵"""
+    stamps = []
+    for path in cube_source_paths(raw_file_path):
+        if os.path.exists(path):
+            file_stat = os.stat(path)
+            stamps.append(f"{path}:{file_stat.st_size}:{file_stat.st_mtime_ns}")
+    return analysis_config_key() + '|' + '|'.join(stamps)
+
+# --- 子群體篩選 ---
+@st.cache_resource(show_spinner="正在建立子群體篩選索引...") # 同一程序內共用，不在每次重新執行時複製資料
+def load_subgroup_index(raw_file_path, cache_key):
+    """預處理後的學生資料與篩選變項的 bitmap 索引 (見 subgroup_index.py)；無法載入資料時為 (None, None)"""
+    df_processed = load_student_frame(raw_file_path, cache_key)
+    if df_processed is None:
+        return None, None
+    filter_frame = load_filter_frame(DATA_DIR, MAP_DIR, from_codes=uses_raw_codes(raw_file_path))
+    return df_processed, BitmapIndex(filter_frame)
+
+def subgroup_filters(subgroup_index):
+    """側邊欄的篩選選單，回傳 {欄位: 選取的選項}"""
+    selection = {}
+    for label, column in FILTER_COLUMNS.items():
+        if column not in subgroup_index.levels:
+            continue
+        counts = subgroup_index.level_counts(column)
+        selection[column] = st.sidebar.multiselect(label, subgroup_index.levels[column], key=f"filter_{column}",
+                                                   format_func=lambda level, counts=counts: f"{level} ({counts[level]})")
+    return selection
+
+def subgroup_cube(df_processed, mask):
+    """只對篩選後的列重新建立次數 cube"""
+    return build_count_cube(df_processed[mask], grouping_col_name, categorical_feature_cols_all,
+                            numerical_feature_cols_all)
+
+# --- 圖表快取 ---
+@st.cache_data(show_spinner=False) # 同一程序內重複使用已讀入的圖片
+def _figure_png(figure_cache_key, _draw):
+    return cached_png(figure_cache_key, _draw)
+
+def figure_png(cube, data_version, kind, draw, **params):
+    """取得圖表的 PNG；快取鍵為資料版本 + 圖表種類與參數，快取沒有時才繪製"""
+    return _figure_png(figure_key(data_version, kind, **params), lambda: draw(cube, **params))
+
+def lazy_section(label, key, expanded=False):
+    """
+    只在展開時才執行內容的特徵區塊，回傳 (容器, 是否展開)。
+    不支援 on_change 的舊版 streamlit 則一律執行 (與原本的行為相同)。
+    """
+    try:
+        section = st.expander(label, expanded=expanded, key=key, on_change="rerun")
+    except TypeError:
+        return st.expander(label, expanded=expanded), True
+    return section, bool(section.open)
+
 # --- 2. 主應用介面 ---
 st.set_page_config(layout="wide", page_title="數位學習樣貌與學業關聯分析")
 
@@ -162,196 +203,89 @@ st.markdown(f"""
 主要的分群方式是依據學生「**{grouping_col_name}**」的回答。
 """)
 
-# 載入並預處理數據
-df_display = load_and_preprocess_data(RAW_STUDENT_DATA_PATH)
-
-if df_display is not None:
-    alpha = 0.05 # 統計檢定顯著水準
+# 載入預先聚合的次數 cube (必要時才讀取並預處理數據)
+cube = load_analysis_cube(RAW_STUDENT_DATA_PATH, cube_cache_key(RAW_STUDENT_DATA_PATH))
+
+# 子群體篩選：啟用時才載入學生資料並建立 bitmap 索引，有篩選條件時只對篩選後的列重建 cube
+st.sidebar.header("子群體篩選")
+if cube is not None and st.sidebar.checkbox("啟用子群體篩選", key="enable_subgroup_filters"):
+    df_for_filters, subgroup_index = load_subgroup_index(RAW_STUDENT_DATA_PATH, cube_cache_key(RAW_STUDENT_DATA_PATH))
+    if subgroup_index is not None:
+        selection = subgroup_filters(subgroup_index)
+        if any(selection.values()):
+            subgroup_mask = subgroup_index.mask(selection)
+            st.sidebar.info(f"篩選後共 {int(subgroup_mask.sum())} / {subgroup_index.row_count} 位學生。")
+            cube = subgroup_cube(df_for_filters, subgroup_mask)
+            selected_text = "；".join(f"{label}：{'、'.join(map(str, selection[column]))}"
+                                     for label, column in FILTER_COLUMNS.items() if selection.get(column))
+            st.info(f"目前顯示子群體 ({selected_text})，共 {int(subgroup_mask.sum())} 位學生。")
+
+if cube is not None:
+    cube_features = set(cube['feature'])
+    cube_version = cube_version_of(cube) # 圖表快取鍵中的資料版本
 
    # --- A. 數值型特徵分析與呈現 ---
     st.header("A. 數值型特徵分析")
     for num_col in numerical_feature_cols_all:
-        if num_col in df_display.columns:
-            st.subheader(f"特徵：{num_col}")
-            
-            # 描述性統計表格
-            desc_stats = df_display.groupby(grouping_col_name, observed=True)[num_col].agg(
-                ['count', 'mean', 'median', 'std']
-            ).round(2)
-            st.write(f"各「{grouping_col_name}」群組在「{num_col}」上的統計：")
-            st.dataframe(desc_stats)
-
-            # 盒鬚圖
-            fig_num, ax_num = plt.subplots(figsize=(10, 6)) # 創建 fig, ax
-            sns.boxplot(x=grouping_col_name, y=num_col, data=df_display, 
-                        order=grade_order, 
-                        hue=grouping_col_name, # Added to address FutureWarning
-                        palette="viridis", 
-                        ax=ax_num,
-                        legend=False) # Added to address FutureWarning
-            ax_num.set_title(f'不同成績組別在「{num_col}」上的分佈', fontsize=14)
-            ax_num.set_xlabel(grouping_col_name, fontsize=10)
-            ax_num.set_ylabel(f"{num_col} (小時)", fontsize=10) # 假設單位是小時
-            ax_num.tick_params(axis='x', rotation=45, labelsize=8) # Corrected: removed ha='right'
-            ax_num.tick_params(axis='y', labelsize=8)
-            plt.tight_layout()
-            st.pyplot(fig_num)
-            plt.close(fig_num) # 關閉圖表，釋放記憶體
-
-            # 統計檢定
-            st.markdown("**統計檢定結果：**")
-            grouped_data_for_test = [
-                df_display[df_display[grouping_col_name] == group_level][num_col].dropna()
-                for group_level in df_display[grouping_col_name].cat.categories
-            ]
-            grouped_data_for_test = [g for g in grouped_data_for_test if not g.empty]
-
-            if len(grouped_data_for_test) >= 2:
-                # ANOVA
-                try:
-                    f_statistic, p_value_anova = stats.f_oneway(*grouped_data_for_test)
-                    st.markdown(f"* **ANOVA 檢定**: F統計量 = {f_statistic:.2f}, p-value = {p_value_anova:.4f}")
-                    if p_value_anova < alpha:
-                        st.markdown(f"    * 結論: **顯著差異** (p < {alpha})。不同成績組別在「{num_col}」上的平均數存在顯著差異。建議進行 post-hoc 檢定。")
-                    else:
-                        st.markdown(f"    * 結論: **無顯著差異** (p >= {alpha})。")
-                except Exception as e:
-                    st.markdown(f"* ANOVA 檢定執行錯誤: {e}")
-                # Kruskal-Wallis
-                try:
-                    h_statistic, p_value_kruskal = stats.kruskal(*grouped_data_for_test)
-                    st.markdown(f"* **Kruskal-Wallis H 檢定**: H統計量 = {h_statistic:.2f}, p-value = {p_value_kruskal:.4f}")
-                    if p_value_kruskal < alpha:
-                        st.markdown(f"    * 結論: **顯著差異** (p < {alpha})。不同成績組別在「{num_col}」上的分佈（中位數）存在顯著差異。建議進行 post-hoc 檢定。")
-                    else:
-                        st.markdown(f"    * 結論: **無顯著差異** (p >= {alpha})。")
-                except Exception as e:
-                    st.markdown(f"* Kruskal-Wallis 檢定執行錯誤: {e}")
-            else:
-                st.markdown("* 有效數據組別少於2組，無法進行 ANOVA 或 Kruskal-Wallis 檢定。")
-            
-            # 文字解讀區塊 (請您填充)
-            st.markdown(f"""
-            **初步文字解讀 ({num_col})**: 
-            * *(例如：從圖表和統計數據看，成績「全班五名以內」的學生在此項目的平均值/中位數為 X，而「全班三十名以後」的為 Y...)*
-            * *(結合p值：ANOVA/Kruskal-Wallis 檢定結果顯示這些差異在統計上是/不是顯著的...)*
-            * *(您的觀察與推論...)*
-            """)
-            st.markdown("---")
+        if num_col in cube_features:
+            # 只在區塊展開時計算內容；預設只展開第一個特徵
+            section, is_open = lazy_section(f"特徵：{num_col}", key=f"section_{num_col}",
+                                            expanded=(num_col == numerical_feature_cols_all[0]))
+            if not is_open:
+                continue
+            with section:
+                # 描述性統計表格與統計檢定 (見 objective1_views.py)
+                desc_stats, test_lines = numeric_section(cube, num_col)
+                st.write(f"各「{grouping_col_name}」群組在「{num_col}」上的統計：")
+                st.dataframe(desc_stats)
+
+                # 盒鬚圖 (以資料版本與繪圖參數快取已繪製的圖片)
+                st.image(figure_png(cube, cube_version, 'boxplot', draw_numeric_boxplot, feature=num_col))
+
+                # 統計檢定
+                st.markdown("**統計檢定結果：**")
+                for line in test_lines:
+                    st.markdown(line)
+
+                # 文字解讀區塊 (請您填充)
+                st.markdown(f"""
+                **初步文字解讀 ({num_col})**: 
+                * *(例如：從圖表和統計數據看，成績「全班五名以內」的學生在此項目的平均值/中位數為 X，而「全班三十名以後」的為 Y...)*
+                * *(結合p值：ANOVA/Kruskal-Wallis 檢定結果顯示這些差異在統計上是/不是顯著的...)*
+                * *(您的觀察與推論...)*
+                """)
         else:
             st.warning(f"數值型欄位 {num_col} 未在載入的數據中找到。")
 
     # --- B. 類別型特徵分析與呈現 ---
     st.header("B. 類別型特徵分析")
-    palette_idx = 0
-    # nan_col_str_representation = "遺失值(NaN)" # 不再需要這個，因為我們不單獨列出NaN的百分比
+    categorical_cols_present = [col for col in categorical_feature_cols_all if col in cube_features] # 決定各特徵的配色
 
     for cat_col in categorical_feature_cols_all: # 確保此列表已定義
-        if cat_col in df_display.columns:
-            st.subheader(f"特徵：{cat_col}")
-
-            # --- 表格數據準備 (修改為 dropna=True 或省略 dropna) ---
-            cat_analysis_table_temp = df_display.groupby(grouping_col_name, observed=True)[cat_col].value_counts(
-                normalize=True # 預設 dropna=True，基於非 NaN 總數計算百分比
-            ).mul(100).round(2).unstack(fill_value=0) # fill_value=0 處理沒有該選項的組別
-
-            # 欄位排序邏輯 (現在不需要特別處理 NaN 欄位了)
-            current_order_for_table = category_orders_map.get(cat_col, None)
-            if current_order_for_table is None and isinstance(df_display[cat_col].dtype, pd.CategoricalDtype):
-                 current_order_for_table = df_display[cat_col].dtype.categories.tolist()
-
-            if current_order_for_table:
-                # 只保留實際存在於表格中的欄位，並按預期順序排列
-                final_ordered_cols_table = [c for c in current_order_for_table if c in cat_analysis_table_temp.columns]
-                # 將任何不在預期順序中但實際存在的欄位附加到末尾
-                for col_name_in_table in cat_analysis_table_temp.columns:
-                    if col_name_in_table not in final_ordered_cols_table:
-                        final_ordered_cols_table.append(col_name_in_table)
-                cat_analysis_table = cat_analysis_table_temp[final_ordered_cols_table]
-            else:
-                cat_analysis_table = cat_analysis_table_temp # 無特定順序時直接使用
-
-            st.write(f"各「{grouping_col_name}」群組在「{cat_col}」上的選項百分比 (%) (基於有效回答者)：")
-            st.dataframe(cat_analysis_table)
-
-            # --- 圖表數據準備 (維持原樣，它已經是 dropna=True 的行為) ---
-            plot_data_cat = df_display.groupby(grouping_col_name, observed=True)[cat_col].value_counts(
-                normalize=True # 預設 dropna=True
-            ).mul(100).rename('percentage').reset_index()
-            
-            # 準備 hue_order 給圖表
-            current_hue_order_for_plot = category_orders_map.get(cat_col, [])
-            if not isinstance(current_hue_order_for_plot, list):
-                 current_hue_order_for_plot = list(current_hue_order_for_plot) if current_hue_order_for_plot else []
-            
-            # 確保 hue_order 中的項目確實存在於 plot_data_cat[cat_col] 中
-            # 並且只使用 plot_data_cat[cat_col] 中實際存在的類別來排序
-            unique_categories_in_plot_data = plot_data_cat[cat_col].unique()
-            
-            # 從預定義順序中篩選出實際存在的類別
-            final_hue_order_for_plot = [cat_val for cat_val in current_hue_order_for_plot if cat_val in unique_categories_in_plot_data]
-            # 添加任何不在預定義順序中但實際存在的類別
-            for cat_val in unique_categories_in_plot_data:
-                if cat_val not in final_hue_order_for_plot:
-                    final_hue_order_for_plot.append(cat_val)
-            
-            if not final_hue_order_for_plot: # 如果上面處理後是空的 (不太可能，但以防萬一)
-                final_hue_order_for_plot = None
-
-
-            fig_cat, ax_cat = plt.subplots(figsize=(12, 7))
-            sns.barplot(x=grouping_col_name, y='percentage', hue=cat_col, data=plot_data_cat,
-                        order=grade_order, hue_order=final_hue_order_for_plot, 
-                        palette=palettes_for_categorical[palette_idx % len(palettes_for_categorical)], ax=ax_cat)
-            palette_idx += 1
-            
-            ax_cat.set_title(f'不同成績組別在「{cat_col}」上的選項百分比\n(基於有效回答者)', fontsize=14)
-            ax_cat.set_xlabel(grouping_col_name, fontsize=10)
-            ax_cat.set_ylabel('百分比 (%)', fontsize=10)
-            ax_cat.tick_params(axis='x', rotation=45, labelsize=8)
-            ax_cat.tick_params(axis='y', labelsize=8)
-            ax_cat.legend(title=cat_col, bbox_to_anchor=(1.02, 1), loc='upper left', fontsize=8, title_fontsize='9')
-            plt.tight_layout(rect=[0, 0, 0.85, 1]) 
-            st.pyplot(fig_cat)
-            plt.close(fig_cat)
-
-            # --- 統計檢定部分不變，因為卡方檢定基於原始次數的列聯表 ---
-            st.markdown("**統計檢定結果：**")
-            contingency_table = pd.crosstab(df_display[grouping_col_name], df_display[cat_col]) # dropna 預設為 True
-            if contingency_table.empty or contingency_table.sum().sum() == 0 or contingency_table.shape[0] < 2 or contingency_table.shape[1] < 2:
-                st.markdown("* 列聯表數據不足（有效回答過少），無法進行卡方檢定。")
-            else:
-                try:
-                    chi2, p_value_chi2, dof, expected_freq = stats.chi2_contingency(contingency_table)
-                    st.markdown(f"* **卡方獨立性檢定**: 卡方統計量 = {chi2:.2f}, p-value = {p_value_chi2:.4f}, 自由度 = {dof}")
-                    # ... (期望頻率警告的邏輯不變) ...
-                    min_expected_freq = expected_freq.min()
-                    warning_msg = ""
-                    if min_expected_freq < 1:
-                        warning_msg = f"警告：期望頻率中存在小於1的值 (最小期望頻率: {min_expected_freq:.2f})。"
-                    elif min_expected_freq < 5:
-                        num_cells_lt_5 = (expected_freq < 5).sum()
-                        total_cells = expected_freq.size
-                        if (num_cells_lt_5 / total_cells) > 0.2:
-                            warning_msg = f"警告：超過20%的儲存格期望頻率小於5 (最小期望頻率: {min_expected_freq:.2f})。卡方檢定結果可能不夠準確。"
-                        else:
-                            warning_msg = f"注意：部分儲存格期望頻率小於5 (最小期望頻率: {min_expected_freq:.2f})。"
-                    if warning_msg:
-                        st.markdown(f"    * {warning_msg}")
-
-                    if p_value_chi2 < alpha:
-                        st.markdown(f"    * 結論: **顯著關聯** (p < {alpha})。「{grouping_col_name}」與「{cat_col}」之間存在統計上顯著的關聯（基於有效回答）。")
-                    else:
-                        st.markdown(f"    * 結論: **無顯著關聯** (p >= {alpha})。「{grouping_col_name}」與「{cat_col}」之間不存在統計上顯著的關聯（基於有效回答）。")
-                except Exception as e:
-                    st.markdown(f"* 卡方檢定執行錯誤: {e}")
+        if cat_col in cube_features:
+            section, is_open = lazy_section(f"特徵：{cat_col}", key=f"section_{cat_col}")
+            if not is_open:
+                continue
+            with section:
+                # --- 表格：選項百分比 (基於有效回答者)，欄位依預定義的選項順序 ---
+                cat_analysis_table = ordered_category_table(cube, cat_col)
+                st.write(f"各「{grouping_col_name}」群組在「{cat_col}」上的選項百分比 (%) (基於有效回答者)：")
+                st.dataframe(cat_analysis_table)
+
+                # --- 圖表 (以資料版本與繪圖參數快取已繪製的圖片) ---
+                palette = category_palette(cat_col, categorical_cols_present)
+                st.image(figure_png(cube, cube_version, 'barplot', draw_category_barplot, feature=cat_col, palette=palette))
+
+                # --- 統計檢定：卡方檢定基於原始次數的列聯表 (排除遺漏值) ---
+                st.markdown("**統計檢定結果：**")
+                for line in chi2_test_lines(cube, cat_col):
+                    st.markdown(line)
             
-            st.markdown(f"""
-            **初步文字解讀 ({cat_col})**:
-            * *(現在表格和圖表的百分比都基於有效回答者，請基於此進行解讀)*
-            * *(您的觀察與推論...)*
-            """)
-            st.markdown("---")
+                st.markdown(f"""
+                **初步文字解讀 ({cat_col})**:
+                * *(現在表格和圖表的百分比都基於有效回答者，請基於此進行解讀)*
+                * *(您的觀察與推論...)*
+                """)
         else:
             st.warning(f"類別型欄位 {cat_col} 未在載入的數據中找到。")
 
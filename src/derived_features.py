@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""
+衍生特徵 (綜合分數、比例、數值化的順序題) 的宣告式登錄與快取。
+
+target3 每次執行都在合併後的大表上以一連串 replace / map 重新計算「成績數值」、「學習進度_數值」、
+study_ratio、「SES_綜合分數」(StandardScaler 標準化) 與其三等分、support_group 等變項。
+本模組改為：
+
+- 每個衍生特徵以 @derived_feature(名稱, 輸入, tables=[對應表, ...]) 登錄，輸入為 (問卷代號, 欄位說明)
+  或其他衍生特徵的名稱，計算方式 (recipe) 是對輸入欄位的向量化運算，回傳一個 Series；
+  tables 為 recipe 用到的模組層級對應表 (GRADE_MAP 等)，修改對應表的內容也會讓快取失效。
+- DerivedFeatureStore.get() 第一次要求某個特徵時才計算 (連同它依賴的衍生特徵)，
+  結果存於 data/derived/{名稱}.parquet，旁邊的 {名稱}.json 記錄：
+  計算方式的雜湊 (recipe 原始碼、輸入、對應表內容與所依賴特徵的雜湊)、來源標註檔的指紋與輸入資料的雜湊。
+  未安裝 pyarrow 時不寫出快取，每次都重新計算。
+- 來源檔與計算方式都沒變時直接讀取快取；來源檔有變動時只讀取輸入欄位比對雜湊，
+  輸入內容沒變的特徵沿用快取，只有輸入真的改變 (或計算方式改變) 的特徵才重新計算。
+
+所有特徵都對齊同一個列配置：以學生問卷 (s) 為基準、依 LAYOUT_PREFIXES 連結其他問卷的 JoinStore.frame()，
+列的順序與 target3 的合併結果相同。對應表以外的標籤 (遺漏值、「我不知道」等) 一律成為 NaN。
+"""
+import hashlib
+import inspect
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from build_manifest import same_sources, source_fingerprints
+from join_store import JoinStore
+from labeled_store import pq
+
+DERIVED_DIR = 'derived'
+BASE_PREFIX = 's'
+LAYOUT_PREFIXES = ['s', 'p', 'sc'] # 與 target3 的合併相同 (學生問卷連結家長、學校問卷)
+
+DERIVED_FEATURES = {} # 名稱 -> {'inputs': [...], 'tables': [...], 'recipe': 函式}
+
+
+def derived_feature(name, inputs, tables=()):
+    """
+    登錄衍生特徵的裝飾器。inputs 的每一項為 (問卷代號, 欄位說明) 或已登錄的衍生特徵名稱；
+    recipe(df) 收到以輸入為欄位的 DataFrame (原始欄位以說明文字、衍生特徵以名稱為欄名)，回傳 Series。
+    tables 為 recipe 讀取的模組層級對應表 (dict / list)，其內容列入快取鍵。
+    """
+    def register(recipe):
+        DERIVED_FEATURES[name] = {'inputs': list(inputs), 'tables': list(tables), 'recipe': recipe}
+        return recipe
+    return register
+
+def _input_name(item):
+    return item[1] if isinstance(item, tuple) else item
+
+
+# --- 對應表 (與 target3 相同) ---
+# 注意：部分標籤與欄位說明含有 CJK 相容漢字 (例如「不」U+F967、「識」U+F9FC)，直接複製自 map 檔，請勿改為一般字元
+GRADE_MAP = {
+    "全班三十名以後": 1, "全班二十一至三十名": 2, "全班十一至二十名": 3,
+    "全班六至十名": 4, "全班五名以內": 5
+}
+PROGRESS_MAP = {
+    "我落後很多,很難跟得上": 1, "我有點落後,可能跟得上": 2,
+    "只落後一點點,很快就跟上了": 3, "大部分都跟得上": 4, "我的進度超前": 5
+}
+AGREEMENT_MAP = {"很不符合": 1, "不符合": 2, "符合": 3, "很符合": 4}
+FAMILY_ORDER = ['很不富裕', '不富裕', '富裕', '很富裕']
+EDUCATION_MAP = {
+    '無／不識字': 1, '自修／識字': 2, '小學': 3, '國（初）中': 4,
+    '高中職': 5, '五專、二專': 6, '大學、二技、四技': 7, '碩士': 8, '博士': 9
+}
+INCOME_MAP = {
+    '4,999 元以下': 1, '5,000~9,999': 2, '10,000~14,999': 3, '15,000~19,999': 4,
+    '20,000~24,999': 5, '25,000~30,999': 6, '30,000~34,999': 7, '35,000~39,999': 8,
+    '40,000~44,999': 9, '45,000~49,999': 10, '50,000~59,999': 11, '60,000~69,999': 12,
+    '70,000~79,999': 13, '80,000~89,999': 14, '90,000~99,999': 15, '100,000~109,999': 16,
+    '110,000~119,999': 17, '120,000~130,999': 18, '130,000~139,999': 19, '140,000~149,999': 20,
+    '150,000~199,999': 21, '200,000 元以上': 22
+}
+INTERNET_QUALITY_MAP = {"經常": 1, "有時": 2, "偶爾": 3, "從未": 5}
+TIME_MAP = {
+    "沒有": 0.0, "0.5小時以內": 0.25, "0.5-1小時": 0.75, "1-1.5小時": 1.25,
+    "1.5-2小時": 1.75, "2-2.5小時": 2.25, "2.5-3小時": 2.75, "3-3.5小時": 3.25,
+    "3.5-4小時": 3.75, "4-4.5小時": 4.25, "4.5-5小時": 4.75, "5小時以上": 5.5
+}
+FREQUENCY_MAP = {'沒有這項設備': 0, '幾乎沒有': 1, '一年幾次': 2, '每月一兩次': 3, '每月三四次': 4,
+                 '每週一兩次': 5, '每週三四次': 6, '幾乎每天': 7}
+
+STUDY_TIME_COLS = ["完成學校功課(查找完成作業需要的資料)", "課外的學習(各種線上付費或免費的課程)"]
+TIME_COLS = STUDY_TIME_COLS + ["玩線上遊戲", "看影片、聽音樂、迷因梗圖、卡通、漫畫", "和他人聊天(傳訊息)"]
+NETWORK_COLS = ['(2)固網寬頻（ADSL 512K 以上、Cable Modem、光纖）', '(4)手機 4G（或 5G）訊號分享', '(7)家中無法上網']
+DEVICE_COLS = ['桌上型電腦_______台', '筆記型電腦_______台', '平板電腦_______台']
+SUPPORT_COLS = [
+    '除臺灣學術網路外,本校另行付費提升頻寬',
+    '本校固定購置/導入支持課室數位互動的硬體設備(如大螢幕、短焦投影、Smartboard等)',
+    '本校的資訊設備借用與管理機制運作完善',
+    '本校能獲得推動數位學習充分的人事或業務費支持',
+    '本校能獲得推動數位學習充分的設備費支持'
+]
+SES_COMPONENTS = ['家境_數值', '家庭教育程度', '家庭總收入']
+SES_LABELS = ['低 SES', '中 SES', '高 SES']
+
+
+# --- 學習表現 ---
+@derived_feature('成績數值', [('s', '你上學期的平均成績大約如何?')], tables=[GRADE_MAP])
+def _grade_numeric(df):
+    return df['你上學期的平均成績大約如何?'].map(GRADE_MAP)
+
+@derived_feature('學習進度_數值', [('s', '你跟得上學校課業進度嗎?')], tables=[PROGRESS_MAP])
+def _progress_numeric(df):
+    return df['你跟得上學校課業進度嗎?'].map(PROGRESS_MAP)
+
+@derived_feature('學習自我管理分數', [
+    ('s', '讀書或寫作業時,我會先將無關的網站、即時通訊、手機APP或提醒聲音關掉'),
+    ('s', '我能要求自己先完成作業或讀書進度後,才能去看我喜歡的網站或玩手機。'),
+], tables=[AGREEMENT_MAP])
+def _self_regulation(df):
+    return df.apply(lambda column: column.map(AGREEMENT_MAP)).mean(axis=1)
+
+
+# --- 家庭社經地位 ---
+@derived_feature('家境類別', [('p', '請問您認為家裡的經濟狀況為何？')], tables=[FAMILY_ORDER])
+def _family_category(df):
+    return df['請問您認為家裡的經濟狀況為何？'].astype(pd.CategoricalDtype(categories=FAMILY_ORDER, ordered=True))
+
+@derived_feature('家境_數值', ['家境類別'])
+def _family_numeric(df):
+    codes = df['家境類別'].cat.codes
+    return codes.where(codes >= 0).astype(float) # 遺漏值為 NaN (cat.codes 的 -1 不當作分數)
+
+@derived_feature('家庭教育程度', [('p', '請問您的學歷')], tables=[EDUCATION_MAP])
+def _family_education(df):
+    return df['請問您的學歷'].map(EDUCATION_MAP)
+
+@derived_feature('家庭總收入', [
+    ('p', '（薪水、獎金、加班費等都算的話）您這份工作，平均每個月收入大概有多少？'),
+    ('p', '（薪水、獎金、加班費等都算的話）您配偶這份工作，平均每個月收入大概有多少？'),
+], tables=[INCOME_MAP])
+def _family_income(df):
+    return df.apply(lambda column: column.map(INCOME_MAP)).sum(axis=1, min_count=1)
+
+@derived_feature('SES_綜合分數', SES_COMPONENTS)
+def _ses_score(df):
+    # 與 StandardScaler 相同：只用三項都有值的列，各自以母體標準差標準化後加總
+    complete = df[SES_COMPONENTS].dropna()
+    scaled = (complete - complete.mean()) / complete.std(ddof=0).replace(0, 1)
+    return scaled.sum(axis=1).reindex(df.index)
+
+@derived_feature('SES_綜合分組', ['SES_綜合分數'], tables=[SES_LABELS])
+def _ses_group(df):
+    score = df['SES_綜合分數']
+    edges = np.unique(score.quantile(np.linspace(0, 1, len(SES_LABELS) + 1)).dropna())
+    if len(edges) != len(SES_LABELS) + 1: # 分數全為 NaN 或相同的值太多，無法分成三等分
+        print(f"提示：SES_綜合分數只有 {max(len(edges) - 1, 0)} 個不同的分位區間，SES_綜合分組全為 NaN。")
+        return pd.Series(pd.Categorical([np.nan] * len(score), categories=SES_LABELS, ordered=True), index=df.index)
+    return pd.qcut(score, q=len(SES_LABELS), labels=SES_LABELS)
+
+
+# --- 數位資源與使用模式 ---
+@derived_feature('網路品質_數值', [('s', '我住的地方沒有網路訊號或是訊號太弱。')],
+                 tables=[INTERNET_QUALITY_MAP])
+def _internet_quality(df):
+    return df['我住的地方沒有網路訊號或是訊號太弱。'].map(INTERNET_QUALITY_MAP)
+
+@derived_feature('網路穩定度', [('p', col) for col in NETWORK_COLS])
+def _network_stability(df):
+    # 依序檢查固網寬頻 (3)、手機訊號分享 (2)、家中無法上網 (1)
+    conditions = [df[col].eq('有') for col in NETWORK_COLS]
+    return pd.Series(np.select(conditions, [3.0, 2.0, 1.0], default=np.nan), index=df.index)
+
+@derived_feature('家中設備總數', [('p', col) for col in DEVICE_COLS])
+def _device_count(df):
+    return df.apply(pd.to_numeric, errors='coerce').sum(axis=1)
+
+@derived_feature('total_time', [('s', col) for col in TIME_COLS], tables=[TIME_MAP])
+def _total_time(df):
+    return df.apply(lambda column: column.map(TIME_MAP)).sum(axis=1)
+
+@derived_feature('study_ratio', [('s', col) for col in STUDY_TIME_COLS] + ['total_time'], tables=[TIME_MAP])
+def _study_ratio(df):
+    study_time = df[STUDY_TIME_COLS[0]].map(TIME_MAP) + df[STUDY_TIME_COLS[1]].map(TIME_MAP)
+    return study_time / df['total_time'].replace(0, np.nan)
+
+@derived_feature('電腦使用頻率', [('s', '電腦(含桌機或筆電)')], tables=[FREQUENCY_MAP])
+def _computer_frequency(df):
+    return df['電腦(含桌機或筆電)'].map(FREQUENCY_MAP)
+
+@derived_feature('手機使用頻率', [('s', '智慧型手機')], tables=[FREQUENCY_MAP])
+def _phone_frequency(df):
+    return df['智慧型手機'].map(FREQUENCY_MAP)
+
+
+# --- 學校支持 ---
+@derived_feature('學校支持_綜合分數', [('sc', col) for col in SUPPORT_COLS], tables=[AGREEMENT_MAP])
+def _school_support(df):
+    return df.apply(lambda column: column.map(AGREEMENT_MAP)).mean(axis=1)
+
+@derived_feature('support_group', ['學校支持_綜合分數'])
+def _support_group(df):
+    score = df['學校支持_綜合分數']
+    group = np.where(score >= score.median(), '高支持', '低支持')
+    return pd.Series(group, index=df.index, dtype=object).where(score.notna())
+
+
+# --- 快取 ---
+def _series_hash(series):
+    return hashlib.sha1(pd.util.hash_pandas_object(series, index=False).to_numpy().tobytes()).hexdigest()
+
+class DerivedFeatureStore:
+    """
+    依需要計算並快取衍生特徵。data_dir / map_dir 與 JoinStore 相同；
+    同一個 store 內已讀入或計算的特徵會保留在記憶體中。
+    """
+
+    def __init__(self, data_dir, map_dir, cache_dir=None, features=None):
+        self.join_store = JoinStore(data_dir, map_dir)
+        self.cache_dir = cache_dir or os.path.join(data_dir, DERIVED_DIR)
+        self.features = features if features is not None else DERIVED_FEATURES
+        self._values = {} # 名稱 -> Series
+        self._value_hashes = {} # 名稱 -> 內容雜湊 (作為依賴它的特徵的輸入雜湊)
+        self._raw = {} # (問卷代號, 欄位說明) -> Series
+        self._config_keys = {}
+        self._source_paths = None
+
+    def source_paths(self):
+        """列配置所依據的所有標註檔 (任何一個改變都可能改變列的順序)"""
+        if self._source_paths is None:
+            self._source_paths = [path for prefix in LAYOUT_PREFIXES for path in self.join_store.source_paths(prefix)]
+        return self._source_paths
+
+    def config_key(self, name):
+        """計算方式的雜湊：recipe 原始碼、輸入、對應表的內容，以及所依賴的衍生特徵的雜湊"""
+        if name not in self._config_keys:
+            spec = self.features[name]
+            parts = [inspect.getsource(spec['recipe']), json.dumps(spec['inputs'], ensure_ascii=False),
+                     json.dumps(spec.get('tables', []), ensure_ascii=False)]
+            parts += [self.config_key(item) for item in spec['inputs'] if not isinstance(item, tuple)]
+            self._config_keys[name] = hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+        return self._config_keys[name]
+
+    def _dependency_order(self, names):
+        """names 與其依賴的衍生特徵，依計算順序排列 (依賴在前)"""
+        ordered = []
+        def visit(name):
+            if name in ordered:
+                return
+            if name not in self.features:
+                raise KeyError(f"未登錄的衍生特徵: {name}")
+            for item in self.features[name]['inputs']:
+                if not isinstance(item, tuple):
+                    visit(item)
+            ordered.append(name)
+        for name in names:
+            visit(name)
+        return ordered
+
+    def _paths(self, name):
+        return os.path.join(self.cache_dir, name + '.parquet'), os.path.join(self.cache_dir, name + '.json')
+
+    def _has_cache(self, name):
+        return pq is not None and os.path.exists(self._paths(name)[0])
+
+    def _load_meta(self, name):
+        try:
+            with open(self._paths(name)[1], 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _load_values(self, name):
+        return pd.read_parquet(self._paths(name)[0])[name] # categorical 的選項順序由 parquet 保存
+
+    def _save(self, name, values, meta):
+        """寫出特徵與版本紀錄；未安裝 pyarrow 時不寫出 (下次重新計算)"""
+        if pq is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        feature_path, meta_path = self._paths(name)
+        values.rename(name).reset_index(drop=True).to_frame().to_parquet(feature_path, index=False)
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    def _read_raw(self, items):
+        """
+        以 JoinStore 讀取尚未讀入的原始欄位 (列配置固定為 LAYOUT_PREFIXES 的連結結果)。
+        每個問卷各讀一次 (連結索引已在記憶體中)，避免不同問卷的同名欄位互相改名；檔案中沒有的欄位為全 NaN。
+        """
+        missing = [item for item in dict.fromkeys(items) if item not in self._raw]
+        for prefix in LAYOUT_PREFIXES:
+            descriptions = [description for item_prefix, description in missing if item_prefix == prefix]
+            if not descriptions:
+                continue
+            columns = {name: (descriptions if name == prefix else []) for name in LAYOUT_PREFIXES}
+            frame = self.join_store.frame(columns, base=BASE_PREFIX)
+            for description in descriptions:
+                self._raw[(prefix, description)] = frame[description] if description in frame.columns \
+                    else pd.Series(np.nan, index=frame.index, dtype=object)
+
+    def _input_frame(self, name):
+        spec = self.features[name]
+        data = {_input_name(item): (self._raw[item] if isinstance(item, tuple) else self._values[item])
+                for item in spec['inputs']}
+        return pd.DataFrame(data)
+
+    def _input_hash(self, name):
+        spec = self.features[name]
+        parts = [_series_hash(self._raw[item]) if isinstance(item, tuple) else self._value_hashes[item]
+                 for item in spec['inputs']]
+        return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, names):
+        """
+        回傳 names 指定的衍生特徵 (DataFrame，欄位依 names 順序)。
+        快取有效時直接讀取；否則只讀取需要的原始欄位，輸入內容沒變的沿用快取，其餘重新計算。
+        """
+        names = [names] if isinstance(names, str) else list(names)
+        ordered = self._dependency_order(names)
+        # 來源檔指紋每次 get() 只計算一次 (大小與修改時間沒變時沿用紀錄中的雜湊)，檢查與寫入紀錄共用
+        current_sources = None
+        previous_sources = None
+        stale = []
+        for name in ordered:
+            if name in self._values:
+                continue
+            meta = self._load_meta(name)
+            if meta is not None and previous_sources is None:
+                previous_sources = meta.get('sources')
+            if meta is not None and meta.get('config_key') == self.config_key(name) and self._has_cache(name):
+                if current_sources is None:
+                    current_sources = source_fingerprints(self.source_paths(), previous_sources)
+                if same_sources(current_sources, meta.get('sources', {})):
+                    self._values[name] = self._load_values(name)
+                    continue
+            stale.append(name)
+
+        if stale:
+            if current_sources is None:
+                current_sources = source_fingerprints(self.source_paths(), previous_sources)
+            self._read_raw([item for name in stale for item in self.features[name]['inputs'] if isinstance(item, tuple)])
+            for name in self._dependency_order(stale):
+                if name in self._values and name not in stale:
+                    self._value_hashes.setdefault(name, _series_hash(self._values[name]))
+                    continue
+                start_time = time.perf_counter()
+                input_hash = self._input_hash(name)
+                meta = self._load_meta(name)
+                reuse = meta is not None and meta.get('config_key') == self.config_key(name) \
+                    and meta.get('input_hash') == input_hash and self._has_cache(name)
+                values = self._load_values(name) if reuse else \
+                    self.features[name]['recipe'](self._input_frame(name)).rename(name)
+                self._values[name] = values.reset_index(drop=True)
+                self._value_hashes[name] = _series_hash(self._values[name])
+                self._save(name, self._values[name], {
+                    'built_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'config_key': self.config_key(name),
+                    'sources': current_sources,
+                    'input_hash': input_hash,
+                    'rows': int(len(values)),
+                })
+                action = "輸入未改變，沿用快取" if reuse else "已重新計算"
+                print(f"衍生特徵「{name}」: {action} ({time.perf_counter() - start_time:.3f} 秒)")
+        return pd.DataFrame({name: self._values[name] for name in names})
+
+    def frame(self, columns, features):
+        """
+        JoinStore.frame(columns) 的結果加上衍生特徵 (兩者的列配置相同)。
+        columns 只能包含 LAYOUT_PREFIXES 的問卷 (連結其他問卷會改變列配置)。
+        """
+        extra = [prefix for prefix in columns if prefix not in LAYOUT_PREFIXES]
+        if extra:
+            raise ValueError(f"衍生特徵的列配置只連結 {LAYOUT_PREFIXES}，無法加入問卷 {extra}")
+        df = self.join_store.frame({prefix: list(columns.get(prefix, [])) for prefix in LAYOUT_PREFIXES},
+                                   base=BASE_PREFIX)
+        return pd.concat([df, self.get(features)], axis=1)
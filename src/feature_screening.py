@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+批次顯著性檢定：一次篩檢大量題目與成績分群的關聯。
+
+儀表板與 target notebooks 逐一對少數欄位呼叫 stats.chi2_contingency / f_oneway / kruskal。
+本模組改為在整數代碼上一次處理所有題目：
+
+1. 以一次 bincount 建立堆疊的次數陣列 counts[題目, 分群, 選項]。
+2. 卡方 (含 dof = 1 時的 Yates 校正)、ANOVA (以選項代碼為分數) 與 Kruskal-Wallis
+   (以同值次數計算等級，含同值校正) 都由這個陣列以向量運算一次算出，結果與 scipy 逐一計算相同。
+3. 各檢定分別以 Benjamini-Hochberg 校正 (q-value)，輸出一張長格式結果表
+   (每個資料集 x 題目 x 檢定一列)。
+
+篩檢的題目為有特定 value map、且實質選項 (非負代碼) 數在 MIN_LEVELS 到 MAX_LEVELS 之間的欄位
+(李克特量表、頻率題等)；負數代碼 (general_options 的遺漏值與「我不知道」等) 視為遺漏值。
+
+分群為學生問卷的成績變項 (as20)。家長 (p) 與手足 (f) 問卷以 nstudent_id 對應學生；
+教師問卷 (t / st) 以 school_class 對應班上每位學生，以「學生 x 教師」配對為單位，
+同一位教師的回答會重複計入，結果只適合作為篩檢用途。
+
+用法 (在 src/ 目錄下執行):
+    python feature_screening.py [資料集前綴 ...]      (預設為 s p t)
+輸出 data/screening/TIGPSw1_grade_screening.csv
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+
+from map_registry import open_registry
+from value_mapping import code_positions
+
+GROUPING_PREFIX = 's'
+GROUPING_VARIABLE = 'as20' # 你上學期的平均成績大約如何?
+MIN_LEVELS = 3
+MAX_LEVELS = 12
+DEFAULT_ALPHA = 0.05
+RESULT_COLUMNS = ['dataset', 'variable', 'description', 'test', 'statistic', 'df', 'p_value', 'q_value',
+                  'significant', 'n', 'groups', 'levels', 'min_expected']
+# 各資料集對應到學生分群的鍵 (資料集欄位, 學生欄位)
+GROUP_LINK_KEYS = {
+    's': 'nstudent_id',
+    'p': 'nstudent_id',
+    'f': 'nstudent_id',
+    't': 'school_class',
+    'st': 'school_class',
+}
+
+
+# --- 批次檢定引擎 ---
+def stacked_counts(group_codes, group_count, level_codes, level_count):
+    """
+    建立堆疊的次數陣列 counts[題目, 分群, 選項]。
+    group_codes: (列數,) 的分群代碼，-1 表示遺漏；
+    level_codes: (列數, 題目數) 的選項位置，-1 表示遺漏。
+    """
+    rows, items = level_codes.shape
+    valid = (level_codes >= 0) & (group_codes >= 0)[:, None]
+    item_index = np.broadcast_to(np.arange(items), level_codes.shape)
+    flat = (item_index[valid] * group_count + np.broadcast_to(group_codes[:, None], level_codes.shape)[valid]) \
+        * level_count + level_codes[valid]
+    counts = np.bincount(flat, minlength=items * group_count * level_count)
+    return counts.reshape(items, group_count, level_count)
+
+def batched_chi2(counts):
+    """
+    對每個題目的 (分群 x 選項) 列聯表做卡方獨立性檢定 (與 stats.chi2_contingency 相同，
+    只使用有次數的分群與選項，dof = 1 時套用 Yates 校正)。
+    回傳 (卡方統計量, 自由度, p-value, 最小期望次數)；列聯表小於 2 x 2 的題目為 NaN。
+    """
+    counts = counts.astype(float)
+    row_totals = counts.sum(axis=2)
+    col_totals = counts.sum(axis=1)
+    totals = row_totals.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = row_totals[:, :, None] * col_totals[:, None, :] / totals[:, None, None]
+    dof = ((row_totals > 0).sum(axis=1) - 1) * ((col_totals > 0).sum(axis=1) - 1)
+    used = expected > 0
+
+    observed = counts
+    yates = dof == 1
+    if yates.any():
+        diff = expected[yates] - counts[yates]
+        observed = counts.copy()
+        observed[yates] = counts[yates] + np.sign(diff) * np.minimum(0.5, np.abs(diff))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cells = np.where(used, (observed - expected) ** 2 / expected, 0.0)
+    chi2 = cells.sum(axis=(1, 2))
+    min_expected = np.where(used, expected, np.inf).min(axis=(1, 2))
+
+    testable = dof >= 1
+    chi2 = np.where(testable, chi2, np.nan)
+    p_values = np.where(testable, stats.chi2.sf(chi2, np.maximum(dof, 1)), np.nan)
+    return chi2, np.where(testable, dof, np.nan), p_values, np.where(testable, min_expected, np.nan)
+
+def batched_anova(counts, level_values):
+    """
+    以選項代碼 level_values[題目, 選項] 為分數，對每個題目做單因子 ANOVA (與 stats.f_oneway 相同)。
+    只使用有資料的分群；回傳 (F 統計量, 組間自由度, 組內自由度, p-value)，無法計算者為 NaN。
+    各分群內的分數都相同但分群之間不同時 (組內平方和為 0)，與 f_oneway 相同回傳 F = inf、p = 0；
+    所有分數都相同時為 NaN。
+    """
+    counts = counts.astype(float)
+    values = np.nan_to_num(level_values.astype(float))[:, None, :]
+    n = counts.sum(axis=2)
+    sums = (counts * values).sum(axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        group_means = sums / n
+        grand_means = sums.sum(axis=1) / n.sum(axis=1)
+        ss_between = np.nansum(n * (group_means - grand_means[:, None]) ** 2, axis=1)
+        ss_within = np.nansum(counts * (values - group_means[:, :, None]) ** 2, axis=(1, 2))
+        k = (n > 0).sum(axis=1)
+        df_between = k - 1
+        df_within = n.sum(axis=1) - k
+        f_statistic = (ss_between / df_between) / (ss_within / df_within)
+    testable = (df_between >= 1) & (df_within >= 1) & ((ss_within > 0) | (ss_between > 0))
+    f_statistic = np.where(testable, f_statistic, np.nan)
+    p_values = np.where(testable, stats.f.sf(f_statistic, np.maximum(df_between, 1), np.maximum(df_within, 1)), np.nan)
+    return f_statistic, df_between, df_within, p_values
+
+def batched_kruskal(counts):
+    """
+    對每個題目做 Kruskal-Wallis H 檢定 (與 stats.kruskal 相同，含同值校正)；
+    選項依代碼大小排序，同一選項的回答者取平均等級。
+    只使用有資料的分群；回傳 (H 統計量, 自由度, p-value)，無法計算者為 NaN。
+    """
+    counts = counts.astype(float)
+    ties = counts.sum(axis=1)
+    total_n = ties.sum(axis=1)
+    mean_ranks = np.cumsum(ties, axis=1) - (ties - 1) / 2 # 同值取平均等級
+    rank_sums = np.einsum('igl,il->ig', counts, mean_ranks)
+    n = counts.sum(axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h_statistic = 12.0 / (total_n * (total_n + 1)) * np.nansum(rank_sums ** 2 / n, axis=1) - 3 * (total_n + 1)
+        tie_correction = 1 - (ties ** 3 - ties).sum(axis=1) / (total_n ** 3 - total_n)
+        h_statistic = h_statistic / tie_correction
+    dof = (n > 0).sum(axis=1) - 1
+    testable = (dof >= 1) & (tie_correction > 0)
+    h_statistic = np.where(testable, h_statistic, np.nan)
+    p_values = np.where(testable, stats.chi2.sf(h_statistic, np.maximum(dof, 1)), np.nan)
+    return h_statistic, dof, p_values
+
+def benjamini_hochberg(p_values):
+    """Benjamini-Hochberg 校正後的 q-value；NaN 的 p-value 不計入檢定數，結果也保持 NaN"""
+    p_values = np.asarray(p_values, dtype=float)
+    q_values = np.full(p_values.shape, np.nan)
+    tested = ~np.isnan(p_values)
+    if tested.any():
+        q_values[tested] = stats.false_discovery_control(p_values[tested], method='bh')
+    return q_values
+
+
+# --- 題目選取 ---
+def screening_items(registry, prefix, min_levels=MIN_LEVELS, max_levels=MAX_LEVELS, exclude=()):
+    """
+    回傳 {變項代碼: 實質選項代碼 (int64 ndarray，遞增)}：
+    有特定 value map 且非負代碼數在 min_levels 到 max_levels 之間的欄位。
+    """
+    compiled_maps = registry.compiled_value_maps(prefix)
+    items = {}
+    for variable in registry.id_map(prefix):
+        if variable in exclude or not compiled_maps.has_specific(variable):
+            continue
+        codes, _ = registry.code_table(prefix, variable)
+        substantive = codes[codes >= 0]
+        if min_levels <= len(substantive) <= max_levels:
+            items[variable] = substantive
+    return items
+
+
+# --- 資料集篩檢 ---
+def _read_raw_columns(csv_path, columns):
+    header = pd.read_csv(csv_path, nrows=0).columns
+    present = [col for col in columns if col in header]
+    return pd.read_csv(csv_path, usecols=present, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+
+def student_groups(registry, data_dir):
+    """學生的成績分群：回傳 (DataFrame[nstudent_id, school_class, group_code], 分群標籤列表)"""
+    codes, labels = registry.code_table(GROUPING_PREFIX, GROUPING_VARIABLE)
+    group_codes = codes[codes >= 0]
+    group_labels = list(labels[codes >= 0])
+    students = _read_raw_columns(os.path.join(data_dir, f'TIGPSw1_{GROUPING_PREFIX}.csv'),
+                                 ['nstudent_id', 'school_class', GROUPING_VARIABLE])
+    students['group_code'] = code_positions(students.pop(GROUPING_VARIABLE), group_codes)
+    return students, group_labels
+
+def screen_dataset(prefix, registry, data_dir, students, group_count):
+    """篩檢單一資料集的所有題目，回傳未經多重比較校正的結果表"""
+    exclude = {GROUPING_VARIABLE} if prefix == GROUPING_PREFIX else set()
+    items = screening_items(registry, prefix, exclude=exclude)
+    link_key = GROUP_LINK_KEYS[prefix]
+    df = _read_raw_columns(os.path.join(data_dir, f'TIGPSw1_{prefix}.csv'), [link_key] + list(items))
+    items = {variable: codes for variable, codes in items.items() if variable in df.columns}
+
+    level_count = max((len(codes) for codes in items.values()), default=0)
+    level_codes = np.empty((len(df), len(items)), dtype=np.int8 if level_count < 127 else np.int64)
+    level_values = np.full((len(items), level_count), np.nan)
+    for i, (variable, codes) in enumerate(items.items()):
+        level_codes[:, i] = code_positions(df[variable], codes)
+        level_values[i, :len(codes)] = codes
+
+    if prefix == GROUPING_PREFIX:
+        group_codes = students['group_code'].to_numpy()
+    else:
+        # 依連結鍵對應學生分群 (轉換代碼之後才展開)；教師問卷會展開為每位學生一列
+        linked = df[[link_key]].reset_index().merge(students[[link_key, 'group_code']], on=link_key, how='inner')
+        level_codes = level_codes[linked['index'].to_numpy()]
+        group_codes = linked['group_code'].to_numpy()
+    counts = stacked_counts(group_codes.astype(np.int64), group_count, level_codes.astype(np.int64), max(level_count, 1))
+
+    chi2, chi2_df, chi2_p, min_expected = batched_chi2(counts)
+    f_statistic, anova_df, _, anova_p = batched_anova(counts, level_values)
+    h_statistic, kruskal_df, kruskal_p = batched_kruskal(counts)
+
+    id_map = registry.id_map(prefix)
+    base = pd.DataFrame({
+        'dataset': prefix,
+        'variable': list(items),
+        'description': [id_map.get(variable, '') for variable in items],
+        'n': counts.sum(axis=(1, 2)),
+        'groups': (counts.sum(axis=2) > 0).sum(axis=1),
+        'levels': [len(codes) for codes in items.values()],
+    })
+    results = [
+        base.assign(test='chi2', statistic=chi2, df=chi2_df, p_value=chi2_p, min_expected=min_expected),
+        base.assign(test='anova', statistic=f_statistic, df=anova_df, p_value=anova_p, min_expected=np.nan),
+        base.assign(test='kruskal', statistic=h_statistic, df=kruskal_df, p_value=kruskal_p, min_expected=np.nan),
+    ]
+    return pd.concat(results, ignore_index=True)
+
+def screen_against_grades(prefixes, data_dir, map_dir, alpha=DEFAULT_ALPHA):
+    """
+    對多個資料集的所有題目做成績分群的批次檢定，
+    各檢定分別以 Benjamini-Hochberg 校正，回傳長格式結果表 (依 q-value 排序)。
+    """
+    registry = open_registry(map_dir)
+    if registry is None:
+        raise RuntimeError("批次檢定需要 pyarrow 編譯的 map registry (請安裝 pyarrow)。")
+    students, group_labels = student_groups(registry, data_dir)
+    tables = []
+    for prefix in prefixes:
+        start_time = time.time()
+        table = screen_dataset(prefix, registry, data_dir, students, len(group_labels))
+        tables.append(table)
+        print(f"資料集 {prefix}: 檢定 {table['variable'].nunique()} 個題目，耗時 {time.time() - start_time:.2f} 秒")
+    results = pd.concat(tables, ignore_index=True)
+    results['q_value'] = results.groupby('test')['p_value'].transform(lambda p: benjamini_hochberg(p.to_numpy()))
+    results['significant'] = results['q_value'] < alpha
+    results = results.sort_values(['test', 'q_value', 'dataset', 'variable'], na_position='last', kind='stable')
+    return results[RESULT_COLUMNS].reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    prefixes = sys.argv[1:] or ['s', 'p', 't']
+    data_dir = '../data/'
+    map_dir = '../maps/'
+    start_time = time.time()
+    results = screen_against_grades(prefixes, data_dir, map_dir)
+    output_path = os.path.join(data_dir, 'screening', 'TIGPSw1_grade_screening.csv')
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    results.to_csv(output_path, index=False, encoding='utf-8-sig')
+
+    summary = results.groupby('test')['significant'].agg(['size', 'sum'])
+    print("\n--- 批次檢定摘要 (Benjamini-Hochberg, q < 0.05) ---")
+    for test, row in summary.iterrows():
+        print(f"{test}: {int(row['sum'])} / {int(row['size'])} 個題目顯著")
+    print(f"已寫出: {output_path} (總耗時 {time.time() - start_time:.2f} 秒)")
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+已繪製圖表的 PNG 快取。
+
+儀表板每次重新執行都會以 matplotlib / seaborn 重畫所有圖表並 tight_layout。
+本模組把繪製結果存成 PNG：快取鍵為「資料版本 + 圖表種類與參數」的雜湊，
+相同的鍵直接讀回圖片，不再繪圖。快取檔存於 data/figures/{鍵}.png，
+可跨 session / 重新啟動共用；資料或圖表參數改變時鍵不同，自然不會讀到舊圖。
+FIGURE_STYLE_VERSION 在繪圖程式 (版面、字型、配色等) 修改時遞增，使舊圖全部失效。
+
+舊的鍵不會再被讀取，因此每次寫入新圖後會整理快取目錄 (prune_figure_cache)：
+刪除超過 FIGURE_CACHE_MAX_AGE_DAYS 天未使用的圖，總大小仍超過 FIGURE_CACHE_MAX_BYTES 時再從最久未使用的開始刪除。
+讀到快取時會更新檔案的修改時間，作為「最近使用」的依據。
+不依資料版本刪除：不同資料集 (學生 / 家長) 的圖各有自己的資料版本，會同時使用。
+"""
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+
+import matplotlib.pyplot as plt
+
+FIGURE_CACHE_DIR = 'data/figures'
+FIGURE_STYLE_VERSION = 1
+FIGURE_DPI = 200 # 與 st.pyplot 預設的輸出解析度相同
+FIGURE_CACHE_MAX_BYTES = 200 * 1024 * 1024
+FIGURE_CACHE_MAX_AGE_DAYS = 30
+
+# 快取檔的權限與一般新建檔案相同 (0o666 扣除 umask)；mkstemp 建立的暫存檔只有擁有者可讀寫，
+# 直接改名會讓其他帳號 (例如批次匯出報表與 Streamlit 伺服器) 無法讀取共用的快取圖
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FIGURE_FILE_MODE = 0o666 & ~_UMASK
+
+
+def figure_key(data_version, kind, **params):
+    """資料版本、圖表種類與繪圖參數的雜湊 (參數須可轉為 JSON)"""
+    payload = json.dumps([FIGURE_STYLE_VERSION, data_version, kind, params], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def render_png(fig, dpi=FIGURE_DPI):
+    """將 Figure 輸出為 PNG bytes 並關閉圖表，釋放記憶體"""
+    buffer = io.BytesIO()
+    try:
+        fig.savefig(buffer, format='png', dpi=dpi, bbox_inches='tight')
+    finally:
+        plt.close(fig)
+    return buffer.getvalue()
+
+def cached_png(key, draw, cache_dir=FIGURE_CACHE_DIR):
+    """
+    取得快取鍵 key 的 PNG；快取不存在時呼叫 draw() 取得 Figure 繪製並寫入快取。
+    快取目錄無法寫入時仍回傳繪製結果。
+    """
+    png_path = os.path.join(cache_dir, key + '.png')
+    try:
+        with open(png_path, 'rb') as f:
+            png_bytes = f.read()
+    except OSError:
+        pass
+    else:
+        try:
+            os.utime(png_path) # 記錄最近使用時間，整理快取時保留常用的圖
+        except OSError:
+            pass
+        return png_bytes
+    png_bytes = render_png(draw())
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(png_bytes)
+        os.chmod(temp_path, FIGURE_FILE_MODE)
+        os.replace(temp_path, png_path) # 先寫暫存檔再取代，避免同時執行的 session 讀到寫一半的圖
+    except OSError as e:
+        print(f"警告：無法寫入圖表快取 {png_path}: {e}")
+    else:
+        prune_figure_cache(cache_dir, keep=png_path)
+    return png_bytes
+
+def prune_figure_cache(cache_dir=FIGURE_CACHE_DIR, max_bytes=FIGURE_CACHE_MAX_BYTES,
+                       max_age_days=FIGURE_CACHE_MAX_AGE_DAYS, keep=None):
+    """
+    刪除超過 max_age_days 天未使用的快取圖，總大小仍超過 max_bytes 時再從最久未使用的開始刪除 (keep 不刪除)。
+    回傳刪除的檔案數；其他程序同時刪除或檔案無法刪除時略過。
+    """
+    entries = []
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(('.png', '.tmp')) and entry.is_file():
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return 0
+    entries.sort() # 最久未使用的在前
+    cutoff = time.time() - max_age_days * 86400
+    total_bytes = sum(size for _, size, _ in entries)
+    removed = 0
+    for mtime, size, path in entries:
+        if mtime >= cutoff and total_bytes <= max_bytes:
+            break
+        if path == keep or (path.endswith('.tmp') and mtime >= cutoff): # 其他程序可能正在寫入的暫存檔
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_bytes -= size
+        removed += 1
+    return removed
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+學生 → 班級 → 學校的階層聚合。
+
+target2 的班級層次分析原本以 groupby().agg 搭配 Python lambda，
+在每個分群內重建 pd.Categorical(x.dropna()).codes.mean()，班級 ID 也只是隨機產生的佔位值。
+本模組改以真實的 school_class (學校班級 ID) 與 nschool_id (學校 ID) 分群，
+對任意欄位一次以向量運算算出各層級的統計量 (不需逐分群呼叫 Python 函式)：
+
+- 數值欄位：有效筆數 n、平均 mean。
+  所有數值欄位組成一個矩陣，依分群排序後以 np.add.reduceat 一次加總。
+- 順序類別欄位 (categorical，選項順序即 categories 順序)：有效筆數 n、
+  選項位置的平均 code_mean (0 為第一個選項)，以及各選項的比例 share:{選項}。
+  次數以 feature_screening.stacked_counts 一次 bincount 建立。
+
+結果為寬格式 DataFrame：索引為分群 ID，欄位為 (feature, statistic) 的 MultiIndex；
+('*', 'rows') 為分群內的總列數，班級層級另有 ('*', 學校 ID 欄位) 記錄所屬學校。
+ID 為遺漏值的列不計入任何分群。
+
+聚合結果可存於 data/aggregates/{name}_{層級}.parquet，
+旁邊的 {name}.json 記錄來源檔的指紋與聚合定義的雜湊，兩者都沒變時直接讀回。
+未安裝 pyarrow 時不寫出聚合結果 (每次重新計算)。
+"""
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from build_manifest import same_sources, source_fingerprints
+from feature_screening import stacked_counts
+from labeled_store import pq
+
+# 各層級的分群鍵 (原始變項代碼)；標註檔中的欄位名稱由 id_map 查得
+LEVEL_KEYS = {
+    'class': 'school_class',
+    'school': 'nschool_id',
+}
+SHARE_PREFIX = 'share:'
+
+
+# --- 向量化聚合 ---
+def _group_rows(keys):
+    """依分群 ID 排序後的列位置與各分群的起點；回傳 (分群 ID, 列位置, 起點)"""
+    codes, groups = pd.factorize(keys, sort=True) # 遺漏的 ID 為 -1
+    order = np.argsort(codes, kind='stable')
+    order = order[codes[order] >= 0]
+    starts = np.searchsorted(codes[order], np.arange(len(groups)))
+    return codes, groups, order, starts
+
+def aggregate_by(df, key, numeric_cols=(), ordinal_cols=()):
+    """
+    以 df[key] 分群，計算數值欄位的 n / mean 與順序類別欄位的 n / code_mean / 各選項比例。
+    ordinal_cols 須為 categorical 欄位；不存在於 df 的欄位會被略過。
+    """
+    numeric_cols = [col for col in numeric_cols if col in df.columns]
+    ordinal_cols = [col for col in ordinal_cols if col in df.columns]
+    codes, groups, order, starts = _group_rows(df[key])
+    group_count = len(groups)
+    columns = {('*', 'rows'): np.diff(np.append(starts, len(order)))}
+
+    if numeric_cols and group_count:
+        values = df[numeric_cols].to_numpy(dtype=float)[order]
+        valid = ~np.isnan(values)
+        sums = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=0)
+        counts = np.add.reduceat(valid.astype(np.int64), starts, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+        for i, col in enumerate(numeric_cols):
+            columns[(col, 'n')] = counts[:, i]
+            columns[(col, 'mean')] = means[:, i]
+
+    if ordinal_cols and group_count:
+        level_lists = [list(df[col].cat.categories) for col in ordinal_cols]
+        level_count = max(max((len(levels) for levels in level_lists), default=0), 1)
+        level_codes = np.column_stack([df[col].cat.codes.to_numpy().astype(np.int64) for col in ordinal_cols])
+        counts = stacked_counts(codes.astype(np.int64), group_count, level_codes, level_count) # [欄位, 分群, 選項]
+        totals = counts.sum(axis=2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            code_means = (counts * np.arange(level_count)).sum(axis=2) / totals
+            shares = counts / totals[:, :, None]
+        for i, (col, levels) in enumerate(zip(ordinal_cols, level_lists)):
+            columns[(col, 'n')] = totals[i]
+            columns[(col, 'code_mean')] = code_means[i]
+            for j, level in enumerate(levels):
+                columns[(col, SHARE_PREFIX + str(level))] = shares[i, :, j]
+
+    result = pd.DataFrame(columns, index=pd.Index(groups, name=key))
+    result.columns = pd.MultiIndex.from_tuples(result.columns, names=['feature', 'statistic'])
+    return result
+
+def aggregate_hierarchy(df, class_key, school_key, numeric_cols=(), ordinal_cols=()):
+    """
+    同一份學生 (或教師) 層級資料分別聚合到班級與學校，回傳 {'class': ..., 'school': ...}。
+    班級層級附上 ('*', school_key) 欄位 (班級所屬的學校 ID)，可再連結學校層級的結果。
+    """
+    class_frame = aggregate_by(df, class_key, numeric_cols, ordinal_cols)
+    _, _, order, starts = _group_rows(df[class_key])
+    class_frame[('*', school_key)] = df[school_key].to_numpy()[order[starts]] if len(starts) else []
+    school_frame = aggregate_by(df, school_key, numeric_cols, ordinal_cols)
+    return {'class': class_frame, 'school': school_frame}
+
+
+def statistic_table(frame, statistic):
+    """取出所有欄位的同一個統計量 (例如 'mean'、'code_mean')，欄位為特徵名稱"""
+    return frame.xs(statistic, axis=1, level='statistic')
+
+def level_shares(frame, feature):
+    """單一順序類別欄位的各選項比例，欄位為選項標籤"""
+    shares = frame[feature]
+    shares = shares.loc[:, shares.columns.str.startswith(SHARE_PREFIX)]
+    shares.columns = [col[len(SHARE_PREFIX):] for col in shares.columns]
+    return shares
+
+
+# --- 儲存與載入 ---
+def aggregate_config_key(df, keys, numeric_cols, ordinal_cols):
+    """聚合定義 (分群鍵、欄位與選項順序) 的雜湊；定義改變時快取需要重建"""
+    config = [list(keys), list(numeric_cols),
+              [[col, [str(level) for level in df[col].cat.categories]] for col in ordinal_cols if col in df.columns]]
+    payload = json.dumps(config, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def aggregate_paths(agg_dir, name, levels):
+    """回傳 ({層級: 聚合檔路徑}, 版本紀錄 JSON 路徑)"""
+    paths = {level: os.path.join(agg_dir, f'{name}_{level}.parquet') for level in levels}
+    return paths, os.path.join(agg_dir, name + '.json')
+
+def load_aggregates(agg_dir, name, source_paths, config_key, levels=tuple(LEVEL_KEYS)):
+    """讀取已存的各層級聚合結果；未安裝 pyarrow、不存在、來源檔內容或聚合定義改變時回傳 None"""
+    if pq is None:
+        return None
+    paths, meta_path = aggregate_paths(agg_dir, name, levels)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if meta.get('config_key') != config_key or not all(os.path.exists(path) for path in paths.values()):
+        return None
+    if not same_sources(source_fingerprints(source_paths, meta.get('sources')), meta.get('sources', {})):
+        return None
+    return {level: pd.read_parquet(path) for level, path in paths.items()}
+
+def save_aggregates(frames, agg_dir, name, source_paths, config_key):
+    """儲存各層級聚合結果與版本紀錄；未安裝 pyarrow 時不寫出 (下次重新計算)"""
+    if pq is None:
+        return
+    os.makedirs(agg_dir, exist_ok=True)
+    paths, meta_path = aggregate_paths(agg_dir, name, frames)
+    for level, frame in frames.items():
+        frame.to_parquet(paths[level])
+    meta = {
+        'built_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'config_key': config_key,
+        'sources': source_fingerprints(source_paths),
+        'groups': {level: int(len(frame)) for level, frame in frames.items()},
+    }
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+def cached_hierarchy(df, name, source_paths, class_key, school_key, numeric_cols=(), ordinal_cols=(),
+                     agg_dir='../data/aggregates'):
+    """
+    aggregate_hierarchy 的快取版本：來源檔與聚合定義都沒變時直接讀回先前的結果。
+    source_paths 為 df 的來源檔 (例如標註檔)，作為快取的版本依據。
+    """
+    config_key = aggregate_config_key(df, [class_key, school_key], numeric_cols, ordinal_cols)
+    frames = load_aggregates(agg_dir, name, source_paths, config_key)
+    if frames is not None:
+        print(f"已載入 {name} 的班級 / 學校聚合結果 (快取)。")
+        return frames
+    frames = aggregate_hierarchy(df, class_key, school_key, numeric_cols, ordinal_cols)
+    try:
+        save_aggregates(frames, agg_dir, name, source_paths, config_key)
+    except OSError as e:
+        print(f"警告：無法寫入聚合結果 {name}: {e}")
+    return frames
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+以整數 ID 連結各問卷的 join store。
+
+分析筆記本原本先讀入學生、家長、學校問卷的「全部」欄位，再以 pd.merge 串接，
+合併後的表格有上千個欄位，實際只用到其中數十個。本模組把連結與取欄位分開：
+
+- 連結索引 (join index)：只讀取兩份問卷的 ID 欄位 (nstudent_id / school_class / nschool_id)，
+  以 factorize 轉為緊湊的 int32 代碼後，一次算出 left join 的列對應
+  (left_pos, right_pos；right_pos 為 -1 表示沒有對應的列)。
+  結果存於 data/join_index/{base}__{other}__{key}.npz，旁邊的 .json 記錄來源檔的指紋，
+  來源檔改變時才重新計算。
+- 取欄位：frame() 依連結索引，只從各問卷讀取要求的欄位，再依列對應展開。
+
+列的順序與 pd.merge(how='left') 相同：依基準問卷的列順序，同一列有多筆對應時依對應問卷的列順序展開。
+與 pd.merge 不同的是 ID 為遺漏值的列不會互相對應。
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from build_manifest import same_sources, source_fingerprints
+from labeled_store import labeled_csv_path, labeled_source_paths, read_labeled_table
+from map_registry import load_map_json
+
+# 連結兩份問卷時依序嘗試的 ID 欄位 (原始變項代碼)，使用第一個兩邊都有的欄位
+KEY_PRIORITY = ['nstudent_id', 'school_class', 'nschool_id']
+JOIN_INDEX_DIR = 'join_index'
+
+
+def join_index_paths(index_dir, base, other, key):
+    """回傳 (列對應 .npz 路徑, 來源指紋 .json 路徑)"""
+    stem = os.path.join(index_dir, f'{base}__{other}__{key}')
+    return stem + '.npz', stem + '.json'
+
+def left_join_positions(left_keys, right_keys):
+    """
+    計算 left join 的列對應，回傳 (left_pos, right_pos) 兩個 int32 陣列。
+    兩邊的 ID 先一起 factorize 為緊湊代碼；遺漏的 ID 代碼為 -1，不與任何列對應。
+    """
+    codes, uniques = pd.factorize(np.concatenate([np.asarray(left_keys), np.asarray(right_keys)]))
+    codes = codes.astype(np.int32)
+    left_codes, right_codes = codes[:len(left_keys)], codes[len(left_keys):]
+
+    # 對應問卷依代碼排序 (stable，同代碼維持原本的列順序)；遺漏值 (-1) 排在最前面
+    right_order = np.argsort(right_codes, kind='stable').astype(np.int32)
+    code_counts = np.bincount(right_codes + 1, minlength=len(uniques) + 1)
+    code_starts = np.cumsum(code_counts) - code_counts
+    # 左邊遺漏的 ID 改查最後一格 (次數 0)
+    code_counts = np.append(code_counts[1:], 0)
+    code_starts = np.append(code_starts[1:], 0)
+    lookup = np.where(left_codes >= 0, left_codes, len(uniques))
+
+    match_counts = code_counts[lookup]
+    output_counts = np.maximum(match_counts, 1) # 沒有對應的列仍保留一列
+    left_pos = np.repeat(np.arange(len(left_keys), dtype=np.int32), output_counts)
+    offsets = np.arange(len(left_pos)) - np.repeat(np.cumsum(output_counts) - output_counts, output_counts)
+    has_match = np.repeat(match_counts > 0, output_counts)
+    right_pos = np.full(len(left_pos), -1, dtype=np.int32)
+    right_pos[has_match] = right_order[(np.repeat(code_starts[lookup], output_counts) + offsets)[has_match]]
+    return left_pos, right_pos
+
+
+class JoinStore:
+    """
+    各問卷 (s、p、sc、t…) 的標註資料以 ID 欄位連結。
+    data_dir 為標註檔所在目錄，map_dir 為 id_map 所在目錄；
+    連結索引存於 data_dir/join_index，記憶體中也會保留已計算的索引。
+    """
+
+    def __init__(self, data_dir, map_dir, index_dir=None):
+        self.data_dir = data_dir
+        self.map_dir = map_dir
+        self.index_dir = index_dir or os.path.join(data_dir, JOIN_INDEX_DIR)
+        self._id_maps = {}
+        self._indexes = {}
+
+    def id_map(self, prefix):
+        """問卷的 id_map {變項代碼: 說明文字} (優先使用 map registry)"""
+        if prefix not in self._id_maps:
+            id_map_path = os.path.join(self.map_dir, f'tigps_w1_{prefix}_id_map.json')
+            self._id_maps[prefix] = load_map_json(id_map_path)
+        return self._id_maps[prefix]
+
+    def source_paths(self, prefix):
+        """問卷的標註檔 (存在的 CSV 與 parquet)，作為連結索引的版本依據"""
+        return labeled_source_paths(self.data_dir, prefix)
+
+    def join_key(self, base, other):
+        """兩份問卷共有的連結鍵 (變項代碼)；沒有共同的 ID 欄位時拋出 KeyError"""
+        base_map, other_map = self.id_map(base), self.id_map(other)
+        for key in KEY_PRIORITY:
+            if key in base_map and key in other_map:
+                return key
+        raise KeyError(f"問卷 {base} 與 {other} 沒有共同的 ID 欄位 ({', '.join(KEY_PRIORITY)})")
+
+    def key_values(self, prefix, key):
+        """只讀取問卷的 ID 欄位，回傳其數值陣列"""
+        description = self.id_map(prefix)[key]
+        df = read_labeled_table(labeled_csv_path(self.data_dir, prefix), columns=[description], as_category=False)
+        if description not in df.columns:
+            raise KeyError(f"問卷 {prefix} 的標註檔缺少 ID 欄位 '{description}'")
+        return df[description].to_numpy()
+
+    def join_index(self, base, other, key=None):
+        """
+        base 對 other 的 left join 列對應 (left_pos, right_pos)。
+        依序使用記憶體中的結果、磁碟上未過期的索引檔，都沒有時才讀取 ID 欄位重新計算並寫入。
+        """
+        key = key or self.join_key(base, other)
+        cache_key = (base, other, key)
+        if cache_key in self._indexes:
+            return self._indexes[cache_key]
+
+        index_path, meta_path = join_index_paths(self.index_dir, base, other, key)
+        source_paths = self.source_paths(base) + self.source_paths(other)
+        positions = self._load_index(index_path, meta_path, source_paths)
+        if positions is None:
+            positions = left_join_positions(self.key_values(base, key), self.key_values(other, key))
+            self._save_index(positions, index_path, meta_path, source_paths)
+        self._indexes[cache_key] = positions
+        return positions
+
+    def _load_index(self, index_path, meta_path, source_paths):
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            previous = meta.get('sources', {})
+            if not same_sources(source_fingerprints(source_paths, previous), previous):
+                return None
+            with np.load(index_path) as index_file:
+                return index_file['left_pos'], index_file['right_pos']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save_index(self, positions, index_path, meta_path, source_paths):
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            left_pos, right_pos = positions
+            np.savez(index_path, left_pos=left_pos, right_pos=right_pos)
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'sources': source_fingerprints(source_paths)}, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            print(f"警告：無法寫入連結索引 {index_path}: {e}")
+
+    def frame(self, columns, base='s', keys=None, as_category=False):
+        """
+        以 base 問卷為基準，left join 其他問卷，只載入要求的欄位。
+        columns: {問卷代號: [欄位說明文字, ...]}，其中 base 的欄位在最前面；
+        keys: 可指定 {問卷代號: 連結鍵變項代碼}，未指定時依 KEY_PRIORITY 自動選擇。
+        各問卷都直接以 base 的 ID 連結 (例如學校問卷以學生問卷的學校 ID 連結)。
+        檔案中不存在的欄位會被略過；與先前欄位同名的欄位加上 _{問卷代號} 後綴。
+        """
+        keys = keys or {}
+        base_rows = None # 目前每一列對應的 base 列號
+        side_rows = {} # 問卷代號 -> 目前每一列對應的該問卷列號 (-1 為沒有對應)
+        for prefix in columns:
+            if prefix == base:
+                continue
+            left_pos, right_pos = self.join_index(base, prefix, keys.get(prefix))
+            if base_rows is None:
+                base_rows, side_rows[prefix] = left_pos, right_pos
+                continue
+            # 已展開的列再依這份問卷的對應數展開 (一對多時列數增加)
+            match_counts = np.bincount(left_pos, minlength=base_rows.max(initial=-1) + 1)
+            match_starts = np.cumsum(match_counts) - match_counts
+            repeats = match_counts[base_rows]
+            expanded = np.repeat(np.arange(len(base_rows)), repeats)
+            offsets = np.arange(len(expanded)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+            side_rows = {name: rows[expanded] for name, rows in side_rows.items()}
+            side_rows[prefix] = right_pos[match_starts[base_rows[expanded]] + offsets]
+            base_rows = base_rows[expanded]
+
+        parts = []
+        used_names = set()
+        for prefix in [base] + [name for name in columns if name != base]:
+            side_df = read_labeled_table(labeled_csv_path(self.data_dir, prefix), columns=list(columns.get(prefix, [])),
+                                         as_category=as_category).reset_index(drop=True)
+            if base_rows is None: # 只有 base 的欄位
+                parts.append(side_df)
+                used_names.update(side_df.columns)
+                continue
+            rows = base_rows if prefix == base else side_rows[prefix]
+            side_df = side_df.reindex(rows).reset_index(drop=True) # -1 不在索引中，成為遺漏值
+            side_df.columns = [f'{name}_{prefix}' if name in used_names else name for name in side_df.columns]
+            used_names.update(side_df.columns)
+            parts.append(side_df)
+        return pd.concat(parts, axis=1)
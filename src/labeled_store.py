@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+標註後資料集 (TIGPSw1_{prefix}_descriptive_labeled) 的欄式儲存與讀取。
+
+map_test.py 除了原本的 UTF-8-BOM CSV 之外，另外寫出同名的 .parquet 檔：
+標籤欄位以 categorical (字典編碼) 儲存，數值欄位 (ID、年份、時數等) 保留數值型別。
+讀取端透過 read_labeled_table 只讀取需要的欄位；
+若 parquet 檔不存在 (或未安裝 pyarrow)，則退回讀取 CSV，並同樣只解析需要的欄位。
+
+若標註檔尚未產生，map_raw_columns 可直接從原始 TIGPSw1_{prefix}.csv
+只讀取並轉換需要的欄位 (依 id_map 反查變項代碼，再套用 value maps)；
+read_raw_codes 則只讀取需要的欄位、保留整數代碼，由呼叫端直接以代碼建立 categorical。
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from map_registry import load_map_json, registered_compiled_maps
+from value_mapping import CompiledValueMaps, translate_values
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # pyarrow 為選用套件，未安裝時只使用 CSV
+    pa = None
+    pq = None
+
+# 與 pd.read_csv 預設相同的遺漏值字串，讓 parquet 與 CSV 讀回的內容一致
+CSV_NA_VALUES = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+}
+
+
+def labeled_csv_path(data_dir, prefix):
+    return os.path.join(data_dir, f'TIGPSw1_{prefix}_descriptive_labeled.csv')
+
+def labeled_parquet_path(data_dir, prefix):
+    return os.path.join(data_dir, f'TIGPSw1_{prefix}_descriptive_labeled.parquet')
+
+def columnar_path_for(csv_path):
+    """CSV 檔案對應的 parquet 檔案路徑 (同目錄、同檔名)"""
+    return os.path.splitext(csv_path)[0] + '.parquet'
+
+def labeled_source_paths(data_dir, prefix):
+    """標註資料集實際存在的檔案 (CSV 與 parquet)，作為預先計算結果的版本依據"""
+    csv_path = labeled_csv_path(data_dir, prefix)
+    return [path for path in (csv_path, columnar_path_for(csv_path)) if os.path.exists(path)]
+
+
+def to_columnar_frame(df):
+    """
+    將 map_all_values 輸出的 object 欄位轉為適合欄式儲存的型別：
+    遺漏值字串轉為 NaN，全為數字的欄位轉為數值型別 (與 read_csv 的推斷相同)，
+    其餘標籤欄位轉為 categorical。
+    """
+    typed_columns = {}
+    for column in df.columns:
+        series = df[column]
+        if series.dtype == object:
+            series = series.where(~series.isin(CSV_NA_VALUES), np.nan)
+            try:
+                series = pd.to_numeric(series)
+            except (ValueError, TypeError):
+                series = series.astype('category')
+        typed_columns[column] = series
+    typed_df = pd.DataFrame(typed_columns, index=df.index)
+    typed_df.columns = df.columns
+    return typed_df
+
+def save_columnar(df, filepath):
+    """將 DataFrame 以 parquet 格式儲存 (標籤欄位為 categorical)；未安裝 pyarrow 時略過"""
+    if pq is None:
+        print(f"提示：未安裝 pyarrow，略過欄式檔案 {filepath} 的輸出。")
+        return False
+    print(f"\n--- 正在將欄式結果儲存至 {filepath} ---")
+    try:
+        to_columnar_frame(df).to_parquet(filepath, index=False)
+        print("成功儲存欄式檔案。")
+        return True
+    except Exception as e:
+        print(f"儲存欄式檔案 '{filepath}' 時發生錯誤：{e}")
+        if os.path.exists(filepath):
+            os.remove(filepath) # 避免讀取端讀到舊的或不完整的欄式檔案
+        return False
+
+
+def available_columns(filepath):
+    """回傳標註資料檔的欄位名稱 (parquet 只讀取 schema，CSV 只讀取標題列)"""
+    columnar_path = columnar_path_for(filepath) if filepath.endswith('.csv') else filepath
+    if pq is not None and os.path.exists(columnar_path):
+        return list(pq.read_schema(columnar_path).names)
+    return list(pd.read_csv(filepath, nrows=0).columns)
+
+def read_labeled_table(filepath, columns=None, as_category=True):
+    """
+    讀取標註後的資料檔，只載入 columns 指定的欄位 (None 表示全部)。
+    filepath 可以是 .csv 或 .parquet；若給 CSV 路徑且同名 parquet 存在，優先讀取 parquet。
+    不存在於檔案中的欄位會被略過 (由呼叫端自行檢查缺漏)。
+    as_category=False 時，categorical 欄位會轉回 object，行為與直接讀 CSV 相同。
+    找不到檔案時拋出 FileNotFoundError。
+    """
+    columnar_path = columnar_path_for(filepath) if filepath.endswith('.csv') else filepath
+    if pq is not None and os.path.exists(columnar_path):
+        if columns is not None:
+            existing = set(pq.read_schema(columnar_path).names)
+            columns = [col for col in columns if col in existing]
+        df = pd.read_parquet(columnar_path, columns=columns)
+        if not as_category:
+            category_cols = df.select_dtypes(include='category').columns
+            df[category_cols] = df[category_cols].astype(object)
+        return df
+
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(filepath)
+    if columns is None:
+        return pd.read_csv(filepath, low_memory=False)
+    wanted = set(columns)
+    df = pd.read_csv(filepath, usecols=lambda col: col in wanted, low_memory=False)
+    return df[[col for col in columns if col in df.columns]] # 依要求的順序排列
+
+
+def _load_maps(id_map_path, value_map_path):
+    """讀取 id_map 與編譯後的 value maps；優先使用預先編譯的 map registry，無法使用時才直接解析 JSON"""
+    id_map = load_map_json(id_map_path)
+    compiled_maps = registered_compiled_maps(value_map_path)
+    if compiled_maps is None:
+        value_maps = load_map_json(value_map_path)
+        compiled_maps = CompiledValueMaps(value_maps.get('general_options', {}), value_maps.get('value_maps', {}))
+    return id_map, compiled_maps
+
+def _read_raw_selected(raw_csv_path, id_map_path, value_map_path, columns):
+    """依說明文字反查變項代碼，只讀取原始 CSV 中這些欄位；回傳 (id_map, compiled_maps, 變項代碼列表, raw_df)"""
+    if not os.path.exists(raw_csv_path):
+        raise FileNotFoundError(raw_csv_path)
+    id_map, compiled_maps = _load_maps(id_map_path, value_map_path)
+
+    description_to_code = {}
+    for code, description in id_map.items():
+        description_to_code.setdefault(description, str(code))
+    codes = [description_to_code[col] for col in columns if col in description_to_code]
+
+    wanted = set(codes)
+    raw_df = pd.read_csv(raw_csv_path, usecols=lambda col: col in wanted, low_memory=False)
+    return id_map, compiled_maps, [code for code in codes if code in raw_df.columns], raw_df
+
+def map_raw_columns(raw_csv_path, id_map_path, value_map_path, columns, as_category=True):
+    """
+    不經過完整轉換流程，直接從原始 CSV 產生指定說明欄位的標註資料。
+    columns 為說明文字 (轉換後的欄位名稱)；透過 id_map 反查原始變項代碼，
+    只讀取這些欄位，套用 general_options + 特定 value map 後再重新命名。
+    回傳內容與 read_labeled_table(標註檔, columns) 相同；id_map 中找不到的欄位會被略過。
+    找不到原始 CSV 或 map 檔時拋出 FileNotFoundError。
+    """
+    id_map, compiled_maps, codes, raw_df = _read_raw_selected(raw_csv_path, id_map_path, value_map_path, columns)
+
+    labeled_columns = {}
+    for code in codes:
+        combined_map = compiled_maps.for_column(code)
+        if combined_map:
+            labels, _ = translate_values(raw_df[code], combined_map)
+            labeled_columns[id_map[code]] = pd.Series(labels, index=raw_df.index)
+        else:
+            labeled_columns[id_map[code]] = raw_df[code]
+    df = to_columnar_frame(pd.DataFrame(labeled_columns, index=raw_df.index))
+    if not as_category:
+        category_cols = df.select_dtypes(include='category').columns
+        df[category_cols] = df[category_cols].astype(object)
+    return df
+
+def read_raw_codes(raw_csv_path, id_map_path, value_map_path, columns):
+    """
+    只讀取原始 CSV 中指定說明欄位的整數代碼，不轉換為標籤。
+    回傳 (df, column_maps)：df 的欄位以說明文字命名、保留原始代碼；
+    column_maps 為 {說明文字: 組合後的對應表 {代碼字串: 標籤}}，供之後直接由代碼建立 categorical。
+    id_map 中找不到的欄位會被略過；找不到原始 CSV 或 map 檔時拋出 FileNotFoundError。
+    """
+    id_map, compiled_maps, codes, raw_df = _read_raw_selected(raw_csv_path, id_map_path, value_map_path, columns)
+    df = raw_df[codes].rename(columns={code: id_map[code] for code in codes})
+    column_maps = {id_map[code]: compiled_maps.for_column(code) for code in codes}
+    return df, column_maps
+
+
+class ColumnarChunkWriter:
+    """
+    串流模式用的 parquet 逐批寫入器。
+    各欄位的型別 (整數 / 浮點數 / categorical) 先由第一批決定，之後的批次轉換為相同型別。
+    後續批次與第一批的型別不一致時 (例如第一批全為空白的欄位之後出現文字、整數欄位之後出現空白)，
+    停止逐批寫入；若有指定 csv_path (同時寫出的 CSV)，close() 時改由完整的 CSV 重新寫出 parquet
+    (write_columnar_from_csv，型別依整個檔案決定，與一般模式的 to_columnar_frame 相同)，
+    否則放棄欄式輸出並刪除不完整的檔案，讀取端會自動退回讀取 CSV。未安裝 pyarrow 時不做任何事。
+    """
+
+    def __init__(self, filepath, csv_path=None, chunksize=None):
+        self.filepath = filepath
+        self.csv_path = csv_path
+        self.chunksize = chunksize
+        self._writer = None
+        self._schema = None
+        self._deferred = False
+        self.failed = pq is None
+        if pq is None:
+            print(f"提示：未安裝 pyarrow，略過欄式檔案 {filepath} 的輸出。")
+
+    def _typed_chunk(self, df):
+        typed_columns = {}
+        for column, field in zip(df.columns, self._schema):
+            series = df[column]
+            if series.dtype == object:
+                series = series.where(~series.isin(CSV_NA_VALUES), np.nan)
+            if pa.types.is_dictionary(field.type):
+                series = series.astype('category')
+            else:
+                series = pd.to_numeric(series) # 無法轉換時拋出例外
+            typed_columns[column] = series
+        typed_df = pd.DataFrame(typed_columns, index=df.index)
+        typed_df.columns = df.columns
+        return typed_df
+
+    def write(self, df):
+        if self.failed or self._deferred:
+            return
+        try:
+            if self._writer is None:
+                table = pa.Table.from_pandas(to_columnar_frame(df), preserve_index=False)
+                self._schema = _int32_dictionary_schema(table.schema)
+                table = table.cast(self._schema)
+                self._writer = pq.ParquetWriter(self.filepath, self._schema)
+            else:
+                table = pa.Table.from_pandas(self._typed_chunk(df), schema=self._schema, preserve_index=False)
+            self._writer.write_table(table)
+        except Exception as e:
+            if self.csv_path is None:
+                self.abort(e)
+                return
+            print(f"提示：欄位型別在批次間不一致 ({e})，完成後改由 {self.csv_path} 重新寫出欄式檔案。")
+            self._deferred = True
+            self._discard()
+
+    def _discard(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+
+    def abort(self, error=None):
+        """放棄欄式輸出並刪除不完整的檔案"""
+        if self.failed:
+            return
+        self.failed = True
+        if error is not None:
+            print(f"警告：欄位型別在批次間不一致或寫入失敗，略過欄式檔案 {self.filepath}：{error}")
+        self._discard()
+
+    def close(self):
+        """完成寫入；需要時由 CSV 重新寫出 (CSV 必須已完整寫出並關閉)"""
+        if self.failed:
+            return
+        if self._deferred:
+            self.failed = not write_columnar_from_csv(self.csv_path, self.filepath, self.chunksize)
+        elif self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            print(f"成功儲存欄式檔案: {self.filepath}")
+
+
+def _int32_dictionary_schema(schema):
+    """字典索引統一使用 int32，避免後續批次的類別數超過第一批時無法寫入"""
+    fields = [pa.field(field.name, pa.dictionary(pa.int32(), field.type.value_type))
+              if pa.types.is_dictionary(field.type) else field
+              for field in schema]
+    return pa.schema(fields, metadata=schema.metadata)
+
+def _read_labeled_chunks(csv_path, chunksize):
+    return pd.read_csv(csv_path, chunksize=chunksize, dtype=str, encoding='utf-8-sig', low_memory=False)
+
+def write_columnar_from_csv(csv_path, filepath, chunksize=None):
+    """
+    由標註 CSV 分批寫出 parquet，型別依整個檔案決定 (與 to_columnar_frame 對整份資料推斷的結果相同)：
+    所有非遺漏值都是數字的欄位為數值 (有遺漏值或小數時為浮點數)，其餘為 categorical。
+    讀取 CSV 兩次 (第一次只判斷型別)，尖峰記憶體只與 chunksize 有關。
+    回傳是否成功；失敗時刪除不完整的檔案。未安裝 pyarrow 時回傳 False。
+    """
+    if pq is None:
+        return False
+    chunksize = chunksize or 100_000
+    print(f"\n--- 正在由 {csv_path} 重新寫出欄式檔案 {filepath} ---")
+    writer = None
+    try:
+        text_columns, float_columns = set(), set()
+        for chunk in _read_labeled_chunks(csv_path, chunksize):
+            for column in chunk.columns:
+                if column in text_columns:
+                    continue
+                try:
+                    values = pd.to_numeric(chunk[column])
+                except (ValueError, TypeError):
+                    text_columns.add(column)
+                    continue
+                if values.dtype.kind == 'f':
+                    float_columns.add(column)
+
+        for chunk in _read_labeled_chunks(csv_path, chunksize):
+            typed_columns = {}
+            for column in chunk.columns:
+                if column in text_columns:
+                    typed_columns[column] = chunk[column].astype(pd.CategoricalDtype(
+                        pd.Index(chunk[column].dropna().unique(), dtype=object)))
+                else:
+                    typed_columns[column] = pd.to_numeric(chunk[column]).astype(
+                        'float64' if column in float_columns else 'int64')
+            typed_df = pd.DataFrame(typed_columns, index=chunk.index)
+            typed_df.columns = chunk.columns
+            table = pa.Table.from_pandas(typed_df, preserve_index=False)
+            if writer is None:
+                schema = _int32_dictionary_schema(table.schema)
+                schema = pa.schema([pa.field(field.name, pa.dictionary(pa.int32(), pa.string()))
+                                    if pa.types.is_dictionary(field.type) else field for field in schema],
+                                   metadata=schema.metadata)
+                writer = pq.ParquetWriter(filepath, schema)
+            writer.write_table(table.cast(writer.schema))
+        if writer is None: # 沒有資料列
+            return False
+        writer.close()
+        print(f"成功儲存欄式檔案: {filepath}")
+        return True
+    except Exception as e:
+        print(f"警告：由 CSV 寫出欄式檔案失敗，略過 {filepath}：{e}")
+        if writer is not None:
+            writer.close()
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        return False
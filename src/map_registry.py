@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+"""
+預先編譯的 map registry：把 maps/ 下所有 id_map 與 value map JSON 編譯為
+可記憶體映射 (memory-map) 的 Arrow IPC 檔，避免每個使用端每次啟動都重新
+解析 JSON、把鍵轉成字串、再重新組合 general + 特定對應表。
+
+registry 存放於 maps/registry/，包含兩個檔案：
+- value_labels.arrow：去重後的 value map，每列一個 (map_id, 代碼字串, 整數代碼, 標籤)，
+  同一個 map 的列連續存放；各資料集的 general_options 也是其中的 map。
+- columns.arrow：每個資料集的每個變項一列 (資料集前綴, 變項代碼, 說明文字, 特定 map_id)；
+  schema metadata 記錄各資料集 general_options 的 map_id 與來源 JSON 的指紋。
+
+open_registry 在來源 JSON 有變動 (或 registry 不存在) 時自動重新編譯；
+讀取端只在實際用到某個資料集或某個 map 時才把對應的列轉為 dict，並快取結果。
+使用端以 load_map_json 讀取 map 檔 (優先使用 registry，無法使用時直接讀取 JSON)。
+未安裝 pyarrow 或 registry 無法寫入時，各函式回傳 None，由呼叫端退回直接讀取 JSON。
+
+用法 (於 src/ 目錄下執行，手動重新編譯並顯示統計)：
+    python map_registry.py
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+
+from build_manifest import file_fingerprint
+from value_mapping import CompiledValueMaps, code_table
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError: # pyarrow 為選用套件，未安裝時使用端直接讀取 JSON
+    pa = None
+    ipc = None
+
+REGISTRY_DIRNAME = 'registry'
+LABELS_FILENAME = 'value_labels.arrow'
+COLUMNS_FILENAME = 'columns.arrow'
+MAP_FILE_PATTERN = re.compile(r'^tigps_w1_(?P<prefix>[a-z]+)_(?P<kind>id_map|value_maps)\.json$')
+NO_MAP = -1
+REGISTRY_FORMAT_VERSION = 1 # registry 檔案格式改變時遞增，舊的 registry 會自動重新編譯
+
+_open_registries = {} # registry 目錄的絕對路徑 -> MapRegistry (同一行程內共用)
+
+
+def registry_dir_for(map_dir):
+    return os.path.join(map_dir, REGISTRY_DIRNAME)
+
+def discover_map_files(map_dir):
+    """回傳 {前綴: {'id_map': 路徑, 'value_maps': 路徑}} (依前綴排序)"""
+    found = {}
+    for filepath in sorted(glob.glob(os.path.join(map_dir, 'tigps_w1_*.json'))):
+        match = MAP_FILE_PATTERN.match(os.path.basename(filepath))
+        if match:
+            found.setdefault(match.group('prefix'), {})[match.group('kind')] = filepath
+    return found
+
+def _read_json(filepath):
+    # 使用 utf-8-sig 來處理可能的 BOM
+    with open(filepath, 'r', encoding='utf-8-sig') as f:
+        return json.load(f)
+
+def _source_fingerprints(map_dir, previous=None):
+    previous = previous or {}
+    fingerprints = {}
+    for files in discover_map_files(map_dir).values():
+        for filepath in files.values():
+            name = os.path.basename(filepath)
+            fingerprints[name] = file_fingerprint(filepath, previous.get(name))
+    return fingerprints
+
+def _build_id(fingerprints):
+    payload = json.dumps([REGISTRY_FORMAT_VERSION, sorted((name, fp['sha256']) for name, fp in fingerprints.items())])
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+# --- 編譯 ---
+def compile_registry(map_dir):
+    """將 map_dir 下的所有 map JSON 編譯為 registry，回傳 registry 目錄；未安裝 pyarrow 時回傳 None"""
+    if pa is None:
+        return None
+    map_ids = {}      # map 內容的 key -> map_id
+    map_entries = []  # map_id -> [(代碼字串, 標籤), ...] (保留第一次出現時的順序)
+
+    def register(mapping):
+        entries = [(str(k), str(v)) for k, v in mapping.items()]
+        key = tuple(sorted(entries))
+        if key not in map_ids:
+            map_ids[key] = len(map_entries)
+            map_entries.append(entries)
+        return map_ids[key]
+
+    column_rows = {'prefix': [], 'variable': [], 'description': [], 'map_id': []}
+    general_map_ids = {}
+    prefix_rows = {} # 前綴 -> [起始列, 結束列)；同一資料集的變項連續存放
+    for prefix, files in discover_map_files(map_dir).items():
+        id_map = _read_json(files['id_map']) if 'id_map' in files else {}
+        value_maps = _read_json(files['value_maps']) if 'value_maps' in files else {}
+        general_map_ids[prefix] = register(value_maps.get('general_options', {}) or {})
+        specific_maps = value_maps.get('value_maps', {}) or {}
+
+        variables = list(dict.fromkeys([str(k) for k in id_map] + [str(k) for k in specific_maps]))
+        for variable in variables:
+            specific_map = specific_maps.get(variable)
+            column_rows['prefix'].append(prefix)
+            column_rows['variable'].append(variable)
+            column_rows['description'].append(id_map.get(variable))
+            column_rows['map_id'].append(register(specific_map) if isinstance(specific_map, dict) else NO_MAP)
+        prefix_rows[prefix] = [len(column_rows['variable']) - len(variables), len(column_rows['variable'])]
+
+    label_rows = {'map_id': [], 'code': [], 'code_int': [], 'label': []}
+    for map_id, entries in enumerate(map_entries):
+        for code, label in entries:
+            label_rows['map_id'].append(map_id)
+            label_rows['code'].append(code)
+            label_rows['code_int'].append(int(code) if re.fullmatch(r'-?\d+', code) else None)
+            label_rows['label'].append(label)
+
+    sources = _source_fingerprints(map_dir)
+    metadata = {
+        'build_id': _build_id(sources),
+        'sources': json.dumps(sources),
+        'general_map_ids': json.dumps(general_map_ids),
+        'prefix_rows': json.dumps(prefix_rows),
+    }
+    labels_table = pa.table({
+        'map_id': pa.array(label_rows['map_id'], pa.int32()),
+        'code': pa.array(label_rows['code'], pa.string()),
+        'code_int': pa.array(label_rows['code_int'], pa.int64()),
+        'label': pa.array(label_rows['label'], pa.string()).dictionary_encode(),
+    }).replace_schema_metadata({'build_id': metadata['build_id']})
+    columns_table = pa.table({
+        'prefix': pa.array(column_rows['prefix'], pa.string()).dictionary_encode(),
+        'variable': pa.array(column_rows['variable'], pa.string()),
+        'description': pa.array(column_rows['description'], pa.string()),
+        'map_id': pa.array(column_rows['map_id'], pa.int32()),
+    }).replace_schema_metadata(metadata)
+
+    registry_dir = registry_dir_for(map_dir)
+    os.makedirs(registry_dir, exist_ok=True)
+    # 兩個檔案帶有相同的 build_id；各自寫完才取代，讀取端會檢查兩者一致
+    for filename, table in ((LABELS_FILENAME, labels_table), (COLUMNS_FILENAME, columns_table)):
+        filepath = os.path.join(registry_dir, filename)
+        temp_path = f"{filepath}.{os.getpid()}.tmp"
+        with pa.OSFile(temp_path, 'wb') as sink, ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(temp_path, filepath)
+    return registry_dir
+
+
+# --- 讀取 ---
+def _column_to_list(table, name):
+    """Arrow 欄位轉為 Python list (經由 numpy，比 to_pylist 快數倍)"""
+    array = table.column(name).combine_chunks()
+    if pa.types.is_dictionary(array.type):
+        array = array.dictionary_decode()
+    return array.to_numpy(zero_copy_only=False).tolist()
+
+def _read_schema_metadata(filepath):
+    with pa.memory_map(filepath, 'r') as source:
+        metadata = ipc.open_file(source).schema.metadata or {}
+    return {k.decode('utf-8'): v.decode('utf-8') for k, v in metadata.items()}
+
+def _is_fresh(registry_dir, map_dir):
+    """registry 存在、兩個檔案屬於同一次編譯，且來源 JSON 沒有改變"""
+    labels_path = os.path.join(registry_dir, LABELS_FILENAME)
+    columns_path = os.path.join(registry_dir, COLUMNS_FILENAME)
+    if not (os.path.exists(labels_path) and os.path.exists(columns_path)):
+        return False
+    metadata = _read_schema_metadata(columns_path)
+    if _read_schema_metadata(labels_path).get('build_id') != metadata.get('build_id'):
+        return False
+    stored_sources = json.loads(metadata.get('sources', '{}'))
+    current_sources = _source_fingerprints(map_dir, stored_sources)
+    return _build_id(current_sources) == metadata.get('build_id')
+
+def open_registry(map_dir):
+    """
+    取得 map_dir 的 MapRegistry；registry 不存在或來源 JSON 有變動時先重新編譯。
+    檢查只需 stat 來源檔 (大小與修改時間不變時不重新計算雜湊)。
+    未安裝 pyarrow 或無法編譯 / 寫入時回傳 None。
+    """
+    if pa is None or not discover_map_files(map_dir):
+        return None
+    registry_dir = os.path.abspath(registry_dir_for(map_dir))
+    try:
+        if not _is_fresh(registry_dir, map_dir):
+            compile_registry(map_dir)
+            _open_registries.pop(registry_dir, None)
+    except (OSError, ValueError, pa.ArrowException) as e:
+        print(f"警告：無法編譯 map registry ({registry_dir})，改為直接讀取 JSON：{e}")
+        return None
+    registry = _open_registries.get(registry_dir)
+    if registry is None:
+        registry = _open_registries[registry_dir] = MapRegistry(registry_dir)
+    return registry
+
+
+class MapRegistry:
+    """
+    已編譯 registry 的讀取端。
+    Arrow 檔以記憶體映射開啟 (不複製資料)，第一次用到時才開啟；
+    各資料集 / 各 map 轉為 Python dict 的結果會被快取 (回傳的 dict 為共用物件，請勿修改)。
+    """
+
+    def __init__(self, registry_dir):
+        self.registry_dir = registry_dir
+        self._labels = None
+        self._columns = None
+        self._cache = {}
+
+    def _load(self):
+        if self._labels is not None:
+            return
+        self._labels = self._read_table(LABELS_FILENAME)
+        self._columns = self._read_table(COLUMNS_FILENAME)
+        metadata = self._columns.schema.metadata or {}
+        self._general_map_ids = json.loads(metadata.get(b'general_map_ids', b'{}'))
+        self._prefix_rows = json.loads(metadata.get(b'prefix_rows', b'{}'))
+
+    def _read_table(self, filename):
+        source = pa.memory_map(os.path.join(self.registry_dir, filename), 'r')
+        return ipc.open_file(source).read_all()
+
+    def _cached(self, key, build):
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    @property
+    def prefixes(self):
+        self._load()
+        return list(self._prefix_rows)
+
+    def _all_value_maps(self):
+        """一次將所有 value map 轉為 dict (總共只有數千列，比逐一切片快)"""
+        def build():
+            maps = {}
+            columns = [_column_to_list(self._labels, name) for name in ('map_id', 'code', 'label')]
+            for map_id, code, label in zip(*columns):
+                maps.setdefault(map_id, {})[code] = label
+            return maps
+        return self._cached('maps', build)
+
+    @property
+    def map_count(self):
+        """registry 中不同 value map 的數量 (含各資料集的 general_options)"""
+        self._load()
+        return len(self._all_value_maps())
+
+    def value_map(self, map_id):
+        """{代碼字串: 標籤} (與 JSON 中的單一 map 相同)"""
+        self._load()
+        return self._all_value_maps().get(map_id, {})
+
+    def _column_rows(self, prefix):
+        self._load()
+        if prefix not in self._prefix_rows:
+            raise KeyError(f"registry 中沒有資料集 {prefix}")
+        start, stop = self._prefix_rows[prefix]
+        def build():
+            rows = self._columns.slice(start, stop - start)
+            return {name: _column_to_list(rows, name) for name in ('variable', 'description', 'map_id')}
+        return self._cached(('rows', prefix), build)
+
+    def id_map(self, prefix):
+        """{變項代碼: 說明文字} (與 tigps_w1_{prefix}_id_map.json 相同)"""
+        def build():
+            rows = self._column_rows(prefix)
+            return {variable: description for variable, description in zip(rows['variable'], rows['description'])
+                    if description is not None}
+        return self._cached(('id_map', prefix), build)
+
+    def general_options(self, prefix):
+        self._load()
+        return self.value_map(self._general_map_ids[prefix])
+
+    def value_maps(self, prefix):
+        """{'general_options': ..., 'value_maps': ...} (與 tigps_w1_{prefix}_value_maps.json 相同)"""
+        def build():
+            rows = self._column_rows(prefix)
+            maps = self._all_value_maps()
+            specific = {variable: maps.get(map_id, {}) for variable, map_id in zip(rows['variable'], rows['map_id'])
+                        if map_id != NO_MAP}
+            return {'general_options': self.general_options(prefix), 'value_maps': specific}
+        return self._cached(('value_maps', prefix), build)
+
+    def compiled_value_maps(self, prefix):
+        """資料集的 CompiledValueMaps (每種特定 map 只與 general 組合一次，不需重新去重)"""
+        def build():
+            rows = self._column_rows(prefix)
+            maps = self._all_value_maps()
+            general_map = self.general_options(prefix)
+            combined_maps = {} # 特定 map_id -> general + 特定組合後的對應表
+            column_maps = {}
+            for variable, map_id in zip(rows['variable'], rows['map_id']):
+                if map_id == NO_MAP or not maps.get(map_id):
+                    continue
+                combined_map = combined_maps.get(map_id)
+                if combined_map is None:
+                    combined_map = combined_maps[map_id] = {**general_map, **maps[map_id]} # 特定選項優先
+                column_maps[variable] = combined_map
+            return CompiledValueMaps.from_tables(general_map, column_maps)
+        return self._cached(('compiled', prefix), build)
+
+    def code_table(self, prefix, variable):
+        """
+        變項的整數代碼與標籤表 (general + 特定組合後，依代碼排序)：
+        回傳 (codes: int64 ndarray, labels: object ndarray)；非整數代碼不包含在內。
+        """
+        return self._cached(('code_table', prefix, variable),
+                            lambda: code_table(self.compiled_value_maps(prefix).for_column(variable)))
+
+    def label_to_code(self, prefix, variable):
+        """變項的反查表 {標籤: 代碼字串}；同一標籤對應多個代碼時，特定選項優先於通用選項"""
+        def build():
+            self._load()
+            specific_map = self.value_map(self._variable_map_id(prefix, variable))
+            reverse = {label: code for code, label in reversed(list(self.general_options(prefix).items()))}
+            reverse.update({label: code for code, label in reversed(list(specific_map.items()))})
+            return reverse
+        return self._cached(('label_to_code', prefix, variable), build)
+
+    def _variable_map_id(self, prefix, variable):
+        rows = self._column_rows(prefix)
+        lookup = self._cached(('map_ids', prefix), lambda: dict(zip(rows['variable'], rows['map_id'])))
+        map_id = lookup.get(str(variable), NO_MAP)
+        return map_id if map_id != NO_MAP else self._general_map_ids[prefix]
+
+    def description_to_code(self, prefix):
+        """反查表 {說明文字: 變項代碼}；說明文字重複時取第一個"""
+        def build():
+            reverse = {}
+            for code, description in self.id_map(prefix).items():
+                reverse.setdefault(description, code)
+            return reverse
+        return self._cached(('description_to_code', prefix), build)
+
+
+# --- 使用端的便利函式 ---
+def _registry_for_file(filepath):
+    """由 map JSON 路徑取得 (registry, 前綴, 種類)；不是 map 檔或無法使用 registry 時回傳 None"""
+    match = MAP_FILE_PATTERN.match(os.path.basename(filepath))
+    if match is None or not os.path.exists(filepath):
+        return None
+    registry = open_registry(os.path.dirname(filepath) or '.')
+    if registry is None:
+        return None
+    return registry, match.group('prefix'), match.group('kind')
+
+def load_registered_map(filepath):
+    """
+    以 registry 取得 map JSON 檔的內容 (與 json.load 的結果相同)。
+    不是 map 檔、檔案不存在或無法使用 registry 時回傳 None，由呼叫端改為直接讀取 JSON。
+    """
+    found = _registry_for_file(filepath)
+    if found is None:
+        return None
+    registry, prefix, kind = found
+    return registry.id_map(prefix) if kind == 'id_map' else registry.value_maps(prefix)
+
+def load_map_json(filepath):
+    """
+    讀取 map JSON 檔：優先以 registry 取得 (load_registered_map)，無法使用時直接解析 JSON。
+    找不到檔案時拋出 FileNotFoundError，JSON 格式錯誤時拋出 json.JSONDecodeError。
+    """
+    data = load_registered_map(filepath)
+    if data is None:
+        data = _read_json(filepath)
+    return data
+
+def registered_compiled_maps(value_map_path):
+    """以 registry 取得 value map 檔對應的 CompiledValueMaps；無法使用 registry 時回傳 None"""
+    found = _registry_for_file(value_map_path)
+    if found is None or found[2] != 'value_maps':
+        return None
+    registry, prefix, _ = found
+    return registry.compiled_value_maps(prefix)
+
+
+if __name__ == "__main__":
+    map_dir = sys.argv[1] if len(sys.argv) > 1 else '../maps/'
+    if pa is None:
+        raise SystemExit("未安裝 pyarrow，無法編譯 map registry。")
+    registry_dir = compile_registry(map_dir)
+    registry = open_registry(map_dir)
+    source_size = sum(os.path.getsize(p) for files in discover_map_files(map_dir).values() for p in files.values())
+    registry_size = sum(os.path.getsize(os.path.join(registry_dir, name)) for name in (LABELS_FILENAME, COLUMNS_FILENAME))
+    registry._load()
+    print(f"已編譯 map registry: {registry_dir}")
+    print(f"資料集: {registry.prefixes}")
+    print(f"不同的 value map: {registry.map_count} 種，"
+          f"共 {registry._labels.num_rows} 個代碼/標籤，{registry._columns.num_rows} 個變項")
+    print(f"來源 JSON: {source_size / 1024:.1f} KB -> registry: {registry_size / 1024:.1f} KB")
@@ -5,6 +5,20 @@ import time
 import pprint
 from collections import Counter
 import os # 引入 os 模組來處理路徑
+import sys
+import argparse
+import contextlib
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from value_mapping import VALUE_RULE, CompiledValueMaps, translate_values
+from labeled_store import (ColumnarChunkWriter, labeled_csv_path, labeled_parquet_path, save_columnar,
+                           to_columnar_frame)
+from build_manifest import (check_build_status, column_map_fingerprints, load_manifest, manifest_path_for,
+                            record_build)
+from map_registry import load_map_json, open_registry, registered_compiled_maps
+from unmapped_audit import UnmappedValueAudit
+from pipeline_trace import PipelineTrace, traced
+from schema_preflight import description_collisions, print_preflight_report, read_header, run_preflight
 
 # --- 設定基本路徑 ---
 # 請根據您的檔案存放位置修改
@@ -19,12 +33,10 @@ os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(MAP_DIR, exist_ok=True)
 
 def load_json(filepath):
-    """載入 JSON 檔案"""
+    """載入 JSON 檔案 (maps/ 下的 map 檔優先從預先編譯的 map registry 取得，見 map_registry.py)"""
     print(f"正在讀取 JSON 檔案: {filepath}")
     try:
-        # *** 注意：使用 utf-8-sig 來處理可能的 BOM ***
-        with open(filepath, 'r', encoding='utf-8-sig') as f:
-            data = json.load(f)
+        data = load_map_json(filepath) # 以 utf-8-sig 處理可能的 BOM
         print(f"成功讀取: {filepath}")
         return data
     except FileNotFoundError:
@@ -56,9 +68,116 @@ def load_csv(filepath):
         return None
 
 # --- 新的/修改後的值轉換函式 ---
-def map_all_values(df, general_options, specific_maps):
+def print_value_mapping_report(value_mapped_count, skipped_columns_errors, unmapped_entries,
+                               elapsed, max_unmapped_to_print):
+    """列印值轉換結束後的報告 (新舊引擎共用)"""
+    print("\n--- 值轉換完成 ---")
+    print(f"嘗試轉換 {value_mapped_count} 個欄位的值 (使用通用選項，並優先應用特定選項)。")
+    print(f"因處理錯誤而跳過 {len(skipped_columns_errors)} 個欄位。")
+    print(f"值轉換過程耗時: {elapsed:.2f} 秒。")
+
+    if skipped_columns_errors:
+        print("\n--- 以下欄位因處理錯誤而被跳過 ---")
+        pprint.pprint(skipped_columns_errors)
+    if unmapped_entries:
+        print(f"\n--- 以下資料點的值無法在對應的 Value Map 中找到 (最多顯示 {max_unmapped_to_print} 筆) ---")
+        print("(索引, 欄位名稱, 未能轉換的值)")
+        # 使用 pprint 處理可能包含換行符的欄位名稱或值
+        for entry in unmapped_entries:
+             pprint.pprint(entry) # 逐行打印以獲得更好格式
+    elif value_mapped_count > 0 and not skipped_columns_errors:
+         print("\n--- 所有欄位均已嘗試應用通用或特定 Value Map ---")
+    elif value_mapped_count == 0 and not skipped_columns_errors:
+        print("\n--- 沒有欄位需要進行值轉換，或所有欄位均無錯誤 ---")
+
+def map_values_with(df, compiled_maps, unmapped_entries, skipped_columns_errors, max_unmapped_to_print,
+                    audit=None, trace=None, dataset=None):
+    """
+    以預先編譯的 compiled_maps 轉換 df 的所有欄位 (map_all_values 與串流模式共用)。
+    未對應的值與處理錯誤會累加到 unmapped_entries / skipped_columns_errors，
+    因此串流模式可跨批次累計同一份報告。回傳 (轉換後的新 DataFrame, 已轉換欄位數)。
+    audit (UnmappedValueAudit) 若有指定，另外記錄所有欄位的完整未對應值 (見 unmapped_audit.py)。
+    trace (PipelineTrace) 若有指定，記錄每個欄位的轉換耗時 (見 pipeline_trace.py)，dataset 為資料集前綴。
+    """
+    if audit is not None:
+        audit.add_rows(len(df))
+    value_mapped_count = 0
+    # 先收集所有轉換後的欄位，最後一次組成新的 DataFrame (不修改原始傳入的 DataFrame)
+    new_columns = {}
+    for original_code in df.columns:
+        column = df[original_code]
+        combined_map = compiled_maps.for_column(original_code)
+
+        # 如果組合後的對應表是空的，則保留原欄位
+        if not combined_map:
+            new_columns[original_code] = column
+            continue
+
+        try:
+            column_start = time.perf_counter()
+            labels, failed_positions = translate_values(column, combined_map)
+            if trace is not None:
+                trace.record_column(dataset, original_code, time.perf_counter() - column_start, len(column))
+            if audit is not None:
+                audit.record(original_code, labels, failed_positions, df, compiled_maps.has_specific(original_code))
+
+            # --- 記錄未對應的值 (與舊版相同，最多 max_unmapped_to_print 筆) ---
+            if len(failed_positions) and len(unmapped_entries) <= max_unmapped_to_print:
+                remaining = max_unmapped_to_print - len(unmapped_entries)
+                for pos in failed_positions[:remaining]:
+                    unmapped_entries.append((df.index[pos], original_code, column.iat[pos]))
+                if len(failed_positions) > remaining and len(unmapped_entries) == max_unmapped_to_print:
+                    unmapped_entries.append(("...", f"達到顯示上限 ({max_unmapped_to_print})", "..."))
+
+            new_columns[original_code] = pd.Series(labels, index=df.index, name=original_code)
+            value_mapped_count += 1 # 記錄已處理（嘗試轉換）的欄位數
+
+        except Exception as e:
+            print(f"  處理欄位 '{original_code}' (原始 Dtype: {column.dtype}) 時發生錯誤: {e}")
+            skipped_columns_errors.append(f"{original_code} (原因: 處理時發生錯誤)")
+            new_columns[original_code] = column
+
+    processed_df = pd.DataFrame(new_columns, index=df.index)
+    processed_df.columns = df.columns
+    return processed_df, value_mapped_count
+
+def map_all_values(df, general_options, specific_maps, compiled_maps=None, audit=None, trace=None, dataset=None):
     """
-    在 DataFrame 上進行值的轉換。
+    在 DataFrame 上進行值的轉換 (編譯式引擎，見 value_mapping.py)。
+    對所有欄位應用 general_options。
+    如果欄位有 specific_map，則 specific_map 中的規則優先於 general_options。
+    每種不同的 value map 只編譯一次，並以整數索引陣列查表轉換，
+    結果與 map_all_values_legacy (astype(str).replace) 完全相同。
+    compiled_maps 若已預先編譯 (例如取自 map registry)，直接使用而不重新編譯。
+    audit 若有指定，另外彙整所有欄位的完整未對應值報告 (終端機仍只列出前 50 筆)。
+    trace 若有指定，記錄每個欄位的轉換耗時。
+    """
+    print("\n--- 開始轉換數值為標籤 (優先使用特定對應，並應用通用對應) ---")
+    start_time = time.time()
+    skipped_columns_errors = []
+    unmapped_entries = []
+    MAX_UNMAPPED_TO_PRINT = 50
+
+    if compiled_maps is None:
+        compiled_maps = CompiledValueMaps(general_options, specific_maps)
+    print(f"已編譯 {compiled_maps.distinct_map_count} 種不同的特定 Value Map (共 {compiled_maps.column_count} 個欄位使用)。")
+
+    processed_df, value_mapped_count = map_values_with(df, compiled_maps, unmapped_entries,
+                                                       skipped_columns_errors, MAX_UNMAPPED_TO_PRINT, audit,
+                                                       trace, dataset)
+
+    # --- 處理結束後的報告 ---
+    print_value_mapping_report(value_mapped_count, skipped_columns_errors, unmapped_entries,
+                               time.time() - start_time, MAX_UNMAPPED_TO_PRINT)
+
+    return processed_df # 返回處理過的新 DataFrame
+
+def map_all_values_legacy(df, general_options, specific_maps):
+    """
+    在 DataFrame 上進行值的轉換 (舊版逐欄 astype(str).replace 引擎)。
+    保留作為 map_all_values 的對照基準 (見 bench_value_mapping.py)。
+    以 str(值) 查表，因此與 map_all_values 只在代碼字串不同的值上有差異
+    (例如含空白而被讀成浮點數的 4.0 在此為 '4.0'，查不到鍵 '4')。
     對所有欄位應用 general_options。
     如果欄位有 specific_map，則 specific_map 中的規則優先於 general_options。
     """
@@ -139,25 +258,8 @@ def map_all_values(df, general_options, specific_maps):
             skipped_columns_errors.append(f"{original_code} (原因: 處理時發生錯誤)")
 
     # --- 處理結束後的報告 ---
-    end_time = time.time()
-    print("\n--- 值轉換完成 ---")
-    print(f"嘗試轉換 {value_mapped_count} 個欄位的值 (使用通用選項，並優先應用特定選項)。")
-    print(f"因處理錯誤而跳過 {len(skipped_columns_errors)} 個欄位。")
-    print(f"值轉換過程耗時: {end_time - start_time:.2f} 秒。")
-
-    if skipped_columns_errors:
-        print("\n--- 以下欄位因處理錯誤而被跳過 ---")
-        pprint.pprint(skipped_columns_errors)
-    if unmapped_entries:
-        print(f"\n--- 以下資料點的值無法在對應的 Value Map 中找到 (最多顯示 {MAX_UNMAPPED_TO_PRINT} 筆) ---")
-        print("(索引, 欄位名稱, 未能轉換的值)")
-        # 使用 pprint 處理可能包含換行符的欄位名稱或值
-        for entry in unmapped_entries:
-             pprint.pprint(entry) # 逐行打印以獲得更好格式
-    elif value_mapped_count > 0 and not skipped_columns_errors:
-         print("\n--- 所有欄位均已嘗試應用通用或特定 Value Map ---")
-    elif value_mapped_count == 0 and not skipped_columns_errors:
-        print("\n--- 沒有欄位需要進行值轉換，或所有欄位均無錯誤 ---")
+    print_value_mapping_report(value_mapped_count, skipped_columns_errors, unmapped_entries,
+                               time.time() - start_time, MAX_UNMAPPED_TO_PRINT)
 
     return processed_df # 返回處理過的新 DataFrame
 
@@ -221,26 +323,40 @@ def save_csv(df, filepath):
         return False
 
 # --- 修改後的資料集處理流程 ---
-def process_dataset(prefix, data_dir, map_dir):
-    """處理單一資料集的完整流程 (先轉換值，再重新命名欄位)"""
+def process_dataset(prefix, data_dir, map_dir, chunksize=None, force=False, trace=None):
+    """
+    處理單一資料集的完整流程 (先轉換值，再重新命名欄位)。
+    chunksize 若有指定，改用串流模式 (見 process_dataset_streaming)，記憶體用量只與批次大小有關。
+    依建置紀錄 (build_manifest.py) 判斷：輸入與輸出都沒變時略過；
+    只有部分欄位的 value map 改變時，只重新轉換這些欄位。force=True 時一律完整重建。
+    轉換成功後，所有欄位的未對應值完整報告寫入 data/audits/ (見 unmapped_audit.py)。
+    讀取原始資料之前先以 CSV 標題列檢查 id_map 說明文字衝突 (見 schema_preflight.py)，有衝突時立即失敗。
+    trace (PipelineTrace) 若有指定，記錄各階段的耗時、CPU 時間、尖峰 RSS 與列數 / 欄數 (見 pipeline_trace.py)。
+    回傳結果摘要 dict (prefix, status, rows, cols, output_path, message)，
+    供批次模式彙整；status 為 'ok'、'skipped' 或 'failed'。
+    """
     print(f"\n{'='*10} 開始處理資料集: {prefix} {'='*10}")
+    result = {'prefix': prefix, 'status': 'failed', 'rows': None, 'cols': None,
+              'output_path': None, 'message': ''}
 
     # --- 建構檔案路徑 ---
     # 保持檔名結構，但路徑來自參數
     id_map_path = os.path.join(map_dir, f'tigps_w1_{prefix}_id_map.json')
     value_map_path = os.path.join(map_dir, f'tigps_w1_{prefix}_value_maps.json')
     csv_path = os.path.join(data_dir, f'TIGPSw1_{prefix}.csv')
-    output_path = os.path.join(data_dir, f'TIGPSw1_{prefix}_descriptive_labeled.csv')
+    output_path = labeled_csv_path(data_dir, prefix)
+    columnar_output_path = labeled_parquet_path(data_dir, prefix) # 欄式輸出 (標籤為 categorical)
+    manifest_path = manifest_path_for(data_dir, prefix)
+    input_paths = {'raw_csv': csv_path, 'id_map': id_map_path, 'value_map': value_map_path}
+    output_paths = {'csv': output_path, 'parquet': columnar_output_path}
+    # 值轉換規則與讀取模式不同時一律完整重建 (部分欄位的重新轉換也沿用建置時的讀取方式)
+    build_settings = {'value_rule': VALUE_RULE, 'read_mode': 'streaming' if chunksize else 'in_memory'}
 
     # --- 執行步驟 ---
-    loaded_id_map = load_json(id_map_path)
-    loaded_value_maps = load_json(value_map_path) # 載入包含 general 和 specific 的檔案
-    raw_data_df = load_csv(csv_path)
+    with traced(trace, 'load_maps', prefix):
+        loaded_id_map = load_json(id_map_path)
+        loaded_value_maps = load_json(value_map_path) # 載入包含 general 和 specific 的檔案
 
-    # --- 檢查檔案載入情況 ---
-    if raw_data_df is None: # 至少要有原始資料
-        print(f"資料集 {prefix} 因無法載入 CSV 檔案 {csv_path} 而無法處理。")
-        return
     if loaded_id_map is None:
         print(f"警告：資料集 {prefix} 缺少或無法讀取 id_map 檔案 {id_map_path}，欄位將不會被重新命名。")
         loaded_id_map = {} # 提供空字典以繼續執行，避免後續錯誤
@@ -248,6 +364,17 @@ def process_dataset(prefix, data_dir, map_dir):
         print(f"警告：資料集 {prefix} 缺少或無法讀取 value_map 檔案 {value_map_path}，將不會進行值轉換。")
         loaded_value_maps = {} # 提供空字典以繼續執行
 
+    # --- 預檢：只讀標題列，說明文字衝突時不做任何轉換 ---
+    if os.path.exists(csv_path):
+        with traced(trace, 'preflight', prefix):
+            collisions = description_collisions(read_header(csv_path), {str(k): v for k, v in loaded_id_map.items()})
+        if collisions:
+            print(f"\n*** 嚴重錯誤：id_map 中有 {len(collisions)} 個說明文字衝突，重新命名後會有重複欄位: ***")
+            pprint.pprint(collisions)
+            print("請修正 id_map (或執行 python schema_preflight.py --fix) 後重試。跳過此資料集。")
+            result['message'] = f"id_map 說明文字衝突 ({len(collisions)} 個)"
+            return result
+
     # --- 提取 general 和 specific maps ---
     # *** 提供預設空字典，確保即使檔案不存在或格式錯誤也能安全地獲取 ***
     general_options = loaded_value_maps.get('general_options', {})
@@ -256,20 +383,111 @@ def process_dataset(prefix, data_dir, map_dir):
     if not general_options and not specific_value_maps and loaded_value_maps is not None and loaded_value_maps != {}:
           print(f"警告：Value map 檔案 {value_map_path} 似乎是空的或缺少 'general_options'/'value_maps' 鍵。")
 
+    # 預先編譯的對應表 (map registry 無法使用時才由 JSON 內容編譯)
+    with traced(trace, 'compile_maps', prefix):
+        compiled_maps = registered_compiled_maps(value_map_path) if os.path.exists(value_map_path) else None
+        if compiled_maps is None:
+            compiled_maps = CompiledValueMaps(general_options, specific_value_maps)
+    audit = UnmappedValueAudit(prefix, loaded_id_map)
+
+    # --- 檢查建置紀錄，判斷是否需要重建 ---
+    column_fingerprints = column_map_fingerprints(general_options, specific_value_maps)
+    previous_manifest = load_manifest(manifest_path)
+    if force:
+        print("已指定強制重建，忽略建置紀錄。")
+    elif os.path.exists(csv_path):
+        with traced(trace, 'check_build', prefix):
+            build_status, detail = check_build_status(previous_manifest, input_paths, output_paths,
+                                                      column_fingerprints, build_settings)
+        if build_status == 'up_to_date':
+            print(f"資料集 {prefix} 的輸入與輸出均未改變，略過轉換。")
+            result.update(status='skipped', output_path=output_path, message="已是最新")
+            return result
+        if build_status == 'remap_columns':
+            raw_columns = previous_manifest.get('raw_columns', [])
+            if not detail:
+                print("Value map 檔案有變動，但沒有任何欄位的對應內容改變，只更新建置紀錄。")
+                record_build(manifest_path, input_paths, output_paths, column_fingerprints,
+                             raw_columns, previous=previous_manifest, settings=build_settings)
+                result.update(status='skipped', output_path=output_path, message="對應內容未改變")
+                return result
+            if len(detail) < len(raw_columns) and os.path.exists(columnar_output_path):
+                with traced(trace, 'remap_columns', prefix) as stage:
+                    result = remap_changed_columns(csv_path, output_path, columnar_output_path, loaded_id_map,
+                                                   compiled_maps, audit, detail, result, trace,
+                                                   read_as_text=bool(chunksize))
+                    stage.update(rows=result['rows'], columns=len(detail))
+                if result['status'] == 'ok':
+                    with traced(trace, 'write_audit', prefix):
+                        audit.write(data_dir, replace_columns=detail)
+                    record_build(manifest_path, input_paths, output_paths, column_fingerprints,
+                                 raw_columns, previous=previous_manifest, settings=build_settings)
+                    return result
+                print("部分欄位重新轉換失敗，改為完整重建。")
+            else:
+                print(f"有 {len(detail)} 個欄位的 value map 改變，需要完整重建。")
+        else:
+            print(f"需要完整重建：{detail}")
+
+    result = convert_dataset(csv_path, output_path, columnar_output_path, loaded_id_map,
+                             general_options, specific_value_maps, compiled_maps, audit, chunksize, result, trace)
+    if result['status'] == 'ok':
+        with traced(trace, 'write_audit', prefix):
+            audit.write(data_dir)
+        raw_columns = pd.read_csv(csv_path, nrows=0).columns
+        record_build(manifest_path, input_paths, output_paths, column_fingerprints,
+                     raw_columns, previous=previous_manifest, settings=build_settings)
+        print(f"\n{'='*10} 資料集: {prefix} 處理完成 {'='*10}")
+    return result
+
+
+def convert_dataset(csv_path, output_path, columnar_output_path, id_map,
+                    general_options, specific_value_maps, compiled_maps, audit, chunksize, result, trace=None):
+    """
+    完整轉換單一資料集：載入原始 CSV、轉換值、重新命名欄位並儲存 (chunksize 指定時改用串流模式)。
+    trace 若有指定，依 load_csv / map_all_values / rename / save_csv / save_columnar 分階段記錄。
+    """
+    prefix = result['prefix']
+    if chunksize:
+        # 串流模式稍後才分批讀取，這裡只確認檔案存在
+        if not os.path.exists(csv_path):
+            print(f"錯誤：找不到資料檔案 {csv_path}。")
+            result['message'] = f"無法載入 CSV 檔案 {csv_path}"
+            return result
+        with traced(trace, 'stream', prefix) as stage:
+            result = process_dataset_streaming(csv_path, output_path, columnar_output_path, id_map,
+                                               compiled_maps, audit, chunksize, result, trace)
+            stage.update(rows=result['rows'], columns=result['cols'])
+        return result
+
+    with traced(trace, 'load_csv', prefix) as stage:
+        raw_data_df = load_csv(csv_path)
+        if raw_data_df is not None:
+            stage.update(rows=raw_data_df.shape[0], columns=raw_data_df.shape[1])
+    # --- 檢查檔案載入情況 ---
+    if raw_data_df is None: # 至少要有原始資料
+        print(f"資料集因無法載入 CSV 檔案 {csv_path} 而無法處理。")
+        result['message'] = f"無法載入 CSV 檔案 {csv_path}"
+        return result
+
     # --- 步驟 1: 進行值轉換 ---
-    value_mapped_df = map_all_values(raw_data_df, general_options, specific_value_maps)
+    with traced(trace, 'map_all_values', prefix, *raw_data_df.shape):
+        value_mapped_df = map_all_values(raw_data_df, general_options, specific_value_maps, compiled_maps, audit,
+                                         trace, prefix)
 
     # --- 步驟 2: 進行欄位重新命名 ---
-    descriptive_df = rename_and_check_duplicates(value_mapped_df, loaded_id_map)
+    with traced(trace, 'rename', prefix, *value_mapped_df.shape):
+        descriptive_df = rename_and_check_duplicates(value_mapped_df, id_map)
 
     # 如果欄位重新命名失敗 (例如，因為 id_map 導致重複欄位名)
     if descriptive_df is None:
-        print(f"資料集 {prefix} 因欄位名稱重複問題停止處理 (在值映射之後發生)。")
+        print(f"資料集因欄位名稱重複問題停止處理 (在值映射之後發生)。")
         # 可考慮儲存僅轉換了值的 DataFrame
         # output_path_value_only = os.path.join(data_dir, f'TIGPSw1_{prefix}_value_mapped_only.csv')
         # print(f"嘗試儲存僅轉換值的結果到: {output_path_value_only}")
         # save_csv(value_mapped_df, output_path_value_only)
-        return
+        result['message'] = "id_map 導致欄位名稱重複"
+        return result
 
     # --- 最終結果就是 descriptive_df ---
     processed_df = descriptive_df
@@ -283,23 +501,291 @@ def process_dataset(prefix, data_dir, map_dir):
     print(processed_df.head())
 
     # 儲存結果
-    save_csv(processed_df, output_path)
+    with traced(trace, 'save_csv', prefix, *processed_df.shape):
+        saved = save_csv(processed_df, output_path)
+    if not saved:
+        result['message'] = f"無法儲存 {output_path}"
+        return result
+    with traced(trace, 'save_columnar', prefix, *processed_df.shape):
+        save_columnar(processed_df, columnar_output_path)
+
+    result.update(status='ok', rows=processed_df.shape[0], cols=processed_df.shape[1],
+                  output_path=output_path)
+    return result
+
+
+def remap_changed_columns(csv_path, output_path, columnar_output_path, id_map,
+                          compiled_maps, audit, changed_codes, result, trace=None, read_as_text=False):
+    """
+    只重新轉換 value map 有改變的欄位，並寫回既有的輸出檔。
+    以既有的 parquet 檔為基礎 (不需重新解析整份標註 CSV)，從原始 CSV 只讀取改變的欄位，
+    轉換後取代對應欄位，再重新輸出 CSV 與 parquet。遺漏值以 'nan' 寫出，與完整建置相同。
+    read_as_text=True 時與串流模式相同，以字串讀入原始值 (既有輸出由串流模式建置時使用)。
+    """
+    print(f"\n--- 只重新轉換 {len(changed_codes)} 個 value map 有改變的欄位 ---")
+    pprint.pprint(changed_codes[:20])
+    start_time = time.time()
+    MAX_UNMAPPED_TO_PRINT = 50
+    try:
+        base_df = pd.read_parquet(columnar_output_path)
+        wanted = set(changed_codes) | {audit.id_column}
+        raw_changed_df = pd.read_csv(csv_path, usecols=lambda col: col in wanted, low_memory=False,
+                                     dtype=str if read_as_text else None)
+        if audit.id_column in raw_changed_df.columns and audit.id_column not in changed_codes:
+            audit.record_ids = raw_changed_df.pop(audit.id_column) # 只供未對應值報告的樣本 ID 使用
+    except Exception as e:
+        print(f"讀取既有輸出或原始欄位時發生錯誤：{e}")
+        result['message'] = f"部分欄位重新轉換失敗: {e}"
+        return result
+
+    unmapped_entries = []
+    skipped_columns_errors = []
+    mapped_df, value_mapped_count = map_values_with(raw_changed_df, compiled_maps, unmapped_entries,
+                                                    skipped_columns_errors, MAX_UNMAPPED_TO_PRINT, audit,
+                                                    trace, result['prefix'])
+    mapped_df.columns = [id_map.get(col, col) for col in mapped_df.columns] # 與完整建置相同的重新命名
+    missing_in_output = [col for col in mapped_df.columns if col not in base_df.columns]
+    if missing_in_output:
+        print(f"既有輸出中找不到以下欄位，無法只更新部分欄位: {missing_in_output[:10]}")
+        result['message'] = "既有輸出與原始欄位不一致"
+        return result
+
+    typed_changed_df = to_columnar_frame(mapped_df)
+    for col in typed_changed_df.columns:
+        base_df[col] = typed_changed_df[col]
+    print_value_mapping_report(value_mapped_count, skipped_columns_errors, unmapped_entries,
+                               time.time() - start_time, MAX_UNMAPPED_TO_PRINT)
+
+    print(f"\n--- 正在將更新後的結果儲存至 {output_path} ---")
+    try:
+        base_df.to_csv(output_path, index=False, encoding='utf-8-sig', na_rep='nan')
+        base_df.to_parquet(columnar_output_path, index=False)
+    except Exception as e:
+        print(f"儲存更新後的結果時發生錯誤：{e}")
+        result['message'] = f"無法儲存 {output_path}"
+        return result
 
-    print(f"\n{'='*10} 資料集: {prefix} 處理完成 {'='*10}")
+    result.update(status='ok', rows=base_df.shape[0], cols=base_df.shape[1], output_path=output_path,
+                  message=f"只重新轉換 {len(changed_codes)} 個欄位")
+    return result
+
+
+def process_dataset_streaming(csv_path, output_path, columnar_output_path, id_map,
+                              compiled_maps, audit, chunksize, result, trace=None):
+    """
+    串流模式：分批讀取原始 CSV，逐批轉換值、重新命名欄位並附加寫入輸出檔。
+    尖峰記憶體只與 chunksize 有關，與檔案大小無關。
+
+    - 欄位名稱重複檢查只與標題列有關，因此在讀取任何資料列之前就先完成。
+    - 未對應值報告跨批次累計 (列索引為整個檔案中的列號)。
+    - 為了讓結果不受批次切分位置影響 (各批推斷的型別可能不同)，串流模式一律以字串讀入原始值；
+      查表前再以 value_mapping.code_strings 寫成標準的代碼字串，因此與一般模式的結果相同
+      (一般模式中因含空白而被讀成浮點數的 4.0 與串流模式的 '4' 都對應到代碼 '4'，未對應時也都寫成 '4')。
+    """
+    print(f"\n--- 串流模式：每批 {chunksize} 列 ---")
+    start_time = time.time()
+    MAX_UNMAPPED_TO_PRINT = 50
+
+    # --- 步驟 0: 以標題列檢查欄位重新命名是否會產生重複 ---
+    header_df = pd.read_csv(csv_path, nrows=0)
+    renamed_header_df = rename_and_check_duplicates(header_df, id_map)
+    if renamed_header_df is None:
+        print("資料集因欄位名稱重複問題停止處理 (在讀取任何資料列之前)。")
+        result['message'] = "id_map 導致欄位名稱重複"
+        return result
+    descriptive_columns = renamed_header_df.columns
+
+    print(f"已編譯 {compiled_maps.distinct_map_count} 種不同的特定 Value Map (共 {compiled_maps.column_count} 個欄位使用)。")
+
+    unmapped_entries = []
+    skipped_columns_errors = []
+    value_mapped_count = 0
+    total_rows = 0
+    columnar_writer = ColumnarChunkWriter(columnar_output_path, csv_path=output_path, chunksize=chunksize)
+    print(f"\n--- 正在將結果逐批寫入 {output_path} ---")
+    try:
+        with open(output_path, 'w', encoding='utf-8-sig', newline='') as output_file:
+            reader = pd.read_csv(csv_path, chunksize=chunksize, dtype=str, low_memory=False)
+            for chunk_number, chunk in enumerate(reader, start=1):
+                mapped_chunk, value_mapped_count = map_values_with(
+                    chunk, compiled_maps, unmapped_entries, skipped_columns_errors, MAX_UNMAPPED_TO_PRINT, audit,
+                    trace, result['prefix'])
+                mapped_chunk.columns = descriptive_columns # 不需再複製整批資料
+                mapped_chunk.to_csv(output_file, header=(chunk_number == 1), index=False)
+                columnar_writer.write(mapped_chunk)
+                total_rows += len(mapped_chunk)
+                if chunk_number == 1:
+                    print("\n--- 第一批結果預覽 (前 5 筆) ---")
+                    print(mapped_chunk.head())
+                print(f"  已完成第 {chunk_number} 批，累計 {total_rows} 列。")
+            if total_rows == 0:
+                renamed_header_df.to_csv(output_file, index=False) # 沒有資料列時仍輸出標題列
+    except Exception as e:
+        columnar_writer.abort(e)
+        print(f"串流處理 '{csv_path}' 時發生錯誤：{e}")
+        result['message'] = f"串流處理時發生錯誤: {e}"
+        return result
+    columnar_writer.close() # 型別在批次間不一致時，於此由寫完的 CSV 重新寫出 parquet
+
+    # 同一欄位在多個批次中出錯時只列出一次
+    skipped_columns_errors = list(dict.fromkeys(skipped_columns_errors))
+    print_value_mapping_report(value_mapped_count, skipped_columns_errors, unmapped_entries,
+                               time.time() - start_time, MAX_UNMAPPED_TO_PRINT)
+
+    print(f"\n{'='*10} 資料集處理完成 (串流模式，共 {total_rows} 列) {'='*10}")
+    result.update(status='ok', rows=total_rows, cols=len(descriptive_columns), output_path=output_path)
+    return result
+
+
+# --- 批次 (多行程) 處理 ---
+def _process_dataset_worker(prefix, data_dir, map_dir, log_dir, chunksize=None, force=False, profile=False):
+    """
+    在子行程中處理單一資料集。
+    詳細輸出寫入 log_dir 下的個別記錄檔，避免多個資料集的訊息交錯；
+    任何例外都會被攔截並轉為 status='failed' 的結果，不影響其他資料集。
+    profile=True 時以 PipelineTrace 記錄各階段，結果的 'trace' 為其 to_dict() (供主行程合併)。
+    """
+    start_time = time.time()
+    log_path = os.path.join(log_dir, f'TIGPSw1_{prefix}_convert.log')
+    trace = PipelineTrace() if profile else None
+    try:
+        with open(log_path, 'w', encoding='utf-8') as log_file, \
+             contextlib.redirect_stdout(log_file):
+            result = process_dataset(prefix, data_dir=data_dir, map_dir=map_dir, chunksize=chunksize,
+                                     force=force, trace=trace)
+    except Exception as e:
+        result = {'prefix': prefix, 'status': 'failed', 'rows': None, 'cols': None,
+                  'output_path': None, 'message': f"{type(e).__name__}: {e}",
+                  'traceback': traceback.format_exc()}
+    result['elapsed'] = time.time() - start_time
+    result['log_path'] = log_path
+    if trace is not None:
+        result['trace'] = trace.to_dict()
+    return result
+
+def process_datasets_parallel(prefixes, data_dir, map_dir, max_workers=None, chunksize=None, force_prefixes=(),
+                              trace=None):
+    """
+    以行程池平行處理多個資料集 (各資料集彼此獨立，不共享狀態)。
+    force_prefixes 中的資料集忽略建置紀錄，一律完整重建。
+    max_workers 預設為 min(資料集數, CPU 核心數)。
+    原始 CSV 較大的資料集會先提交，讓最耗時的工作 (通常是學生檔 s) 最早開始。
+    trace 若有指定，各子行程的階段紀錄合併到其中。
+    回傳依 prefixes 順序排列的結果摘要列表。
+    """
+    if max_workers is None:
+        max_workers = min(len(prefixes), os.cpu_count() or 1)
+    log_dir = os.path.join(data_dir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+
+    def raw_size(prefix):
+        csv_path = os.path.join(data_dir, f'TIGPSw1_{prefix}.csv')
+        return os.path.getsize(csv_path) if os.path.exists(csv_path) else 0
+    submit_order = sorted(prefixes, key=raw_size, reverse=True)
+    open_registry(map_dir) # 先在主行程編譯 (或確認) map registry，子行程直接開啟，不會同時重新編譯
+
+    print(f"使用 {max_workers} 個行程平行處理 {len(prefixes)} 個資料集: {submit_order}")
+    print(f"各資料集的詳細輸出記錄於: {log_dir}")
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_process_dataset_worker, prefix, data_dir, map_dir, log_dir, chunksize,
+                            prefix in force_prefixes, trace is not None): prefix
+            for prefix in submit_order
+        }
+        for future in as_completed(futures):
+            prefix = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # 子行程異常終止 (例如記憶體不足被系統終止) 時仍記錄失敗
+                result = {'prefix': prefix, 'status': 'failed', 'rows': None, 'cols': None,
+                          'output_path': None, 'message': f"{type(e).__name__}: {e}",
+                          'elapsed': None, 'log_path': None}
+            if trace is not None:
+                trace.merge(result.pop('trace', None))
+            results[prefix] = result
+            status_text = {'ok': "完成", 'skipped': "略過"}.get(result['status'], "失敗")
+            elapsed = result.get('elapsed')
+            elapsed_text = f"{elapsed:.2f} 秒" if elapsed is not None else "-"
+            print(f"[{len(results)}/{len(prefixes)}] 資料集 {prefix}: {status_text} (耗時 {elapsed_text})"
+                  + (f" - {result['message']}" if result['message'] else ""))
+    return [results[prefix] for prefix in prefixes]
+
+def print_batch_summary(results, total_elapsed):
+    """列印批次處理的彙整摘要"""
+    print("\n##### 批次處理摘要 #####")
+    print(f"{'資料集':<8}{'狀態':<8}{'列數':>10}{'欄數':>8}{'耗時(秒)':>12}  說明")
+    for result in results:
+        rows = result['rows'] if result['rows'] is not None else '-'
+        cols = result['cols'] if result['cols'] is not None else '-'
+        elapsed = result.get('elapsed')
+        elapsed_text = f"{elapsed:.2f}" if elapsed is not None else '-'
+        detail = result['message'] if result['status'] == 'failed' or not result['output_path'] else result['output_path']
+        print(f"{result['prefix']:<8}{result['status']:<8}{rows:>10}{cols:>8}{elapsed_text:>12}  {detail}")
+    failed = [r['prefix'] for r in results if r['status'] == 'failed']
+    skipped = [r['prefix'] for r in results if r['status'] == 'skipped']
+    print(f"成功 {len(results) - len(failed) - len(skipped)} 個，略過 {len(skipped)} 個 (已是最新)，"
+          f"失敗 {len(failed)} 個。總耗時: {total_elapsed:.2f} 秒。")
+    for result in results:
+        if result.get('traceback'):
+            print(f"\n--- 資料集 {result['prefix']} 的錯誤追蹤 ---")
+            print(result['traceback'])
+    return failed
 
 
 # --- 主要執行區塊 ---
 if __name__ == "__main__":
     # 定義要處理的所有資料集前綴
     datasets_to_process = ['s', 'p', 'f', 't', 'st', 'sc']
-    # 為了測試方便，先用一個虛擬的 'test' 資料集
 
-    print("\n##### 開始批次處理 TIGPS 資料集轉換 #####")
+    parser = argparse.ArgumentParser(description="批次將 TIGPS 原始 CSV 轉換為中文欄位名稱與標籤")
+    parser.add_argument('--prefixes', nargs='+', default=datasets_to_process,
+                        help="要處理的資料集前綴 (預設: 全部六個)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="平行處理的行程數 (預設: min(資料集數, CPU 核心數)；1 表示於目前行程依序處理)")
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="串流模式每批讀取的列數 (預設: 不分批，一次載入整個檔案)")
+    parser.add_argument('--force', nargs='*', default=None, metavar='PREFIX',
+                        help="忽略建置紀錄強制重建；不加前綴表示全部，或指定要強制重建的前綴")
+    parser.add_argument('--fix-descriptions', action='store_true',
+                        help="預檢時為衝突的 id_map 說明文字加上 _變項代碼 後綴並寫回 (見 schema_preflight.py)")
+    parser.add_argument('--chrome-trace', action='store_true',
+                        help="另外以 Chrome trace 格式寫出階段量測紀錄 (可用 chrome://tracing 或 Perfetto 開啟)")
+    args = parser.parse_args()
+    # --force 不帶參數 -> 全部強制重建；--force s p -> 只強制重建指定的資料集
+    force_prefixes = set(args.prefixes) if args.force == [] else set(args.force or [])
+
+    # 先預檢所有資料集的 map 與標題列 (毫秒級)，有衝突的資料集在處理時會立即失敗
+    print_preflight_report(run_preflight(args.prefixes, DATA_DIR, MAP_DIR, args.fix_descriptions))
 
-    # 遍歷每個資料集前綴並處理
-    for prefix in datasets_to_process:
-        # *** 確保傳遞正確的目錄參數 ***
-        process_dataset(prefix, data_dir=DATA_DIR, map_dir=MAP_DIR)
-        print("\n" + "#" * 50 + "\n") # 添加分隔線
+    print("\n##### 開始批次處理 TIGPS 資料集轉換 #####")
+    batch_start_time = time.time()
+    run_trace = PipelineTrace() # 各資料集的階段量測，結束時寫入 data/logs/
+
+    if args.workers == 1:
+        # 依序處理 (與原本的行為相同，輸出直接顯示在終端機)
+        batch_results = []
+        for prefix in args.prefixes:
+            dataset_start_time = time.time()
+            try:
+                dataset_result = process_dataset(prefix, data_dir=DATA_DIR, map_dir=MAP_DIR,
+                                                 chunksize=args.chunksize, force=prefix in force_prefixes,
+                                                 trace=run_trace)
+            except Exception as e:
+                dataset_result = {'prefix': prefix, 'status': 'failed', 'rows': None, 'cols': None,
+                                  'output_path': None, 'message': f"{type(e).__name__}: {e}",
+                                  'traceback': traceback.format_exc()}
+            dataset_result['elapsed'] = time.time() - dataset_start_time
+            batch_results.append(dataset_result)
+            print("\n" + "#" * 50 + "\n") # 添加分隔線
+    else:
+        batch_results = process_datasets_parallel(args.prefixes, DATA_DIR, MAP_DIR, max_workers=args.workers,
+                                                  chunksize=args.chunksize, force_prefixes=force_prefixes,
+                                                  trace=run_trace)
 
+    failed_prefixes = print_batch_summary(batch_results, time.time() - batch_start_time)
+    run_trace.print_summary()
+    run_trace.write(os.path.join(DATA_DIR, 'logs'), chrome=args.chrome_trace)
     print("##### 所有資料集處理完畢 #####")
+    sys.exit(1 if failed_prefixes else 0)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+目標一 (數位學習樣貌與學業關聯) 的分析定義與資料預處理。
+
+從 dashboard_app.py 抽出、不依賴 streamlit，讓儀表板、聚合 cube 的預先計算
+(aggregate_cube.py) 與其他離線分析共用同一套欄位、選項順序與遺漏值處理。
+
+預處理有兩種輸入：
+- preprocess_student_data：標註後的標籤字串 (比對標籤、取代遺漏值字串後轉為 categorical)。
+- preprocess_student_codes：原始整數代碼。每個欄位只對「對應表中的代碼」建立一次
+  代碼 → 類別位置 / 時數的查表陣列，再以 Categorical.from_codes 直接建立有序 categorical，
+  不需要先把整欄轉成標籤字串再比對；標籤只存在於 categories 中，顯示時才用到。
+兩者的輸出相同：map_test.py 產生標註檔時以 value_mapping.code_strings 將值寫成標準的代碼字串再查表
+(因含空白而被讀成浮點數的 4.0 也對應到代碼 '4')，與 code_positions 以數值比對代碼的規則一致。
+舊版流程產生的標註檔中，這類欄位的值仍是未對應的 '4.0'，需以 map_test.py 重新轉換後才會相同
+(建置紀錄中的值轉換規則 value_rule 不同，下次執行 map_test.py 時會自動完整重建)。
+"""
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+
+from value_mapping import code_positions, code_table
+
+# --- 常量與順序定義 (從分析腳本複製過來) ---
+grouping_col_name = "你上學期的平均成績大約如何?"
+
+# 數值型特徵列表
+numerical_feature_cols_all = [
+    "完成學校功課(查找完成作業需要的資料)",  # as35a
+    "課外的學習(各種線上付費或免費的課程)"   # as35b
+]
+# 類別型特徵列表
+categorical_feature_cols_all = [
+    "電腦(含桌機或筆電)",                         # as56a
+    "智慧型手機",                                 # as56b
+    "平板或電子書閱讀器(iPad, Kindle...)",        # as56d
+    "讀書或寫作業時,我會先將無關的網站、即時通訊、手機APP或提醒聲音關掉", # as59a
+    "我能要求自己先完成作業或讀書進度後,才能去看我喜歡的網站或玩手機。",       # as59b
+    "我會運用學習平台上的儀表板,了解自己的認真或表現情況(...)",             # as59c
+    "我會運用學習平台以外的軟體(如:Google日曆、Forrest、Notion、Anki等),安排我的學習進度。", # as59d
+    "我喜歡學校。",                                 # as14a
+    "你跟得上學校課業進度嗎?"                       # as19
+]
+
+all_selected_cols_for_processing = [grouping_col_name] + numerical_feature_cols_all + categorical_feature_cols_all
+
+# 順序定義
+grade_order = ['全班五名以內', '全班六至十名', '全班十一至二十名', '全班二十一至三十名', '全班三十名以後']
+values_to_replace_grade = ["系統遺漏值", "此卷未答", "我不知道"]
+time_mapping = { "沒有": 0.0, "0.5小時以內": 0.25, "0.5-1小時": 0.75, "1-1.5小時": 1.25, "1.5-2小時": 1.75, "2-2.5小時": 2.25, "2.5-3小時": 2.75, "3-3.5小時": 3.25, "3.5-4小時": 3.75, "4-4.5小時": 4.25, "4.5-5小時": 4.75, "5小時以上": 5.5 }
+values_to_replace_time = ["此卷未答", "跳答", "系統遺漏值"]
+comp_freq_order = ['幾乎每天', '每週三四次', '每週一兩次', '每月三四次', '每月一兩次', '一年幾次', '幾乎沒有', '沒有這項設備']
+values_to_replace_freq = ["此卷未答", "系統遺漏值"]
+agreement_order_s59 = ['很符合', '符合', '不符合', '很不符合']
+values_to_replace_manage = ["系統遺漏值", "此卷未答"] # 通用遺失值
+agreement_order_s14a = ['很同意', '同意', '不同意', '很不同意']
+progress_order_s19 = ['我的進度超前', '大部分都跟得上', '只落後一點點,很快就跟上了', '我有點落後,可能跟得上', '我落後很多,很難跟得上']
+
+category_orders_map = {
+    "電腦(含桌機或筆電)": comp_freq_order, "智慧型手機": comp_freq_order, "平板或電子書閱讀器(iPad, Kindle...)": comp_freq_order,
+    "讀書或寫作業時,我會先將無關的網站、即時通訊、手機APP或提醒聲音關掉": agreement_order_s59,
+    "我能要求自己先完成作業或讀書進度後,才能去看我喜歡的網站或玩手機。": agreement_order_s59,
+    "我會運用學習平台上的儀表板,了解自己的認真或表現情況(...)": agreement_order_s59,
+    "我會運用學習平台以外的軟體(如:Google日曆、Forrest、Notion、Anki等),安排我的學習進度。": agreement_order_s59,
+    "我喜歡學校。": agreement_order_s14a, "你跟得上學校課業進度嗎?": progress_order_s19
+}
+
+# 各類別特徵要視為遺漏值的選項
+category_missing_values_map = {
+    "電腦(含桌機或筆電)": values_to_replace_freq, "智慧型手機": values_to_replace_freq,
+    "平板或電子書閱讀器(iPad, Kindle...)": values_to_replace_freq,
+    "讀書或寫作業時,我會先將無關的網站、即時通訊、手機APP或提醒聲音關掉": values_to_replace_manage,
+    "我能要求自己先完成作業或讀書進度後,才能去看我喜歡的網站或玩手機。": values_to_replace_manage,
+    "我會運用學習平台上的儀表板,了解自己的認真或表現情況(...)": values_to_replace_manage,
+    "我會運用學習平台以外的軟體(如:Google日曆、Forrest、Notion、Anki等),安排我的學習進度。": values_to_replace_manage,
+    "我喜歡學校。": values_to_replace_manage, "你跟得上學校課業進度嗎?": values_to_replace_manage
+}
+
+
+def analysis_config_key():
+    """分析定義 (欄位、選項順序、遺漏值處理) 的雜湊；定義改變時預先計算的結果需要重建"""
+    config = [grouping_col_name, grade_order, values_to_replace_grade, numerical_feature_cols_all,
+              time_mapping, values_to_replace_time, categorical_feature_cols_all,
+              category_orders_map, category_missing_values_map]
+    payload = json.dumps(config, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def preprocess_student_data(df_raw):
+    """
+    將標註後的學生資料轉為分析用格式：
+    分群變項與類別特徵轉為有序 categorical，時間特徵依 time_mapping 轉為小時數。
+    回傳 (df_processed, 缺少的欄位列表)。
+    """
+    # 確保只選取我們定義好的欄位，避免潛在的额外欄位問題
+    cols_to_select_initially = [col for col in all_selected_cols_for_processing if col in df_raw.columns]
+    missing_cols_in_raw = [col for col in all_selected_cols_for_processing if col not in df_raw.columns]
+    df_processed = df_raw[cols_to_select_initially].copy()
+
+    # A. 處理分群變項
+    if grouping_col_name in df_processed.columns:
+        df_processed[grouping_col_name] = df_processed[grouping_col_name].replace(values_to_replace_grade, np.nan)
+        grade_dtype = pd.CategoricalDtype(categories=grade_order, ordered=True)
+        df_processed[grouping_col_name] = df_processed[grouping_col_name].astype(grade_dtype)
+
+    # B. 處理時間型數值特徵
+    for col in numerical_feature_cols_all:
+        if col in df_processed.columns:
+            df_processed[col] = df_processed[col].replace(values_to_replace_time, np.nan)
+            mapped_col = df_processed[col].map(time_mapping)
+            # combine_first 用於保留那些不在 mapping 中的值 (例如已經是 NaN 的)
+            df_processed[col] = mapped_col.combine_first(df_processed[col])
+            df_processed[col] = pd.to_numeric(df_processed[col], errors='coerce')
+
+    # C. 處理類別特徵 (設備使用頻率 as56、線上學習自我管理 as59、as14a、as19)
+    for col in categorical_feature_cols_all:
+        if col in df_processed.columns:
+            df_processed[col] = df_processed[col].replace(category_missing_values_map[col], np.nan)
+            category_dtype = pd.CategoricalDtype(categories=category_orders_map[col], ordered=True)
+            df_processed[col] = df_processed[col].astype(category_dtype)
+
+    return df_processed, missing_cols_in_raw
+
+
+def _category_lookup(combined_map, categories, missing_values):
+    """回傳 (遞增的整數代碼, 各代碼在 categories 中的位置)；標籤不在 categories 中或為遺漏值的代碼位置為 -1"""
+    codes, labels = code_table(combined_map)
+    position_of = {label: i for i, label in enumerate(categories) if label not in missing_values}
+    return codes, np.array([position_of.get(label, -1) for label in labels], dtype=np.int64)
+
+def categorical_from_codes(values, combined_map, categories, missing_values=()):
+    """
+    由原始代碼直接建立有序 categorical (categories 依給定順序)。
+    遺漏值代碼 (負數的 general 代碼等)、對應表中沒有的代碼與 NaN 都成為遺漏值。
+    """
+    codes, positions = _category_lookup(combined_map, categories, set(missing_values))
+    category_codes = np.append(positions, -1)[code_positions(values, codes)] # 查不到的代碼 (-1) 取最後一格的 -1
+    return pd.Categorical.from_codes(category_codes, dtype=pd.CategoricalDtype(categories=categories, ordered=True))
+
+def hours_from_codes(values, combined_map):
+    """由時間題的原始代碼直接換算為小時數 (與標籤流程的 time_mapping 換算相同)"""
+    codes, labels = code_table(combined_map)
+    hours = np.array([np.nan if label in values_to_replace_time
+                      else time_mapping.get(label, pd.to_numeric(label, errors='coerce'))
+                      for label in labels] + [np.nan], dtype=float)
+    table_positions = code_positions(values, codes)
+    result = hours[table_positions]
+    # 對應表中沒有的代碼在標籤流程中保留原值，再嘗試轉為數值；這裡維持相同的結果
+    unmatched = table_positions < 0
+    if unmatched.any():
+        result[unmatched] = pd.to_numeric(pd.Series(values).iloc[np.flatnonzero(unmatched)], errors='coerce').to_numpy()
+    return result
+
+def preprocess_student_codes(df_codes, column_maps):
+    """
+    由原始整數代碼直接產生與 preprocess_student_data 相同的分析用資料。
+    df_codes 的欄位以說明文字命名 (見 labeled_store.read_raw_codes)，
+    column_maps 為 {說明文字: 組合後的對應表 {代碼字串: 標籤}}。
+    回傳 (df_processed, 缺少的欄位列表)。
+    """
+    missing_cols_in_raw = [col for col in all_selected_cols_for_processing if col not in df_codes.columns]
+    processed_columns = {}
+    for col in all_selected_cols_for_processing:
+        if col not in df_codes.columns:
+            continue
+        values = df_codes[col]
+        if col == grouping_col_name:
+            processed_columns[col] = categorical_from_codes(values, column_maps[col], grade_order, values_to_replace_grade)
+        elif col in numerical_feature_cols_all:
+            processed_columns[col] = hours_from_codes(values, column_maps[col])
+        else:
+            processed_columns[col] = categorical_from_codes(values, column_maps[col], category_orders_map[col],
+                                                            category_missing_values_map[col])
+    return pd.DataFrame(processed_columns, index=df_codes.index), missing_cols_in_raw
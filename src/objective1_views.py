@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+目標一的圖表、表格與檢定結果 (儀表板與靜態報告共用)。
+
+從 dashboard_app.py 抽出、不依賴 streamlit：
+所有內容都只由次數 cube (aggregate_cube.py) 推導，儀表板以 st.dataframe / st.image / st.markdown 顯示，
+report_export.py 則寫成靜態 HTML / PDF 報告。
+檢定結果以 markdown 文字列回傳 (與儀表板原本顯示的文字相同)。
+"""
+import matplotlib.pyplot as plt
+import scipy.stats as stats
+import seaborn as sns
+
+from aggregate_cube import (anova_from_cube, category_percentages, category_plot_data, contingency_table,
+                            kruskal_from_cube, numeric_long_frame, numeric_summary)
+from contingency_tests import cochran_rule_fails, sparse_table_test
+from objective1 import category_orders_map, grade_order, grouping_col_name
+
+# --- 基本設定與中文字體 ---
+try:
+    # 嘗試設定多種常見中文字體，增加通用性
+    plt.rcParams['font.sans-serif'] = [
+        'Microsoft JhengHei', 'Arial Unicode MS', 'Microsoft YaHei',
+        'SimHei', 'PingFang HK', 'Heiti TC', 'sans-serif'
+    ]
+    plt.rcParams['axes.unicode_minus'] = False
+except Exception:
+    pass
+
+palettes_for_categorical = ["muted", "pastel", "deep", "colorblind", "bright", "tab10"]
+ALPHA = 0.05 # 統計檢定顯著水準
+
+
+# --- 圖表 ---
+def draw_numeric_boxplot(cube, feature):
+    """數值型特徵各成績組別的盒鬚圖"""
+    fig_num, ax_num = plt.subplots(figsize=(10, 6)) # 創建 fig, ax
+    sns.boxplot(x=grouping_col_name, y=feature, data=numeric_long_frame(cube, feature, grouping_col_name),
+                order=grade_order,
+                hue=grouping_col_name, # Added to address FutureWarning
+                palette="viridis",
+                ax=ax_num,
+                legend=False) # Added to address FutureWarning
+    ax_num.set_title(f'不同成績組別在「{feature}」上的分佈', fontsize=14)
+    ax_num.set_xlabel(grouping_col_name, fontsize=10)
+    ax_num.set_ylabel(f"{feature} (小時)", fontsize=10) # 假設單位是小時
+    ax_num.tick_params(axis='x', rotation=45, labelsize=8) # Corrected: removed ha='right'
+    ax_num.tick_params(axis='y', labelsize=8)
+    plt.tight_layout()
+    return fig_num
+
+def draw_category_barplot(cube, feature, palette):
+    """類別型特徵各成績組別的選項百分比長條圖 (基於有效回答者)"""
+    plot_data_cat = category_plot_data(cube, feature, grouping_col_name)
+
+    # 準備 hue_order：從預定義順序中篩選出實際存在的類別，再添加不在預定義順序中的類別
+    unique_categories_in_plot_data = plot_data_cat[feature].unique()
+    final_hue_order_for_plot = [cat_val for cat_val in category_orders_map.get(feature, [])
+                                if cat_val in unique_categories_in_plot_data]
+    for cat_val in unique_categories_in_plot_data:
+        if cat_val not in final_hue_order_for_plot:
+            final_hue_order_for_plot.append(cat_val)
+    if not final_hue_order_for_plot: # 如果上面處理後是空的 (不太可能，但以防萬一)
+        final_hue_order_for_plot = None
+
+    fig_cat, ax_cat = plt.subplots(figsize=(12, 7))
+    sns.barplot(x=grouping_col_name, y='percentage', hue=feature, data=plot_data_cat,
+                order=grade_order, hue_order=final_hue_order_for_plot,
+                palette=palette, ax=ax_cat)
+    ax_cat.set_title(f'不同成績組別在「{feature}」上的選項百分比\n(基於有效回答者)', fontsize=14)
+    ax_cat.set_xlabel(grouping_col_name, fontsize=10)
+    ax_cat.set_ylabel('百分比 (%)', fontsize=10)
+    ax_cat.tick_params(axis='x', rotation=45, labelsize=8)
+    ax_cat.tick_params(axis='y', labelsize=8)
+    ax_cat.legend(title=feature, bbox_to_anchor=(1.02, 1), loc='upper left', fontsize=8, title_fontsize='9')
+    plt.tight_layout(rect=[0, 0, 0.85, 1])
+    return fig_cat
+
+# 圖表種類 -> 繪圖函式 (圖表快取鍵中的 kind 與參數即為此處的呼叫參數)
+FIGURE_DRAWERS = {
+    'boxplot': draw_numeric_boxplot,
+    'barplot': draw_category_barplot,
+}
+
+def category_palette(feature, categorical_cols_present):
+    """類別特徵的配色 (依特徵在實際存在的類別特徵中的位置輪流使用)"""
+    return palettes_for_categorical[categorical_cols_present.index(feature) % len(palettes_for_categorical)]
+
+
+# --- 表格 ---
+def ordered_category_table(cube, feature):
+    """各成績組別的選項百分比 (%)，欄位依預定義的選項順序排列，不在順序中的選項接在最後"""
+    table = category_percentages(cube, feature, grouping_col_name).round(2) # 基於非 NaN 總數計算百分比
+    current_order = category_orders_map.get(feature) or table.columns.tolist()
+    ordered_cols = [c for c in current_order if c in table.columns]
+    ordered_cols += [c for c in table.columns if c not in ordered_cols]
+    return table[ordered_cols]
+
+
+# --- 統計檢定 ---
+def numeric_test_lines(cube, feature, desc_stats, alpha=ALPHA):
+    """數值型特徵的 ANOVA 與 Kruskal-Wallis 檢定結果 (markdown 文字列)"""
+    groups_with_data = (desc_stats['count'] > 0).sum()
+    if groups_with_data < 2:
+        return ["* 有效數據組別少於2組，無法進行 ANOVA 或 Kruskal-Wallis 檢定。"]
+    lines = []
+    try:
+        f_statistic, p_value_anova = anova_from_cube(cube, feature)
+        lines.append(f"* **ANOVA 檢定**: F統計量 = {f_statistic:.2f}, p-value = {p_value_anova:.4f}")
+        if p_value_anova < alpha:
+            lines.append(f"    * 結論: **顯著差異** (p < {alpha})。不同成績組別在「{feature}」上的平均數存在顯著差異。建議進行 post-hoc 檢定。")
+        else:
+            lines.append(f"    * 結論: **無顯著差異** (p >= {alpha})。")
+    except Exception as e:
+        lines.append(f"* ANOVA 檢定執行錯誤: {e}")
+    try:
+        h_statistic, p_value_kruskal = kruskal_from_cube(cube, feature)
+        lines.append(f"* **Kruskal-Wallis H 檢定**: H統計量 = {h_statistic:.2f}, p-value = {p_value_kruskal:.4f}")
+        if p_value_kruskal < alpha:
+            lines.append(f"    * 結論: **顯著差異** (p < {alpha})。不同成績組別在「{feature}」上的分佈（中位數）存在顯著差異。建議進行 post-hoc 檢定。")
+        else:
+            lines.append(f"    * 結論: **無顯著差異** (p >= {alpha})。")
+    except Exception as e:
+        lines.append(f"* Kruskal-Wallis 檢定執行錯誤: {e}")
+    return lines
+
+def expected_frequency_warning(expected_freq):
+    """卡方檢定期望頻率過小的警告文字 (沒有問題時為空字串)"""
+    min_expected_freq = expected_freq.min()
+    if min_expected_freq < 1:
+        return f"警告：期望頻率中存在小於1的值 (最小期望頻率: {min_expected_freq:.2f})。"
+    if min_expected_freq < 5:
+        if ((expected_freq < 5).sum() / expected_freq.size) > 0.2:
+            return f"警告：超過20%的儲存格期望頻率小於5 (最小期望頻率: {min_expected_freq:.2f})。卡方檢定結果可能不夠準確。"
+        return f"注意：部分儲存格期望頻率小於5 (最小期望頻率: {min_expected_freq:.2f})。"
+    return ""
+
+def chi2_test_lines(cube, feature, alpha=ALPHA):
+    """
+    類別型特徵與成績組別的卡方獨立性檢定結果 (markdown 文字列)；列聯表排除遺漏值。
+    期望頻率不符合 Cochran 準則時，改以 Fisher 精確檢定 / 置換檢定 (contingency_tests.py) 的 p-value 下結論。
+    """
+    table = contingency_table(cube, feature, grouping_col_name)
+    if table.empty or table.sum().sum() == 0 or table.shape[0] < 2 or table.shape[1] < 2:
+        return ["* 列聯表數據不足（有效回答過少），無法進行卡方檢定。"]
+    try:
+        chi2, p_value_chi2, dof, expected_freq = stats.chi2_contingency(table)
+    except Exception as e:
+        return [f"* 卡方檢定執行錯誤: {e}"]
+    lines = [f"* **卡方獨立性檢定**: 卡方統計量 = {chi2:.2f}, p-value = {p_value_chi2:.4f}, 自由度 = {dof}"]
+    warning_msg = expected_frequency_warning(expected_freq)
+    if warning_msg:
+        lines.append(f"    * {warning_msg}")
+    if cochran_rule_fails(expected_freq):
+        test_name, p_value_chi2 = sparse_table_test(table.to_numpy())
+        lines.append(f"    * 期望頻率不足，改以 **{test_name}** 計算: p-value = {p_value_chi2:.4f}")
+    if p_value_chi2 < alpha:
+        lines.append(f"    * 結論: **顯著關聯** (p < {alpha})。「{grouping_col_name}」與「{feature}」之間存在統計上顯著的關聯（基於有效回答）。")
+    else:
+        lines.append(f"    * 結論: **無顯著關聯** (p >= {alpha})。「{grouping_col_name}」與「{feature}」之間不存在統計上顯著的關聯（基於有效回答）。")
+    return lines
+
+def numeric_section(cube, feature):
+    """數值型特徵的描述統計表與檢定結果：回傳 (desc_stats, 檢定文字列)"""
+    desc_stats = numeric_summary(cube, feature, grouping_col_name).round(2)
+    return desc_stats, numeric_test_lines(cube, feature, desc_stats)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+轉換流程的階段量測 (structured stage-level profiling)。
+
+map_test.process_dataset 的各階段 (檢查建置紀錄、讀取 CSV、值轉換、重新命名、寫出 CSV / parquet、
+未對應值報告…) 以 PipelineTrace.stage() 包住，記錄：
+    wall 時間、CPU 時間、階段結束時行程的尖峰 RSS、處理的列數與欄數
+值轉換另外記錄每個欄位的耗時 (record_column)，彙整出各資料集最慢的欄位。
+
+尖峰 RSS 取自 resource.getrusage，為行程啟動以來的最高值：
+某階段結束時的值比前一階段高，表示該階段推高了記憶體用量。
+無法取得時 (例如 Windows 沒有 resource 模組) 記錄為 None。
+
+每次執行寫出一個 JSON 紀錄 (data/logs/pipeline_trace_{時間}.json)；
+可另外寫出 Chrome trace 格式 (.trace.json，可用 chrome://tracing 或 Perfetto 開啟)。
+平行處理時各子行程各自記錄，再以 merge() 合併到主行程的紀錄中。
+"""
+import contextlib
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError: # Windows 沒有 resource 模組，不記錄尖峰 RSS
+    resource = None
+
+SLOWEST_COLUMNS = 20 # 每個資料集保留的最慢欄位數
+
+
+def peak_rss_mb():
+    """行程啟動以來的尖峰 RSS (MB)；無法取得時回傳 None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 的單位為 KB，macOS 為 bytes
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+class PipelineTrace:
+    """一次執行 (一個或多個資料集) 的階段紀錄"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.events = []
+        self.column_costs = {} # 資料集 -> {欄位: [秒數, 列數]}
+
+    @contextlib.contextmanager
+    def stage(self, name, dataset=None, rows=None, columns=None):
+        """
+        量測一個階段。yield 的 dict 可在階段中更新 rows / columns
+        (例如讀入 CSV 之後才知道列數)，也可加入其他說明欄位。
+        """
+        info = {'rows': rows, 'columns': columns}
+        start_wall = time.time()
+        start_perf = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield info
+        finally:
+            self.events.append({
+                'dataset': dataset,
+                'stage': name,
+                'start': round(start_wall - self.started_at, 6),
+                'wall_seconds': round(time.perf_counter() - start_perf, 6),
+                'cpu_seconds': round(time.process_time() - start_cpu, 6),
+                'peak_rss_mb': peak_rss_mb(),
+                'pid': os.getpid(),
+                **info,
+            })
+
+    def record_column(self, dataset, column, seconds, rows):
+        """累計單一欄位的轉換耗時 (串流模式會跨批次累加)"""
+        cost = self.column_costs.setdefault(dataset, {}).setdefault(str(column), [0.0, 0])
+        cost[0] += seconds
+        cost[1] += rows
+
+    def slowest_columns(self, limit=SLOWEST_COLUMNS):
+        """{資料集: [{'column', 'seconds', 'rows'}, ...]}，依耗時由高到低"""
+        slowest = {}
+        for dataset, costs in self.column_costs.items():
+            ranked = sorted(costs.items(), key=lambda item: -item[1][0])[:limit]
+            slowest[dataset] = [{'column': column, 'seconds': round(seconds, 6), 'rows': rows}
+                                for column, (seconds, rows) in ranked]
+        return slowest
+
+    def to_dict(self):
+        return {
+            'started_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at)),
+            'started_epoch': self.started_at,
+            'events': self.events,
+            'slowest_columns': self.slowest_columns(),
+        }
+
+    def merge(self, other):
+        """合併子行程的紀錄 (to_dict 的結果)；事件的起始時間換算為本紀錄的時間軸"""
+        if not other:
+            return
+        offset = other.get('started_epoch', self.started_at) - self.started_at
+        for event in other.get('events', []):
+            self.events.append({**event, 'start': round(event['start'] + offset, 6)})
+        for dataset, columns in other.get('slowest_columns', {}).items():
+            for entry in columns:
+                self.record_column(dataset, entry['column'], entry['seconds'], entry['rows'])
+
+    def chrome_trace(self):
+        """Chrome trace 格式 (complete events，時間單位為微秒)"""
+        trace_events = []
+        for event in self.events:
+            args = {key: value for key, value in event.items()
+                    if key not in ('stage', 'start', 'wall_seconds', 'pid') and value is not None}
+            trace_events.append({
+                'name': event['stage'], 'cat': event['dataset'] or 'run', 'ph': 'X',
+                'ts': int(event['start'] * 1e6), 'dur': int(event['wall_seconds'] * 1e6),
+                'pid': event['pid'], 'tid': event['dataset'] or 'run', 'args': args,
+            })
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def write(self, log_dir, chrome=False):
+        """寫出 JSON 紀錄 (chrome=True 時另外寫出 Chrome trace)，回傳紀錄檔路徑"""
+        os.makedirs(log_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(self.started_at))
+        trace_path = os.path.join(log_dir, f'pipeline_trace_{stamp}.json')
+        with open(trace_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        print(f"階段量測紀錄已寫出: {trace_path}")
+        if chrome:
+            chrome_path = os.path.join(log_dir, f'pipeline_trace_{stamp}.trace.json')
+            with open(chrome_path, 'w', encoding='utf-8') as f:
+                json.dump(self.chrome_trace(), f, ensure_ascii=False)
+            print(f"Chrome trace 已寫出: {chrome_path}")
+        return trace_path
+
+    def print_summary(self, column_limit=10):
+        """列印各資料集 x 階段的量測摘要，以及所有資料集中最慢的欄位"""
+        if not self.events:
+            return
+        print("\n##### 各階段量測摘要 #####")
+        print(f"{'資料集':<8}{'階段':<22}{'wall(秒)':>10}{'CPU(秒)':>10}{'尖峰RSS(MB)':>13}{'列數':>10}{'欄數':>7}")
+        for event in self.events:
+            rss = f"{event['peak_rss_mb']:.1f}" if event['peak_rss_mb'] is not None else '-'
+            rows = event['rows'] if event['rows'] is not None else '-'
+            columns = event['columns'] if event['columns'] is not None else '-'
+            print(f"{event['dataset'] or '-':<8}{event['stage']:<22}{event['wall_seconds']:>10.2f}"
+                  f"{event['cpu_seconds']:>10.2f}{rss:>13}{rows:>10}{columns:>7}")
+        ranked = sorted(((entry['seconds'], dataset, entry['column'])
+                         for dataset, columns in self.slowest_columns().items() for entry in columns), reverse=True)
+        if ranked:
+            print(f"\n值轉換最慢的 {min(column_limit, len(ranked))} 個欄位:")
+            for seconds, dataset, column in ranked[:column_limit]:
+                print(f"  {dataset:<6}{column:<24}{seconds:.4f} 秒")
+
+
+def traced(trace, name, dataset=None, rows=None, columns=None):
+    """trace 為 None 時不做任何量測 (yield 一個不會被記錄的 dict)，呼叫端不必另外判斷"""
+    if trace is None:
+        return contextlib.nullcontext({'rows': rows, 'columns': columns})
+    return trace.stage(name, dataset, rows, columns)
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+目標一分析的靜態報告匯出 (不需要 streamlit)。
+
+儀表板 (dashboard_app.py) 只能在 streamlit session 中檢視。本模組以相同的預處理 (objective1.py)、
+次數 cube (aggregate_cube.py) 與圖表 / 表格 / 檢定文字 (objective1_views.py)，
+為全體學生與各個子群體 (例如依學校類型、性別切分) 各寫出一份自成一體的 HTML 報告
+(圖片以 base64 內嵌，可直接寄送或放上靜態網站)，並可另外輸出 PDF。
+
+- 資料只讀取一次；每個子群體由同一份預處理結果篩選列後建立自己的次數 cube。
+- 圖表以行程池平行繪製 (matplotlib 為單執行緒)，並使用 figure_cache 的 PNG 快取：
+  快取鍵為 cube 內容的雜湊 + 圖表參數，與儀表板相同，內容沒變的圖不會重畫。
+- 有效分群 (成績組別非遺漏) 少於 MIN_SUBGROUP_ROWS 人的子群體不輸出報告。
+
+用法 (在 src/ 目錄下執行)：
+    python report_export.py                               # 全體 + 依 SUBGROUP_COLUMNS 切分
+    python report_export.py --by 學校類型 --workers 4 --pdf
+    python report_export.py --by                          # 只輸出全體學生
+報告寫入 ../data/reports/objective1/ (index.html 列出所有報告)。
+"""
+import argparse
+import base64
+import html
+import io
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use('Agg') # 批次作業不需要視窗 (須在匯入 pyplot 之前設定)
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.backends.backend_pdf import PdfPages
+
+from aggregate_cube import build_count_cube, cube_version_of
+from figure_cache import FIGURE_DPI, cached_png, figure_key
+from labeled_store import labeled_csv_path, labeled_source_paths, map_raw_columns, read_labeled_table, read_raw_codes
+from map_registry import load_map_json
+from objective1 import (all_selected_cols_for_processing, categorical_feature_cols_all, grouping_col_name,
+                        numerical_feature_cols_all, preprocess_student_codes, preprocess_student_data)
+from objective1_views import (FIGURE_DRAWERS, category_palette, chi2_test_lines, numeric_section,
+                              ordered_category_table)
+
+SUBGROUP_COLUMNS = ['學校類型', '請問你的性別(生理性別)?']
+MIN_SUBGROUP_ROWS = 30
+REPORT_TITLE = "目標一：描繪數位學習樣貌與學業關聯的初步圖像"
+REPORT_STYLE = """
+body { font-family: 'Microsoft JhengHei', 'PingFang TC', 'Noto Sans CJK TC', sans-serif; margin: 2em auto; max-width: 1100px; }
+table { border-collapse: collapse; margin: 0.5em 0 1em; font-size: 0.9em; }
+th, td { border: 1px solid #ccc; padding: 0.25em 0.6em; text-align: right; }
+th { background: #f3f3f3; }
+img { max-width: 100%; }
+section { border-top: 1px solid #ddd; padding-top: 0.5em; }
+"""
+
+
+# --- 資料與子群體 ---
+def load_report_data(data_dir, map_dir, subgroup_columns=(), from_codes=True):
+    """
+    讀取並預處理學生資料 (與儀表板相同：原始代碼 CSV 存在且 from_codes 時由代碼預處理，否則讀標註檔)。
+    回傳 (df_processed, subgroups)：subgroups 為子群體欄位的標籤 (遺漏原因為 NaN)，索引與 df_processed 相同。
+    """
+    raw_codes_path = os.path.join(data_dir, 'TIGPSw1_s.csv')
+    id_map_path = os.path.join(map_dir, 'tigps_w1_s_id_map.json')
+    value_map_path = os.path.join(map_dir, 'tigps_w1_s_value_maps.json')
+    labeled_path = labeled_csv_path(data_dir, 's')
+    subgroup_columns = list(subgroup_columns)
+
+    if (from_codes and os.path.exists(raw_codes_path)) or not labeled_source_paths(data_dir, 's'):
+        df_codes, column_maps = read_raw_codes(raw_codes_path, id_map_path, value_map_path,
+                                               all_selected_cols_for_processing)
+        df_processed, missing_cols = preprocess_student_codes(df_codes, column_maps)
+        subgroups = map_raw_columns(raw_codes_path, id_map_path, value_map_path, subgroup_columns, as_category=False)
+    else:
+        df_raw = read_labeled_table(labeled_path, columns=all_selected_cols_for_processing + subgroup_columns,
+                                    as_category=False)
+        df_processed, missing_cols = preprocess_student_data(df_raw)
+        subgroups = df_raw[[col for col in subgroup_columns if col in df_raw.columns]]
+    if missing_cols:
+        print(f"警告：原始數據中缺少以下欄位，將只處理存在的欄位: {missing_cols}")
+
+    missing_reasons = set(str(label) for label in
+                          (load_map_json(value_map_path).get('general_options', {}) or {}).values())
+    subgroups = subgroups.apply(lambda col: col.where(~col.astype(str).isin(missing_reasons)))
+    absent = [col for col in subgroup_columns if col not in subgroups.columns]
+    if absent:
+        print(f"警告：找不到子群體欄位 {absent}，略過這些切分。")
+    return df_processed, subgroups
+
+def _slug(text):
+    return re.sub(r'[^\w]+', '_', str(text)).strip('_') or 'value'
+
+def subgroup_cuts(df_processed, subgroups):
+    """
+    回傳 [(報告代號, 標題, 列遮罩)]：第一個為全體學生，之後為每個子群體欄位的每個值。
+    有效分群 (成績組別非遺漏) 少於 MIN_SUBGROUP_ROWS 人的子群體不列入。
+    """
+    graded = df_processed[grouping_col_name].notna().to_numpy() if grouping_col_name in df_processed else None
+    cuts = [('all', "全體學生", np.ones(len(df_processed), dtype=bool))]
+    for col_index, column in enumerate(subgroups.columns, start=1):
+        values = subgroups[column]
+        for value in sorted(values.dropna().unique(), key=str):
+            mask = (values == value).to_numpy()
+            valid_rows = int((mask & graded).sum()) if graded is not None else int(mask.sum())
+            if valid_rows < MIN_SUBGROUP_ROWS:
+                print(f"略過子群體 {column} = {value} (有效人數 {valid_rows} < {MIN_SUBGROUP_ROWS})")
+                continue
+            cuts.append((f'{col_index}_{_slug(column)}_{_slug(value)}', f"{column}：{value}", mask))
+    return cuts
+
+
+# --- 報告內容 ---
+def report_sections(cube):
+    """
+    由次數 cube 產生報告的各區塊：
+    [{'part', 'feature', 'caption', 'table', 'figure': (kind, params), 'tests': [markdown 文字列]}]
+    """
+    cube_features = set(cube['feature'])
+    sections = []
+    for num_col in numerical_feature_cols_all:
+        if num_col not in cube_features:
+            continue
+        desc_stats, test_lines = numeric_section(cube, num_col)
+        sections.append({'part': "A. 數值型特徵分析", 'feature': num_col,
+                         'caption': f"各「{grouping_col_name}」群組在「{num_col}」上的統計：",
+                         'table': desc_stats, 'figure': ('boxplot', {'feature': num_col}), 'tests': test_lines})
+    categorical_cols_present = [col for col in categorical_feature_cols_all if col in cube_features]
+    for cat_col in categorical_cols_present:
+        sections.append({'part': "B. 類別型特徵分析", 'feature': cat_col,
+                         'caption': f"各「{grouping_col_name}」群組在「{cat_col}」上的選項百分比 (%) (基於有效回答者)：",
+                         'table': ordered_category_table(cube, cat_col),
+                         'figure': ('barplot', {'feature': cat_col,
+                                                'palette': category_palette(cat_col, categorical_cols_present)}),
+                         'tests': chi2_test_lines(cube, cat_col)})
+    return sections
+
+
+# --- 平行繪圖 ---
+def _render_figure(cube, cube_version, kind, params, cache_dir):
+    """在子行程中繪製單一圖表 (經由 PNG 快取)，回傳 PNG bytes"""
+    return cached_png(figure_key(cube_version, kind, **params), lambda: FIGURE_DRAWERS[kind](cube, **params),
+                      cache_dir)
+
+def render_figures(jobs, cache_dir, max_workers=None):
+    """
+    jobs 為 [(工作代號, cube, cube 版本, 圖表種類, 參數)]，回傳 {工作代號: PNG bytes}。
+    快取中已有的圖直接讀取，其餘以行程池平行繪製；max_workers=1 時於目前行程依序繪製。
+    """
+    pngs = {}
+    pending = []
+    for job_id, cube, cube_version, kind, params in jobs:
+        png_path = os.path.join(cache_dir, figure_key(cube_version, kind, **params) + '.png')
+        if os.path.exists(png_path):
+            with open(png_path, 'rb') as f:
+                pngs[job_id] = f.read()
+        else:
+            pending.append((job_id, cube, cube_version, kind, params))
+    print(f"共 {len(jobs)} 張圖表，{len(jobs) - len(pending)} 張取自快取，{len(pending)} 張需要繪製。")
+    if max_workers == 1 or len(pending) <= 1:
+        for job_id, cube, cube_version, kind, params in pending:
+            pngs[job_id] = _render_figure(cube, cube_version, kind, params, cache_dir)
+        return pngs
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {job_id: executor.submit(_render_figure, cube, cube_version, kind, params, cache_dir)
+                   for job_id, cube, cube_version, kind, params in pending}
+        for job_id, future in futures.items():
+            pngs[job_id] = future.result()
+    return pngs
+
+
+# --- 輸出 ---
+def _inline_markdown(text):
+    return re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', html.escape(text))
+
+def _markdown_list_html(lines):
+    """檢定結果的 markdown 文字列 ('* ' 為第一層、'    * ' 為第二層) 轉為巢狀清單"""
+    items = [] # [(第一層文字, [第二層文字])]
+    for line in lines:
+        text = _inline_markdown(line.strip().lstrip('*').strip())
+        if line.startswith('    ') and items:
+            items[-1][1].append(text)
+        else:
+            items.append((text, []))
+    parts = ['<ul>']
+    for text, children in items:
+        nested = ''.join(f"<li>{child}</li>" for child in children)
+        parts.append(f"<li>{text}" + (f"<ul>{nested}</ul>" if nested else '') + "</li>")
+    parts.append('</ul>')
+    return '\n'.join(parts)
+
+def write_html_report(path, title, row_count, sections, pngs):
+    """寫出自成一體的 HTML 報告 (圖片以 base64 內嵌)"""
+    body = [f"<h1>{html.escape(REPORT_TITLE)}</h1>",
+            f"<h2>{html.escape(title)} (n = {row_count})</h2>",
+            f"<p>主要的分群方式是依據學生「<strong>{html.escape(grouping_col_name)}</strong>」的回答。"
+            f"產生時間：{time.strftime('%Y-%m-%d %H:%M:%S')}</p>"]
+    current_part = None
+    for index, section in enumerate(sections):
+        if section['part'] != current_part:
+            current_part = section['part']
+            body.append(f"<h2>{html.escape(current_part)}</h2>")
+        image = base64.b64encode(pngs[index]).decode('ascii')
+        body += [f"<section><h3>特徵：{html.escape(section['feature'])}</h3>",
+                 f"<p>{html.escape(section['caption'])}</p>",
+                 section['table'].to_html(na_rep='-'),
+                 f'<img src="data:image/png;base64,{image}" alt="{html.escape(section["feature"])}">',
+                 "<p><strong>統計檢定結果：</strong></p>",
+                 _markdown_list_html(section['tests']), "</section>"]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'<!DOCTYPE html>\n<html lang="zh-Hant"><head><meta charset="utf-8">'
+                f'<title>{html.escape(title)}</title><style>{REPORT_STYLE}</style></head>\n<body>\n'
+                + '\n'.join(body) + '\n</body></html>\n')
+
+def write_pdf_report(path, title, row_count, sections, pngs):
+    """寫出 PDF 報告：每個特徵一頁 (標題、統計表、圖表與檢定結果)"""
+    with PdfPages(path) as pdf:
+        for index, section in enumerate(sections):
+            fig = plt.figure(figsize=(8.27, 11.69)) # A4 直式
+            fig.text(0.05, 0.97, f"{title} (n = {row_count})　{section['part']}", fontsize=9, va='top')
+            fig.text(0.05, 0.94, f"特徵：{section['feature']}", fontsize=11, weight='bold', va='top')
+            fig.text(0.05, 0.91, section['caption'] + '\n' + section['table'].to_string(na_rep='-'),
+                     fontsize=6, family='monospace', va='top')
+            image_ax = fig.add_axes([0.05, 0.22, 0.9, 0.45])
+            image_ax.imshow(plt.imread(io.BytesIO(pngs[index]), format='png'))
+            image_ax.axis('off')
+            tests = '\n'.join(line.replace('**', '') for line in section['tests'])
+            fig.text(0.05, 0.19, "統計檢定結果：\n" + tests, fontsize=7, va='top', wrap=True)
+            pdf.savefig(fig, dpi=FIGURE_DPI)
+            plt.close(fig)
+
+def write_index(output_dir, reports):
+    """寫出列出所有報告的 index.html；reports 為 [(檔名, 標題, 人數)]"""
+    items = '\n'.join(f'<li><a href="{html.escape(name)}">{html.escape(title)}</a> (n = {rows})</li>'
+                      for name, title, rows in reports)
+    with open(os.path.join(output_dir, 'index.html'), 'w', encoding='utf-8') as f:
+        f.write(f'<!DOCTYPE html>\n<html lang="zh-Hant"><head><meta charset="utf-8">'
+                f'<title>{html.escape(REPORT_TITLE)}</title><style>{REPORT_STYLE}</style></head>\n<body>\n'
+                f'<h1>{html.escape(REPORT_TITLE)}</h1>\n<ul>\n{items}\n</ul>\n</body></html>\n')
+
+def export_reports(data_dir, map_dir, output_dir, subgroup_columns=SUBGROUP_COLUMNS, max_workers=None,
+                   pdf=False, from_codes=True):
+    """匯出全體與各子群體的報告，回傳 [(報告路徑, 標題, 人數)]"""
+    start_time = time.time()
+    df_processed, subgroups = load_report_data(data_dir, map_dir, subgroup_columns, from_codes)
+    cuts = subgroup_cuts(df_processed, subgroups)
+    print(f"資料讀取與預處理完成 ({len(df_processed)} 列)，共 {len(cuts)} 份報告。耗時 {time.time() - start_time:.2f} 秒。")
+
+    reports = []
+    jobs = []
+    for slug, title, mask in cuts:
+        cube = build_count_cube(df_processed[mask], grouping_col_name, categorical_feature_cols_all,
+                                numerical_feature_cols_all)
+        cube_version = cube_version_of(cube)
+        sections = report_sections(cube)
+        reports.append((slug, title, int(mask.sum()), sections))
+        jobs += [((slug, index), cube, cube_version, kind, params)
+                 for index, (kind, params) in enumerate(section['figure'] for section in sections)]
+
+    pngs = render_figures(jobs, os.path.join(data_dir, 'figures'), max_workers)
+
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    for slug, title, row_count, sections in reports:
+        report_pngs = [pngs[(slug, index)] for index in range(len(sections))]
+        html_path = os.path.join(output_dir, f'{slug}.html')
+        write_html_report(html_path, title, row_count, sections, report_pngs)
+        if pdf:
+            write_pdf_report(os.path.join(output_dir, f'{slug}.pdf'), title, row_count, sections, report_pngs)
+        written.append((html_path, title, row_count))
+    write_index(output_dir, [(os.path.basename(path), title, rows) for path, title, rows in written])
+    print(f"已寫出 {len(written)} 份報告至 {output_dir}。總耗時 {time.time() - start_time:.2f} 秒。")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="匯出目標一分析的靜態 HTML / PDF 報告 (全體與各子群體)")
+    parser.add_argument('--by', nargs='*', default=SUBGROUP_COLUMNS,
+                        help="子群體欄位 (說明文字；預設: 學校類型與性別)；只寫 --by 表示只輸出全體學生")
+    parser.add_argument('--workers', type=int, default=None, help="繪圖的行程數 (預設: CPU 核心數；1 表示不使用行程池)")
+    parser.add_argument('--pdf', action='store_true', help="另外輸出 PDF")
+    parser.add_argument('--labeled', action='store_true', help="由標註檔預處理 (預設優先使用原始代碼 CSV)")
+    parser.add_argument('--output', default='../data/reports/objective1', help="報告輸出目錄")
+    args = parser.parse_args()
+
+    export_reports('../data/', '../maps/', args.output, args.by, max_workers=args.workers, pdf=args.pdf,
+                   from_codes=not args.labeled)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+轉換前的結構預檢：只讀 CSV 標題列與 map 檔，在任何值轉換之前找出 map 的問題。
+
+map_test.py 的 rename_and_check_duplicates 要等到完整 load_csv 與 map_all_values 之後才會發現
+id_map 的說明文字衝突 (id_unique.py 手動修正 tigps_w1_t_id_map.json 的問題)，整個轉換因此白做。
+本模組對每個資料集檢查：
+
+- 缺少的檔案 (原始 CSV 為錯誤；id_map / value map 為警告，轉換仍可執行但不會重新命名或轉換值)。
+- 說明文字衝突：重新命名後會得到相同欄位名稱的原始欄位 (錯誤，轉換一定會失敗)。
+- 沒有 id_map 說明的欄位 (重新命名後保留原始代碼)。
+- 用不到的 id_map 鍵與 value map 鍵 (CSV 中沒有這個欄位)。
+- 型別不符的 value map：特定 map 不是 dict，或代碼鍵不是標準的整數字串
+  (例如 '01'、'1.0'、' 1')。轉換時原始值先以 value_mapping.code_strings 寫成標準的代碼字串再查表，
+  可轉為數值的值一律寫成標準形式 (整數值為 '1'，不論原本是 1、1.0、'01' 或 '1.0')，
+  因此這些非標準的鍵永遠不會被查到。
+
+fix_descriptions=True 時，衝突的說明文字依 id_unique.py 的做法加上 _變項代碼 後綴並寫回 id_map 檔。
+
+用法 (在 src/ 目錄下執行):
+    python schema_preflight.py [--prefixes s p ...] [--fix]
+有錯誤時結束代碼為 1。
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+import pandas as pd
+
+from map_registry import load_map_json
+
+DATASET_PREFIXES = ['s', 'p', 'f', 't', 'st', 'sc']
+INTEGER_KEY_PATTERN = re.compile(r'-?(0|[1-9]\d*)') # 與 code_strings 對整數值寫出的代碼字串相同的鍵
+MAX_ITEMS_TO_PRINT = 10
+
+
+# --- 讀取 ---
+def dataset_paths(prefix, data_dir, map_dir):
+    """資料集的 (原始 CSV, id_map, value map) 路徑 (與 map_test.process_dataset 相同)"""
+    return (os.path.join(data_dir, f'TIGPSw1_{prefix}.csv'),
+            os.path.join(map_dir, f'tigps_w1_{prefix}_id_map.json'),
+            os.path.join(map_dir, f'tigps_w1_{prefix}_value_maps.json'))
+
+def read_header(csv_path):
+    """只讀原始 CSV 的標題列"""
+    return [str(col) for col in pd.read_csv(csv_path, nrows=0).columns]
+
+
+# --- 檢查 ---
+def description_collisions(header, id_map):
+    """
+    重新命名後會重複的欄位名稱：回傳 {欄位名稱: [原始欄位, ...]}。
+    沒有 id_map 說明的欄位保留原始代碼，也可能與其他欄位的說明文字相同。
+    """
+    owners = {}
+    for column in header:
+        owners.setdefault(str(id_map.get(column, column)), []).append(column)
+    return {name: columns for name, columns in owners.items() if len(columns) > 1}
+
+def unique_descriptions(id_map, header):
+    """
+    依 id_unique.py 的做法修正說明文字衝突：衝突欄位的說明改為「說明_變項代碼」。
+    回傳 (修正後的 id_map, 修改的欄位數)；沒有衝突時回傳原本的 id_map。
+    """
+    collisions = description_collisions(header, id_map)
+    to_fix = {column for columns in collisions.values() for column in columns if column in id_map}
+    if not to_fix:
+        return id_map, 0
+    fixed = {code: (f"{description}_{code}" if code in to_fix else description) for code, description in id_map.items()}
+    return fixed, len(to_fix)
+
+def value_map_type_mismatches(value_maps):
+    """
+    value map 中無法與原始整數代碼對應的項目：回傳 {map 名稱: [問題說明, ...]}。
+    map 名稱為 'general_options' 或欄位代碼。
+    """
+    mismatches = {}
+    general_options = value_maps.get('general_options', {}) or {}
+    specific_maps = value_maps.get('value_maps', {}) or {}
+    if not isinstance(general_options, dict):
+        mismatches['general_options'] = [f"不是 dict ({type(general_options).__name__})"]
+        general_options = {}
+    for name, mapping in [('general_options', general_options)] + list(specific_maps.items()):
+        if not isinstance(mapping, dict):
+            mismatches.setdefault(str(name), []).append(f"不是 dict ({type(mapping).__name__})")
+            continue
+        bad_keys = [str(key) for key in mapping if not INTEGER_KEY_PATTERN.fullmatch(str(key))]
+        if bad_keys:
+            mismatches.setdefault(str(name), []).append(f"非整數代碼鍵: {bad_keys}")
+    return mismatches
+
+def preflight_dataset(prefix, data_dir, map_dir, fix_descriptions=False):
+    """
+    預檢單一資料集，回傳報告 dict：
+    errors / warnings (文字列表)、collisions、unmapped_columns、unused_id_keys、unused_value_map_keys、
+    type_mismatches、fixed (寫回 id_map 的修正數) 與 elapsed (秒)。
+    """
+    start_time = time.perf_counter()
+    csv_path, id_map_path, value_map_path = dataset_paths(prefix, data_dir, map_dir)
+    report = {'prefix': prefix, 'errors': [], 'warnings': [], 'collisions': {}, 'unmapped_columns': [],
+              'unused_id_keys': [], 'unused_value_map_keys': [], 'type_mismatches': {}, 'fixed': 0}
+    try:
+        id_map = load_map_json(id_map_path) if os.path.exists(id_map_path) else None
+        value_maps = load_map_json(value_map_path) if os.path.exists(value_map_path) else None
+    except json.JSONDecodeError as e:
+        report['errors'].append(f"map 檔 JSON 格式錯誤：{e}")
+        report['elapsed'] = time.perf_counter() - start_time
+        return report
+    if id_map is None:
+        report['warnings'].append(f"找不到 id_map {id_map_path}，欄位不會重新命名。")
+        id_map = {}
+    if value_maps is None:
+        report['warnings'].append(f"找不到 value map {value_map_path}，不會進行值轉換。")
+        value_maps = {}
+
+    report['type_mismatches'] = value_map_type_mismatches(value_maps)
+    if not os.path.exists(csv_path):
+        report['errors'].append(f"找不到原始資料 {csv_path}。")
+        report['elapsed'] = time.perf_counter() - start_time
+        return report
+
+    header = read_header(csv_path)
+    header_set = set(header)
+    id_map = {str(code): description for code, description in id_map.items()}
+    report['unmapped_columns'] = [column for column in header if column not in id_map]
+    report['unused_id_keys'] = [code for code in id_map if code not in header_set]
+    report['unused_value_map_keys'] = [str(code) for code in (value_maps.get('value_maps', {}) or {})
+                                       if str(code) not in header_set]
+
+    collisions = description_collisions(header, id_map)
+    if collisions and fix_descriptions:
+        fixed_map, report['fixed'] = unique_descriptions(id_map, header)
+        with open(id_map_path, 'w', encoding='utf-8') as f:
+            json.dump(fixed_map, f, ensure_ascii=False, indent=4)
+        collisions = description_collisions(header, fixed_map)
+    report['collisions'] = collisions
+    if collisions:
+        report['errors'].append(f"{len(collisions)} 個說明文字衝突，重新命名後會有重複欄位。")
+    report['elapsed'] = time.perf_counter() - start_time
+    return report
+
+def run_preflight(prefixes, data_dir, map_dir, fix_descriptions=False):
+    """預檢多個資料集，回傳 {前綴: 報告}"""
+    return {prefix: preflight_dataset(prefix, data_dir, map_dir, fix_descriptions) for prefix in prefixes}
+
+
+# --- 報告 ---
+def _preview(items, limit=MAX_ITEMS_TO_PRINT):
+    items = list(items)
+    text = ", ".join(map(str, items[:limit]))
+    return text + (f" ... (共 {len(items)} 個)" if len(items) > limit else "")
+
+def print_preflight_report(reports):
+    """列印預檢報告，回傳有錯誤的資料集前綴列表"""
+    print("\n##### 結構預檢 (只讀 CSV 標題列與 map 檔) #####")
+    for prefix, report in reports.items():
+        status = "錯誤" if report['errors'] else ("警告" if report['warnings'] else "通過")
+        print(f"\n--- 資料集 {prefix}: {status} ({report['elapsed'] * 1000:.1f} 毫秒) ---")
+        for message in report['errors']:
+            print(f"  [錯誤] {message}")
+        for message in report['warnings']:
+            print(f"  [警告] {message}")
+        if report['fixed']:
+            print(f"  已為 {report['fixed']} 個欄位的說明文字加上 _變項代碼 後綴並寫回 id_map。")
+        for name, columns in list(report['collisions'].items())[:MAX_ITEMS_TO_PRINT]:
+            print(f"  衝突：「{name}」<- {columns}")
+        if report['unmapped_columns']:
+            print(f"  沒有 id_map 說明的欄位: {_preview(report['unmapped_columns'])}")
+        if report['unused_id_keys']:
+            print(f"  CSV 中沒有的 id_map 鍵: {_preview(report['unused_id_keys'])}")
+        if report['unused_value_map_keys']:
+            print(f"  CSV 中沒有的 value map 鍵: {_preview(report['unused_value_map_keys'])}")
+        for name, problems in list(report['type_mismatches'].items())[:MAX_ITEMS_TO_PRINT]:
+            print(f"  型別不符 ({name}): {'；'.join(problems)}")
+        if len(report['type_mismatches']) > MAX_ITEMS_TO_PRINT:
+            print(f"  ... 共 {len(report['type_mismatches'])} 個 value map 型別不符")
+    failed = [prefix for prefix, report in reports.items() if report['errors']]
+    print(f"\n預檢完成：{len(reports) - len(failed)} 個資料集通過，{len(failed)} 個有錯誤"
+          + (f" ({', '.join(failed)})" if failed else "") + "。")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="轉換前檢查 TIGPS map 檔與原始 CSV 標題列是否一致")
+    parser.add_argument('--prefixes', nargs='+', default=DATASET_PREFIXES, help="要檢查的資料集前綴 (預設: 全部六個)")
+    parser.add_argument('--fix', action='store_true', help="為衝突的說明文字加上 _變項代碼 後綴並寫回 id_map")
+    args = parser.parse_args()
+    failed_prefixes = print_preflight_report(run_preflight(args.prefixes, '../data/', '../maps/', args.fix))
+    sys.exit(1 if failed_prefixes else 0)
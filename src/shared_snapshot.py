@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+預處理後資料的共用唯讀快照 (Arrow IPC 檔，以 memory map 讀取)。
+
+儀表板以 st.cache_data 快取整份預處理後的 DataFrame 時，每個呼叫者都會得到一份 pickle 後的複本；
+多位使用者同時開啟儀表板時，每個 session 各持有一份資料，伺服器重新啟動後又要重新解析 CSV。
+本模組將預處理後的資料只寫出一次，成為磁碟上的 Arrow IPC 快照：
+
+- 快照不壓縮，以 pyarrow.memory_map 開啟後，欄位直接指向對應的檔案頁面 (zero-copy)。
+  同一台機器上的所有 session 與 worker 程序共用作業系統的 page cache，記憶體用量不隨使用者數增加；
+  伺服器重新啟動後只需重新對應檔案，不必重新預處理。
+- 數值欄位以原本的 numpy dtype 寫出，NaN 保留為值而非 Arrow 的 null，讀取時不需要轉換。
+- categorical 欄位寫出整數代碼 (-1 為遺漏值)，選項與是否有序記在欄位的 metadata，
+  讀取時以 pd.Categorical.from_codes 直接包住檔案中的代碼，也不複製資料。
+- 其他型別 (例如字串) 以一般的 Arrow 陣列寫出，讀取時才轉換 (會複製)。
+讀回的欄位為唯讀陣列；需要修改時請先 copy()。
+
+快照存於 {snapshot_dir}/{name}-{版本}.arrow，版本由來源檔內容與分析定義的雜湊決定；
+旁邊的 {name}.json 記錄目前的版本與來源檔指紋 (與 aggregate_cube 相同)。
+新版本寫到新的檔案名稱，不覆寫其他程序仍在使用中的舊快照；舊快照在無法刪除時保留 (例如 Windows 上仍被對應)。
+pyarrow 為選用套件，未安裝時 attach_snapshot 回傳 None、publish_snapshot 不寫出任何檔案。
+"""
+import glob
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from build_manifest import same_sources, source_fingerprints
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc # noqa: F401 (pa.ipc 需要另外匯入)
+except ImportError: # pyarrow 為選用套件，未安裝時不使用快照
+    pa = None
+
+SNAPSHOT_EXTENSION = '.arrow'
+CATEGORY_METADATA_KEY = b'categorical' # 欄位 metadata：{"categories": [...], "ordered": bool}
+
+
+# --- DataFrame 與 Arrow 表格的轉換 ---
+def _column_array(series):
+    """單一欄位的 Arrow 陣列與欄位 metadata (categorical 欄位寫出代碼，選項記在 metadata)"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        metadata = {'categories': [category.item() if isinstance(category, np.generic) else category
+                                   for category in series.cat.categories],
+                    'ordered': bool(series.cat.ordered)}
+        return (pa.array(series.cat.codes.to_numpy(), from_pandas=False),
+                {CATEGORY_METADATA_KEY: json.dumps(metadata, ensure_ascii=False).encode('utf-8')})
+    values = series.to_numpy()
+    if values.dtype.kind in 'biuf': # 數值欄位：NaN 保留為值，讀取時可直接對應
+        return pa.array(values, from_pandas=False), None
+    return pa.array(series, from_pandas=True), None
+
+def frame_to_table(df):
+    """DataFrame 轉為快照用的 Arrow 表格 (不保存 index；欄位名稱轉為字串)"""
+    arrays, fields = [], []
+    for column in df.columns:
+        array, metadata = _column_array(df[column])
+        arrays.append(array)
+        fields.append(pa.field(str(column), array.type, metadata=metadata))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+def _column_values(column, field):
+    """Arrow 欄位轉為 pandas 的值；固定寬度且沒有 null 的欄位直接對應檔案內容 (zero-copy)"""
+    array = column.combine_chunks() if column.num_chunks != 1 else column.chunk(0)
+    metadata = field.metadata or {}
+    if CATEGORY_METADATA_KEY in metadata:
+        category_info = json.loads(metadata[CATEGORY_METADATA_KEY].decode('utf-8'))
+        return pd.Categorical.from_codes(array.to_numpy(zero_copy_only=True), categories=category_info['categories'],
+                                         ordered=category_info['ordered'], validate=False)
+    if pa.types.is_floating(field.type) or pa.types.is_integer(field.type) or pa.types.is_boolean(field.type):
+        if array.null_count == 0 and not pa.types.is_boolean(field.type): # Arrow 的布林值以 bit 儲存，需要轉換
+            return array.to_numpy(zero_copy_only=True)
+    return array.to_pandas()
+
+def table_to_frame(table):
+    """快照的 Arrow 表格轉為 DataFrame (盡量不複製資料)"""
+    columns = {field.name: pd.Series(_column_values(table.column(i), field), name=field.name, copy=False)
+               for i, field in enumerate(table.schema)}
+    return pd.DataFrame(columns, index=pd.RangeIndex(table.num_rows), copy=False)
+
+
+# --- 發布與讀取 ---
+def snapshot_paths(snapshot_dir, name, version):
+    """回傳 (快照檔路徑, 版本紀錄 JSON 路徑)"""
+    return (os.path.join(snapshot_dir, f'{name}-{version}{SNAPSHOT_EXTENSION}'),
+            os.path.join(snapshot_dir, name + '.json'))
+
+def snapshot_version(sources, config_key):
+    """由來源檔指紋 (內容雜湊) 與分析定義決定的快照版本"""
+    payload = json.dumps([config_key, sorted((path, (fingerprint or {}).get('sha256'))
+                                             for path, fingerprint in sources.items())], ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+def _load_meta(meta_path):
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def attach_snapshot(snapshot_dir, name, source_paths, config_key):
+    """
+    以 memory map 開啟目前的快照，回傳 DataFrame；
+    未安裝 pyarrow、快照不存在、來源檔內容或分析定義 (config_key) 改變時回傳 None。
+    """
+    if pa is None:
+        return None
+    meta = _load_meta(os.path.join(snapshot_dir, name + '.json'))
+    if meta is None or meta.get('config_key') != config_key:
+        return None
+    if not same_sources(source_fingerprints(source_paths, meta.get('sources')), meta.get('sources', {})):
+        return None
+    snapshot_path, _ = snapshot_paths(snapshot_dir, name, meta.get('version'))
+    try:
+        table = pa.ipc.open_file(pa.memory_map(snapshot_path, 'r')).read_all()
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+    return table_to_frame(table)
+
+def publish_snapshot(df, snapshot_dir, name, source_paths, config_key):
+    """
+    將 df 寫成新版本的快照並更新版本紀錄，回傳快照檔路徑 (未安裝 pyarrow 時回傳 None)。
+    先寫到暫存檔再改名，其他程序不會讀到寫到一半的快照；同時移除可刪除的舊版本。
+    """
+    if pa is None:
+        return None
+    os.makedirs(snapshot_dir, exist_ok=True)
+    sources = source_fingerprints(source_paths)
+    version = snapshot_version(sources, config_key)
+    snapshot_path, meta_path = snapshot_paths(snapshot_dir, name, version)
+    table = frame_to_table(df)
+    temp_path = f'{snapshot_path}.{os.getpid()}.tmp'
+    with pa.OSFile(temp_path, 'wb') as sink: # 不壓縮，才能以 memory map 直接讀取
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp_path, snapshot_path)
+
+    meta = {
+        'built_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'config_key': config_key,
+        'version': version,
+        'sources': sources,
+        'rows': int(len(df)),
+        'columns': int(df.shape[1]),
+    }
+    temp_meta_path = f'{meta_path}.{os.getpid()}.tmp'
+    with open(temp_meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(temp_meta_path, meta_path)
+
+    for old_path in glob.glob(os.path.join(glob.escape(snapshot_dir), f'{glob.escape(name)}-*{SNAPSHOT_EXTENSION}')):
+        if old_path != snapshot_path:
+            try:
+                os.remove(old_path)
+            except OSError: # 其他程序仍在使用 (Windows)，留待下次發布時再刪除
+                pass
+    return snapshot_path
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+儀表板子群體篩選的 bitmap 索引。
+
+篩選變項 (學校類型、性別、地區、社經地位三等分) 在資料載入時只處理一次：
+每個變項的每個選項建立一個 bitmap (以 np.packbits 壓縮的布林陣列，每位學生 1 bit)。
+篩選時同一變項內選取的選項以 OR 合併、不同變項之間以 AND 合併，
+最後才展開為列遮罩，只對篩選後的列重新建立次數 cube (aggregate_cube.build_count_cube)。
+不需要在每次切換篩選條件時重新篩選整個 DataFrame 的所有欄位或重跑 groupby。
+
+篩選變項的來源：
+- 學校類型、性別：學生問卷 (s)。
+- 地區：學校問卷 (sc) 的學校縣市，以學校 ID 連結到學生 (join_store.left_join_positions)。
+- 社經地位：主要照顧者最高學歷 (兩位中較高者) 與家庭經濟狀況自評的代碼各自標準化後取平均，
+  依百分等級分為低 / 中 / 高三等分 (同分者歸入同一組，各組人數只會接近三分之一)。
+各變項的遺漏原因 (general_options 的負數代碼) 不屬於任何選項。
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from join_store import left_join_positions
+from labeled_store import labeled_csv_path, map_raw_columns, read_labeled_table, read_raw_codes
+from map_registry import load_map_json
+from value_mapping import code_table
+
+SCHOOL_ID_COL = '學校 ID'
+SCHOOL_TYPE_COL = '學校類型'
+GENDER_COL = '請問你的性別(生理性別)?'
+CITY_COL = '學校縣市'
+ECONOMY_COL = '請問你認為家裡的經濟狀況為何?'
+EDUCATION_COLS = ['請問你的第一位主要照顧者的最高學歷', '請問你的第二位主要照顧者的最高學歷']
+SES_LEVELS = ['低', '中', '高']
+
+# 側邊欄顯示名稱 -> 篩選資料中的欄位
+FILTER_COLUMNS = {
+    '學校類型': SCHOOL_TYPE_COL,
+    '性別': GENDER_COL,
+    '地區 (學校縣市)': CITY_COL,
+    '社經地位 (三等分)': 'ses_tercile',
+}
+
+
+# --- 篩選變項 ---
+def _without_missing(series, missing_reasons):
+    """遺漏原因 (general_options 的標籤) 改為 NaN"""
+    return series.where(~series.astype(str).isin(missing_reasons))
+
+def _substantive_codes(values, combined_map):
+    """原始代碼轉為數值；只保留對應表中的實質選項 (非負代碼)，遺漏原因與未定義的代碼為 NaN"""
+    codes, _ = code_table(combined_map)
+    numeric = pd.to_numeric(values, errors='coerce')
+    return numeric.where(numeric.isin(codes[codes >= 0]))
+
+def ses_terciles(economy_codes, education_codes):
+    """
+    社經地位三等分 (categorical，選項為 SES_LEVELS)。
+    education_codes 為各主要照顧者學歷代碼的 DataFrame (取較高者)；兩項指標各自標準化後取平均，
+    只有其中一項有效時以該項計算，兩項皆遺漏時為 NaN。
+    """
+    indicators = pd.DataFrame({'economy': economy_codes, 'education': education_codes.max(axis=1)})
+    z_scores = (indicators - indicators.mean()) / indicators.std(ddof=0)
+    percentile = z_scores.mean(axis=1).rank(method='average', pct=True)
+    tercile = np.ceil(percentile * len(SES_LEVELS)).clip(1, len(SES_LEVELS))
+    codes = np.where(percentile.notna(), tercile.fillna(0).astype(int) - 1, -1)
+    return pd.Categorical.from_codes(codes, categories=SES_LEVELS)
+
+def _school_attribute(student_school_ids, school_ids, school_values):
+    """以學校 ID 將學校層級的值對應到每位學生 (同一學校有多列時取第一列)"""
+    left_pos, right_pos = left_join_positions(student_school_ids, school_ids)
+    first = np.append(True, left_pos[1:] != left_pos[:-1])
+    right_pos = right_pos[first]
+    values = pd.Series(school_values).reset_index(drop=True).reindex(right_pos) # -1 (找不到) 成為 NaN
+    return values.to_numpy()
+
+def load_filter_frame(data_dir, map_dir, from_codes=True):
+    """
+    讀取所有篩選變項，回傳與學生資料列順序相同的 DataFrame (欄位為 FILTER_COLUMNS 的值)。
+    from_codes=True 且原始代碼 CSV 存在時由原始代碼讀取，否則讀標註檔。
+    找不到學校問卷時略過地區。
+    """
+    paths = {prefix: (os.path.join(data_dir, f'TIGPSw1_{prefix}.csv'),
+                      os.path.join(map_dir, f'tigps_w1_{prefix}_id_map.json'),
+                      os.path.join(map_dir, f'tigps_w1_{prefix}_value_maps.json')) for prefix in ('s', 'sc')}
+    label_cols = [SCHOOL_ID_COL, SCHOOL_TYPE_COL, GENDER_COL]
+    code_cols = [ECONOMY_COL] + EDUCATION_COLS
+    value_maps = load_map_json(paths['s'][2])
+    missing_reasons = set(str(label) for label in (value_maps.get('general_options', {}) or {}).values())
+    use_codes = from_codes and os.path.exists(paths['s'][0])
+
+    if use_codes:
+        labels = map_raw_columns(*paths['s'], label_cols, as_category=False)
+        raw_codes, column_maps = read_raw_codes(*paths['s'], code_cols)
+        codes = pd.DataFrame({col: _substantive_codes(raw_codes[col], column_maps[col]) for col in raw_codes.columns},
+                             index=raw_codes.index)
+    else:
+        labels = read_labeled_table(labeled_csv_path(data_dir, 's'), columns=label_cols + code_cols,
+                                    as_category=False)
+        # 標籤換回 value map 中的代碼 (順序指標需要數值)
+        id_map = load_map_json(paths['s'][1])
+        specific_maps = value_maps.get('value_maps', {}) or {}
+        column_maps = {description: specific_maps.get(variable) or {}
+                       for variable, description in id_map.items() if description in code_cols}
+        codes = {}
+        for col in code_cols:
+            if col in labels.columns:
+                table_codes, table_labels = code_table(column_maps.get(col, {}))
+                codes[col] = _substantive_codes(labels[col].map(dict(zip(table_labels, table_codes))),
+                                                column_maps.get(col, {}))
+        codes = pd.DataFrame(codes, index=labels.index)
+
+    frame = pd.DataFrame(index=labels.index)
+    for col in (SCHOOL_TYPE_COL, GENDER_COL):
+        if col in labels.columns:
+            frame[col] = _without_missing(labels[col], missing_reasons)
+    if SCHOOL_ID_COL in labels.columns:
+        try:
+            if use_codes and os.path.exists(paths['sc'][0]):
+                schools = map_raw_columns(*paths['sc'], [SCHOOL_ID_COL, CITY_COL], as_category=False)
+            else:
+                schools = read_labeled_table(labeled_csv_path(data_dir, 'sc'), columns=[SCHOOL_ID_COL, CITY_COL],
+                                             as_category=False)
+            if CITY_COL in schools.columns:
+                city = _school_attribute(labels[SCHOOL_ID_COL].to_numpy(), schools[SCHOOL_ID_COL].to_numpy(),
+                                         schools[CITY_COL])
+                frame[CITY_COL] = _without_missing(pd.Series(city, index=labels.index), missing_reasons)
+        except FileNotFoundError:
+            print("提示：找不到學校問卷，略過地區篩選。")
+    if ECONOMY_COL in codes.columns:
+        education = codes[[col for col in EDUCATION_COLS if col in codes.columns]]
+        frame['ses_tercile'] = ses_terciles(codes[ECONOMY_COL], education)
+    return frame
+
+
+# --- bitmap 索引 ---
+class BitmapIndex:
+    """每個篩選變項的每個選項一個壓縮 bitmap；以 OR (同變項) / AND (跨變項) 組合篩選條件"""
+
+    def __init__(self, frame):
+        self.row_count = len(frame)
+        self.levels = {}
+        self.bitmaps = {}
+        for column in frame.columns:
+            values = frame[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                codes, levels = values.cat.codes.to_numpy(), list(values.cat.categories)
+            else:
+                codes, levels = pd.factorize(values, sort=True)
+                levels = list(levels)
+            valid = codes >= 0
+            bits = np.zeros((len(levels), self.row_count), dtype=bool)
+            bits[codes[valid], np.flatnonzero(valid)] = True
+            self.levels[column] = levels
+            self.bitmaps[column] = np.packbits(bits, axis=1)
+
+    def level_counts(self, column):
+        """各選項的人數 {選項: 人數}"""
+        counts = np.unpackbits(self.bitmaps[column], axis=1, count=self.row_count).sum(axis=1)
+        return dict(zip(self.levels[column], counts.tolist()))
+
+    def select(self, selection):
+        """
+        selection 為 {欄位: [選項, ...]}；沒有選取任何選項的欄位不篩選。
+        回傳壓縮的 bitmap (沒有任何篩選條件時為 None)。
+        """
+        combined = None
+        for column, chosen in selection.items():
+            if not chosen or column not in self.bitmaps:
+                continue
+            positions = [self.levels[column].index(level) for level in chosen if level in self.levels[column]]
+            column_bits = np.bitwise_or.reduce(self.bitmaps[column][positions], axis=0) if positions \
+                else np.zeros(self.bitmaps[column].shape[1], dtype=np.uint8)
+            combined = column_bits if combined is None else combined & column_bits
+        return combined
+
+    def mask(self, selection):
+        """篩選條件的列遮罩 (布林陣列)；沒有篩選條件時全為 True"""
+        combined = self.select(selection)
+        if combined is None:
+            return np.ones(self.row_count, dtype=bool)
+        return np.unpackbits(combined, count=self.row_count).astype(bool)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+合成 TIGPS 原始資料產生器。
+
+原始 data/ 檔案不在版本庫中，無法量測或回歸測試轉換流程的效能。
+本模組依 maps/tigps_w1_{prefix}_id_map.json 與 value maps 產生任意列數的原始 CSV：
+
+- 欄位與 id_map 相同 (依 id_map 的順序，欄名為變項代碼)。
+- 有特定 value map 的欄位從實質選項 (非負代碼) 中均勻抽取；
+  依 missing_rate 改為 general_options 的遺漏代碼 (負數)，
+  依 junk_rate 改為 value map 沒有定義的代碼 (JUNK_CODES)，
+  依 blank_rate 留白 (讀入後該欄成為浮點數，與實際資料相同)。
+- 只使用 general_options 的欄位 (年份、時數、人數等) 為 0 到 FREE_VALUE_MAX 的整數，同樣混入遺漏代碼。
+- ID 欄位依學生 → 班級 → 學校的階層產生，各問卷之間可以連結：
+  學生、家長、手足問卷的第 i 列為同一位學生；每 CLASS_SIZE 位學生一個班級、
+  每 CLASSES_PER_SCHOOL 個班級一所學校；導師問卷每班一列、科任教師問卷每班 SUBJECT_TEACHERS_PER_CLASS 列、
+  學校問卷每校一列。
+
+資料分批 (CHUNK_ROWS 列) 產生並附加寫入，記憶體用量與總列數無關；
+每批使用由 (seed, 批次編號) 決定的亂數，同樣的參數總是產生相同的檔案。
+
+用法 (在 src/ 目錄下執行):
+    python synthetic_tigps.py --rows 10000 [--output ../data/synthetic/10000] [--prefixes s p ...]
+--rows 為學生人數，其他問卷的列數依上述階層換算。
+"""
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from map_registry import load_map_json
+from value_mapping import code_table
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError: # pyarrow 為選用套件，未安裝時以 pandas 寫出 CSV (較慢)
+    pa = None
+    pa_csv = None
+
+DATASET_PREFIXES = ['s', 'p', 'f', 't', 'st', 'sc']
+CLASS_SIZE = 25
+CLASSES_PER_SCHOOL = 8
+SUBJECT_TEACHERS_PER_CLASS = 3
+CHUNK_ROWS = 20_000
+FREE_VALUE_MAX = 30
+JUNK_CODES = np.array([77, 88, 98, 997]) # 各 value map 都沒有定義的代碼
+DEFAULT_MISSING_RATE = 0.05
+DEFAULT_JUNK_RATE = 0.002
+
+# 各問卷的紀錄 ID 起始值 (與學生 / 班級 / 學校 ID 分開，避免混淆)
+STUDENT_ID_START = 100001
+CLASS_ID_START = 10001
+SCHOOL_ID_START = 101
+RECORD_ID_STARTS = {'nparents_id': 200001, 'nsibling_id': 300001}
+TEACHER_ID_STARTS = {'t': 400001, 'st': 500001}
+
+
+def dataset_rows(prefix, student_rows):
+    """依學生人數換算各問卷的列數"""
+    classes = math.ceil(student_rows / CLASS_SIZE)
+    if prefix in ('s', 'p', 'f'):
+        return student_rows
+    if prefix == 't':
+        return classes
+    if prefix == 'st':
+        return classes * SUBJECT_TEACHERS_PER_CLASS
+    if prefix == 'sc':
+        return math.ceil(classes / CLASSES_PER_SCHOOL)
+    raise ValueError(f"未知的資料集前綴: {prefix}")
+
+def id_columns(prefix, rows):
+    """第 rows 列 (列號陣列) 的 ID 欄位 {變項代碼: 陣列}，依學生 → 班級 → 學校的階層編號"""
+    if prefix in ('s', 'p', 'f'):
+        classes = rows // CLASS_SIZE
+        ids = {'nstudent_id': STUDENT_ID_START + rows}
+    elif prefix in ('t', 'st'):
+        classes = rows if prefix == 't' else rows // SUBJECT_TEACHERS_PER_CLASS
+        ids = {'nteacher_yrid': TEACHER_ID_STARTS[prefix] + rows}
+    elif prefix == 'sc':
+        return {'nschool_id': SCHOOL_ID_START + rows}
+    else:
+        raise ValueError(f"未知的資料集前綴: {prefix}")
+    ids['school_class'] = CLASS_ID_START + classes
+    ids['nschool_id'] = SCHOOL_ID_START + classes // CLASSES_PER_SCHOOL
+    ids.update({key: start + rows for key, start in RECORD_ID_STARTS.items()})
+    return ids
+
+def column_specs(id_map, value_maps):
+    """每個欄位的實質代碼陣列 (只使用 general_options 的欄位為 None)，依 id_map 順序"""
+    specific_maps = value_maps.get('value_maps', {}) or {}
+    specs = {}
+    for variable in id_map:
+        codes, _ = code_table(specific_maps.get(variable) or {})
+        specs[variable] = codes[codes >= 0] if len(codes[codes >= 0]) else None
+    return specs
+
+def _generate_chunk(rng, specs, id_values, row_count, missing_codes, missing_rate, junk_rate, blank_rate):
+    columns = {}
+    for variable, codes in specs.items():
+        if variable in id_values:
+            columns[variable] = id_values[variable]
+            continue
+        if codes is None:
+            values = rng.integers(0, FREE_VALUE_MAX + 1, row_count)
+        else:
+            values = codes[rng.integers(0, len(codes), row_count)]
+        draw = rng.random(row_count)
+        missing = draw < missing_rate
+        values[missing] = missing_codes[rng.integers(0, len(missing_codes), int(missing.sum()))]
+        if codes is not None:
+            junk = (draw >= missing_rate) & (draw < missing_rate + junk_rate)
+            values[junk] = JUNK_CODES[rng.integers(0, len(JUNK_CODES), int(junk.sum()))]
+        if blank_rate:
+            blank = rng.random(row_count) < blank_rate
+            columns[variable] = pd.arrays.IntegerArray(values.astype(np.int64), blank)
+        else:
+            columns[variable] = values
+    return pd.DataFrame(columns)
+
+def _write_chunk(f, chunk, header):
+    """將一批資料附加寫入以二進位模式開啟的 CSV 檔 (有 pyarrow 時使用其多執行緒的 CSV 寫出)"""
+    if pa_csv is None:
+        f.write(chunk.to_csv(header=header, index=False).encode('utf-8'))
+        return
+    if header:
+        f.write((','.join(chunk.columns) + '\n').encode('utf-8'))
+    pa_csv.write_csv(pa.Table.from_pandas(chunk, preserve_index=False), f,
+                     pa_csv.WriteOptions(include_header=False, quoting_style='none'))
+
+def generate_dataset(prefix, student_rows, map_dir, output_dir, missing_rate=DEFAULT_MISSING_RATE,
+                     junk_rate=DEFAULT_JUNK_RATE, blank_rate=0.0, seed=0):
+    """產生單一問卷的合成原始 CSV (output_dir/TIGPSw1_{prefix}.csv)，回傳 (路徑, 列數)"""
+    id_map = load_map_json(os.path.join(map_dir, f'tigps_w1_{prefix}_id_map.json'))
+    value_maps = load_map_json(os.path.join(map_dir, f'tigps_w1_{prefix}_value_maps.json'))
+    specs = column_specs(id_map, value_maps)
+    general_codes, _ = code_table(value_maps.get('general_options', {}) or {})
+    missing_codes = general_codes[general_codes < 0]
+    if not len(missing_codes):
+        missing_codes = np.array([-9])
+    total_rows = dataset_rows(prefix, student_rows)
+
+    os.makedirs(output_dir, exist_ok=True)
+    csv_path = os.path.join(output_dir, f'TIGPSw1_{prefix}.csv')
+    temp_path = csv_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        for chunk_number, row_start in enumerate(range(0, max(total_rows, 1), CHUNK_ROWS)):
+            row_count = min(CHUNK_ROWS, total_rows - row_start)
+            rng = np.random.default_rng([seed, DATASET_PREFIXES.index(prefix), chunk_number])
+            rows = np.arange(row_start, row_start + row_count)
+            id_values = {key: values for key, values in id_columns(prefix, rows).items() if key in specs}
+            chunk = _generate_chunk(rng, specs, id_values, row_count, missing_codes, missing_rate, junk_rate, blank_rate)
+            _write_chunk(f, chunk, header=(chunk_number == 0))
+    os.replace(temp_path, csv_path) # 寫完才取代，避免留下不完整的檔案
+    return csv_path, total_rows
+
+def generate_all(student_rows, map_dir, output_dir, prefixes=DATASET_PREFIXES, **options):
+    """產生多個問卷的合成原始 CSV，回傳 {前綴: 路徑}"""
+    paths = {}
+    for prefix in prefixes:
+        start_time = time.time()
+        paths[prefix], rows = generate_dataset(prefix, student_rows, map_dir, output_dir, **options)
+        print(f"已產生 {paths[prefix]} ({rows} 列，耗時 {time.time() - start_time:.2f} 秒)")
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="依 id_map 與 value maps 產生合成的 TIGPS 原始 CSV")
+    parser.add_argument('--rows', type=int, default=10_000, help="學生人數 (預設: 10000)")
+    parser.add_argument('--output', default=None, help="輸出目錄 (預設: ../data/synthetic/{rows})")
+    parser.add_argument('--maps', default='../maps/', help="id_map 與 value maps 所在目錄")
+    parser.add_argument('--prefixes', nargs='+', default=DATASET_PREFIXES, help="要產生的資料集前綴 (預設: 全部)")
+    parser.add_argument('--missing-rate', type=float, default=DEFAULT_MISSING_RATE, help="一般遺漏代碼的比例")
+    parser.add_argument('--junk-rate', type=float, default=DEFAULT_JUNK_RATE, help="未定義代碼的比例")
+    parser.add_argument('--blank-rate', type=float, default=0.0, help="空白儲存格的比例")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    output_dir = args.output or os.path.join('../data/synthetic', str(args.rows))
+    generate_all(args.rows, args.maps, output_dir, args.prefixes, missing_rate=args.missing_rate,
+                 junk_rate=args.junk_rate, blank_rate=args.blank_rate, seed=args.seed)
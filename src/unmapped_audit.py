@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+未對應值的完整稽核報告。
+
+map_all_values 在終端機只列出前 50 筆未對應的資料點；本模組則對每個欄位
+彙整「所有」未對應的不重複值、出現次數，以及少量樣本列 (列號與受訪者 ID)，
+並寫出機器可讀的報告：
+    data/audits/TIGPSw1_{prefix}_unmapped.csv   (每個欄位 x 未對應值一列)
+    data/audits/TIGPSw1_{prefix}_unmapped.json  (依欄位分組，含摘要)
+
+只使用 general_options 的欄位 (ID、年份、時數等) 本來就是自由數值，
+其非負數值不列為問題，只累計筆數；這類欄位中的其他值 (未定義的負數代碼、文字) 才列入報告。
+有特定 value map 的欄位則列出所有未對應值。
+
+彙整只處理 translate_values 回傳的失敗位置：每個欄位以 factorize + bincount
+計算次數，樣本列以排序後的位置切片取得，不需逐列存取 DataFrame。
+串流模式可逐批呼叫 record，次數與樣本會跨批次累計。
+"""
+import json
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+# 各資料集用來識別受訪者 / 紀錄的 ID 欄位 (原始變項代碼)
+RECORD_ID_COLUMNS = {
+    's': 'nstudent_id',
+    'p': 'nparents_id',
+    'f': 'nsibling_id',
+    't': 'nteacher_yrid',
+    'st': 'nteacher_yrid',
+    'sc': 'nschool_id',
+}
+REPORT_COLUMNS = ['variable', 'description', 'map_kind', 'unmapped_value', 'count', 'share',
+                  'sample_rows', 'sample_ids']
+FREE_NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?') # 只使用 general_options 的欄位中視為正常的數值
+
+
+def audit_paths(data_dir, prefix):
+    """回傳 (CSV 報告路徑, JSON 報告路徑)"""
+    base = os.path.join(data_dir, 'audits', f'TIGPSw1_{prefix}_unmapped')
+    return base + '.csv', base + '.json'
+
+
+class UnmappedValueAudit:
+    """
+    累計單一資料集所有欄位的未對應值。
+    id_map 用於在報告中附上欄位說明；max_samples 為每個未對應值保留的樣本列數。
+    """
+
+    def __init__(self, prefix, id_map=None, max_samples=5):
+        self.prefix = prefix
+        self.id_map = id_map or {}
+        self.id_column = RECORD_ID_COLUMNS.get(prefix)
+        self.max_samples = max_samples
+        self.rows_checked = 0
+        self.record_ids = None # 另外提供的 ID 欄位 (Series，索引與 frame 相同)；frame 中沒有 ID 欄位時使用
+        self._values = {} # 變項代碼 -> {未對應值字串: {'count', 'rows', 'ids'}}
+        self._map_kinds = {} # 變項代碼 -> 'specific' 或 'general'
+        self.free_value_cells = {} # 只使用 general_options 的欄位 -> 自由數值的筆數
+
+    def add_rows(self, row_count):
+        """記錄已檢查的列數 (串流模式每批呼叫一次)"""
+        self.rows_checked += row_count
+
+    def record(self, variable, labels, failed_positions, frame, has_specific_map=True):
+        """
+        記錄一個欄位的未對應值。
+        labels 與 failed_positions 為 translate_values 的回傳值 (失敗位置上的 labels 即原始值的字串形式)，
+        frame 為轉換前的 DataFrame (用來取得列號與 ID 欄位)；
+        has_specific_map=False 表示此欄位只使用 general_options。
+        """
+        if not len(failed_positions):
+            return
+        variable = str(variable)
+        codes, uniques = pd.factorize(labels[failed_positions])
+        if not has_specific_map:
+            # 只檢查不重複值是否為一般數值，再依 codes 展開
+            free_uniques = np.array([FREE_NUMBER_PATTERN.fullmatch(value) is not None for value in uniques])
+            if free_uniques.any():
+                free_rows = free_uniques[codes]
+                self.free_value_cells[variable] = self.free_value_cells.get(variable, 0) + int(free_rows.sum())
+                if free_rows.all():
+                    return
+                kept_uniques = ~free_uniques
+                failed_positions = failed_positions[~free_rows]
+                codes = (np.cumsum(kept_uniques) - 1)[codes[~free_rows]] # 重新編號保留下來的值
+                uniques = uniques[kept_uniques]
+        self._map_kinds[variable] = 'specific' if has_specific_map else 'general'
+        counts = np.bincount(codes, minlength=len(uniques))
+        # 依值分組後的位置 (保持原本的列順序)，每組取前 max_samples 個作為樣本
+        order = np.argsort(codes, kind='stable')
+        group_starts = np.searchsorted(codes[order], np.arange(len(uniques)))
+        row_numbers = frame.index.to_numpy()
+        if self.id_column in frame.columns:
+            record_ids = frame[self.id_column].to_numpy()
+        elif self.record_ids is not None:
+            record_ids = self.record_ids.reindex(frame.index).to_numpy()
+        else:
+            record_ids = None
+
+        column_values = self._values.setdefault(variable, {})
+        for i, value in enumerate(uniques):
+            entry = column_values.setdefault(value, {'count': 0, 'rows': [], 'ids': []})
+            entry['count'] += int(counts[i])
+            needed = self.max_samples - len(entry['rows'])
+            if needed > 0:
+                sample_positions = failed_positions[order[group_starts[i]:group_starts[i] + min(needed, counts[i])]]
+                entry['rows'].extend(int(row) for row in row_numbers[sample_positions])
+                if record_ids is not None:
+                    entry['ids'].extend(_json_value(v) for v in record_ids[sample_positions])
+
+    @property
+    def columns_with_unmapped(self):
+        return len(self._values)
+
+    @property
+    def distinct_unmapped_values(self):
+        return sum(len(values) for values in self._values.values())
+
+    @property
+    def unmapped_cells(self):
+        return sum(entry['count'] for values in self._values.values() for entry in values.values())
+
+    def to_frame(self):
+        """報告內容 (每個欄位 x 未對應值一列，依欄位順序、次數由多到少排列)"""
+        records = []
+        column_order = {variable: i for i, variable in enumerate(self.id_map)} # 依資料集的欄位順序 (與批次切分無關)
+        for variable in sorted(self._values, key=lambda v: column_order.get(v, len(column_order))):
+            values = self._values[variable]
+            for value, entry in sorted(values.items(), key=lambda item: -item[1]['count']):
+                records.append({
+                    'variable': variable,
+                    'description': self.id_map.get(variable, ''),
+                    'map_kind': self._map_kinds[variable],
+                    'unmapped_value': value,
+                    'count': entry['count'],
+                    'share': round(entry['count'] / self.rows_checked, 6) if self.rows_checked else None,
+                    'sample_rows': ';'.join(str(row) for row in entry['rows']),
+                    'sample_ids': ';'.join(str(record_id) for record_id in entry['ids']),
+                })
+        return pd.DataFrame(records, columns=REPORT_COLUMNS)
+
+    def write(self, data_dir, replace_columns=None):
+        """
+        寫出 CSV 與 JSON 報告，回傳 CSV 報告路徑。
+        replace_columns 若有指定 (只重新轉換部分欄位時)，保留既有報告中其他欄位的內容，
+        只以本次結果取代這些欄位。
+        """
+        csv_path, json_path = audit_paths(data_dir, self.prefix)
+        os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+        report_df = self.to_frame()
+        free_value_cells = dict(self.free_value_cells)
+        if replace_columns is not None and os.path.exists(csv_path):
+            text_columns = {col: str for col in REPORT_COLUMNS if col not in ('count', 'share')}
+            previous_df = pd.read_csv(csv_path, dtype=text_columns, keep_default_na=False, encoding='utf-8-sig')
+            replaced = set(str(col) for col in replace_columns)
+            previous_df = previous_df[~previous_df['variable'].isin(replaced)]
+            report_df = pd.concat([previous_df, report_df], ignore_index=True)
+            column_order = {variable: i for i, variable in enumerate(self.id_map)}
+            order_keys = report_df['variable'].map(column_order).fillna(len(column_order))
+            report_df = report_df.iloc[np.argsort(order_keys.to_numpy(), kind='stable')] # 依欄位順序重新排列
+            if os.path.exists(json_path):
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    previous_free = json.load(f).get('free_numeric_cells', {})
+                free_value_cells = {**{k: v for k, v in previous_free.items() if k not in replaced}, **free_value_cells}
+        report_df.to_csv(csv_path, index=False, encoding='utf-8-sig')
+
+        columns = []
+        for variable, group in report_df.groupby('variable', sort=False):
+            columns.append({
+                'variable': variable,
+                'description': group['description'].iloc[0],
+                'map_kind': group['map_kind'].iloc[0],
+                'unmapped_cells': int(group['count'].sum()),
+                'values': [
+                    {'value': row['unmapped_value'], 'count': int(row['count']),
+                     'sample_rows': [int(r) for r in _split_samples(row['sample_rows'])],
+                     'sample_ids': _split_samples(row['sample_ids'])}
+                    for row in group.to_dict('records')
+                ],
+            })
+        summary = {
+            'prefix': self.prefix,
+            'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'rows_checked': self.rows_checked,
+            'id_column': self.id_column,
+            'columns_with_unmapped': len(columns),
+            'distinct_unmapped_values': int(len(report_df)),
+            'unmapped_cells': int(report_df['count'].sum()),
+            'columns': columns,
+            'free_numeric_cells': free_value_cells, # 只使用 general_options 的欄位中的一般數值 (不列為問題)
+        }
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+        print(f"\n--- 未對應值完整報告：{summary['columns_with_unmapped']} 個欄位、"
+              f"{summary['distinct_unmapped_values']} 種未對應值，共 {summary['unmapped_cells']} 筆 ---")
+        print(f"已寫出: {csv_path}")
+        print(f"已寫出: {json_path}")
+        return csv_path
+
+
+def _json_value(value):
+    """numpy 純量轉為可寫入 JSON 的 Python 值"""
+    return value.item() if isinstance(value, np.generic) else value
+
+def _split_samples(text):
+    return [sample for sample in str(text).split(';') if sample] if isinstance(text, str) else []
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+編譯式數值→標籤轉換引擎。
+
+map_test.py 舊版的 map_all_values 對每個欄位都重新組合一次
+general_options + 特定 value map，並把整個欄位 astype(str) 後用 dict 做
+Series.replace。本模組改為：
+
+1. 每個「不同的」value map 只編譯一次 (general 打底、特定覆蓋)，
+   共用相同 map 的欄位 (例如學生問卷 604 個欄位只有 55 種 map) 直接重用。
+2. 轉換時只對欄位中「不重複的值」做字串化與查表，
+   再以整數索引陣列 (lookup table / factorize codes) 一次展開回整欄。
+
+查表的鍵為值的代碼字串 (code_strings)：可轉為數值的值一律寫成標準形式，
+因此結果與讀入時的型別無關 (整數欄位的 4、因含空白而被讀成浮點數的 4.0、以字串讀入的 '4' 都對應到鍵 '4')，
+與 code_positions 以數值比對代碼的結果一致。
+已對應的值換成標籤；未對應的值 (output_strings)：數值寫成同樣的標準形式 (4.0 → '4')，
+文字保留原本的內容 (例如電話號碼 '0912345678'、有前導零的代碼 '007' 不會被改寫)，NaN → 'nan'。
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+# 整數欄位的值域若小於此大小，直接用密集查表陣列 (values - min) 取代雜湊
+MAX_DENSE_LOOKUP_SPAN = 1 << 16
+# 絕對值小於此值的數值才寫成標準形式 (浮點數可精確表示的整數範圍)；更大的值保留原本的字串
+MAX_EXACT_NUMBER = 2 ** 53
+# 代碼字串規則 (code_strings) 的版本，記錄在建置紀錄中；規則改變時既有的標註檔需要完整重建
+VALUE_RULE = 'code_strings-2'
+
+
+class CompiledValueMaps:
+    """
+    預先編譯的 value map 集合。
+
+    general_options: {代碼: 標籤}，套用到所有欄位。
+    specific_maps: {欄位代碼: {代碼: 標籤}}，優先於 general_options。
+    """
+
+    def __init__(self, general_options, specific_maps):
+        self.general_map = {str(k): str(v) for k, v in (general_options or {}).items()}
+        self._compiled = {}        # map 內容的 key -> 組合後的對應表 (共用同一個 dict 物件)
+        self._column_maps = {}     # 欄位代碼 -> 組合後的對應表
+        for column, specific_map in (specific_maps or {}).items():
+            if isinstance(specific_map, dict) and specific_map:
+                specific_str = {str(k): str(v) for k, v in specific_map.items()}
+                self._column_maps[str(column)] = self._compile(specific_str)
+
+    @classmethod
+    def from_tables(cls, general_map, column_maps):
+        """
+        由已組合好的對應表直接建立 (供 map_registry 使用，不再重新組合與去重)。
+        column_maps: {欄位代碼: 組合後的對應表}，相同內容的欄位應共用同一個 dict 物件。
+        """
+        compiled = cls.__new__(cls)
+        compiled.general_map = general_map
+        compiled._column_maps = dict(column_maps)
+        compiled._compiled = {id(m): m for m in compiled._column_maps.values()}
+        return compiled
+
+    def _compile(self, specific_str):
+        key = tuple(sorted(specific_str.items()))
+        combined_map = self._compiled.get(key)
+        if combined_map is None:
+            combined_map = self.general_map.copy()
+            combined_map.update(specific_str) # 特定選項覆蓋通用選項中的相同鍵
+            self._compiled[key] = combined_map
+        return combined_map
+
+    @property
+    def distinct_map_count(self):
+        """編譯後不同對應表的數量 (不含只用 general_options 的欄位)"""
+        return len(self._compiled)
+
+    @property
+    def column_count(self):
+        """有特定 value map 的欄位數"""
+        return len(self._column_maps)
+
+    def for_column(self, column):
+        """取得欄位的組合對應表；沒有特定 map 時回傳 general_options"""
+        return self._column_maps.get(str(column), self.general_map)
+
+    def has_specific(self, column):
+        """欄位是否有自己的特定 value map (否則只套用 general_options)"""
+        return str(column) in self._column_maps
+
+
+def code_strings(values):
+    """
+    查表用的代碼字串 (object ndarray)：
+    可轉為數值的值寫成標準形式 (整數值為 '4'，不論原本是 4、4.0、'4.0' 或 '04'；其他數值為 '0.5')，
+    其餘的值 (文字、NaN、布林值) 同 astype(str)。
+    """
+    array = np.asarray(values)
+    result = np.array([str(value) for value in array.tolist()], dtype=object) if array.dtype.kind != 'f' \
+        else array.astype(str).astype(object)
+    if array.dtype.kind in 'fiu':
+        numeric = array.astype(float)
+    else:
+        objects = array.astype(object)
+        is_bool = np.fromiter((isinstance(value, (bool, np.bool_)) for value in objects), dtype=bool,
+                              count=len(objects))
+        numeric = pd.to_numeric(pd.Series(np.where(is_bool, None, objects)), errors='coerce').to_numpy(dtype=float)
+    exact = np.isfinite(numeric) & (np.abs(numeric) < MAX_EXACT_NUMBER)
+    integral = exact & (numeric == np.floor(numeric))
+    result[integral] = [str(int(value)) for value in numeric[integral]]
+    fractional = exact & ~integral
+    result[fractional] = [str(float(value)) for value in numeric[fractional]]
+    return result
+
+def output_strings(values, keys=None):
+    """
+    未對應值寫入標註檔的字串 (object ndarray)：
+    數值 (int / float，不含布林值) 寫成其代碼字串 (keys，預設為 code_strings(values))，
+    文字等其他值同 str(value)，不改寫其內容。
+    """
+    array = np.asarray(values)
+    keys = code_strings(array) if keys is None else keys
+    if array.dtype.kind in 'fiu':
+        return keys
+    objects = array.astype(object)
+    is_number = np.fromiter((isinstance(value, (int, float, np.integer, np.floating))
+                             and not isinstance(value, (bool, np.bool_)) for value in objects),
+                            dtype=bool, count=len(objects))
+    return np.where(is_number, keys, np.array([str(value) for value in objects], dtype=object))
+
+def translate_values(values, combined_map):
+    """
+    將一個欄位的值依 combined_map 轉換為標籤。
+
+    回傳 (labels, failed_positions)：
+    labels 為 object ndarray：以 code_strings 的鍵查表，已對應的值為標籤，
+    未對應的值為 output_strings 的結果 (NaN 為 'nan'、None 為 'None')；
+    failed_positions 為「非 NA 且不在對應表中」的列位置 (整數 ndarray)。
+    """
+    array = np.asarray(values)
+
+    if array.dtype.kind in 'iu' and array.size:
+        # 整數欄位：以密集查表陣列處理 (不需雜湊，也不需逐筆轉字串)
+        vmin = int(array.min())
+        span = int(array.max()) - vmin + 1
+        if span <= MAX_DENSE_LOOKUP_SPAN:
+            offsets = array - vmin
+            present = np.flatnonzero(np.bincount(offsets, minlength=span))
+            lookup = np.empty(span, dtype=object)
+            failed_lookup = np.zeros(span, dtype=bool)
+            for offset in present:
+                code_str = str(offset + vmin)
+                label = combined_map.get(code_str)
+                if label is None:
+                    lookup[offset] = code_str
+                    failed_lookup[offset] = True
+                else:
+                    lookup[offset] = label
+            labels = lookup[offsets]
+            failed_positions = np.flatnonzero(failed_lookup[offsets]) if failed_lookup.any() \
+                else np.empty(0, dtype=np.intp)
+            return labels, failed_positions
+
+    # 一般情況：factorize 取得不重複值與整數 codes，只對不重複值轉為代碼字串並查表
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    codes, uniques = pd.factorize(series)
+    uniques = np.asarray(uniques, dtype=object)
+    uniques_key = code_strings(uniques)
+    uniques_out = output_strings(uniques, uniques_key)
+    lookup = np.empty(len(uniques), dtype=object)
+    failed_lookup = np.zeros(len(uniques), dtype=bool)
+    for i, (code_str, out_str) in enumerate(zip(uniques_key, uniques_out)):
+        label = combined_map.get(code_str)
+        if label is None:
+            lookup[i] = out_str
+            failed_lookup[i] = code_str != 'nan' # 字串 'nan' 不視為未對應
+        else:
+            lookup[i] = label
+    labels = lookup[codes] if len(lookup) else np.empty(len(codes), dtype=object)
+
+    # NA 值 (codes == -1) 依 astype(str) 的結果個別處理 (NaN → 'nan'，None 保持 None)，且不視為未對應
+    na_positions = np.flatnonzero(codes == -1)
+    if len(na_positions):
+        na_as_str = series.iloc[na_positions].astype(str).to_numpy()
+        labels[na_positions] = [combined_map.get(v, v) if isinstance(v, str) else v for v in na_as_str]
+
+    failed_positions = np.flatnonzero((codes >= 0) & failed_lookup[codes]) if failed_lookup.any() \
+        else np.empty(0, dtype=np.intp)
+    return labels, failed_positions
+
+
+def code_table(combined_map):
+    """
+    對應表中的整數代碼與標籤 (依代碼排序)：回傳 (codes: int64 ndarray, labels: object ndarray)。
+    非整數代碼不包含在內。
+    """
+    pairs = sorted((int(code), label) for code, label in combined_map.items() if re.fullmatch(r'-?\d+', str(code)))
+    codes = np.array([code for code, _ in pairs], dtype=np.int64)
+    labels = np.array([label for _, label in pairs], dtype=object)
+    return codes, labels
+
+def code_positions(values, sorted_codes):
+    """
+    將原始代碼轉為在 sorted_codes (遞增的整數代碼) 中的位置 (int64 ndarray)；
+    不在其中的值 (未定義的代碼、NaN、文字) 為 -1。
+    只對不重複的值做數值轉換與查找，再以 factorize codes 展開回整欄。
+    """
+    codes, uniques = pd.factorize(values)
+    if not len(sorted_codes):
+        return np.full(len(codes), -1, dtype=np.int64)
+    numeric = pd.to_numeric(pd.Series(uniques, dtype=object), errors='coerce').to_numpy(dtype=float)
+    positions = np.minimum(np.searchsorted(sorted_codes, np.nan_to_num(numeric, nan=-np.inf)), len(sorted_codes) - 1)
+    unique_positions = np.append(np.where(sorted_codes[positions] == numeric, positions, -1), -1) # 最後一格給 NA (code -1)
+    return unique_positions[codes]
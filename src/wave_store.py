@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+依調查波次 (wave) 與問卷前綴分割的縱貫資料儲存。
+
+map_test.py 等流程固定處理第一波 (tigps_w1_* map、TIGPSw1_{prefix}.csv、每個前綴一個輸出檔)。
+TIGPS 為追蹤調查，本模組另外維護一個以波次分割的標註資料庫：
+
+    data/waves/wave={波次}/prefix={前綴}/part-0.parquet   (未安裝 pyarrow 時為 part-0.csv)
+    data/waves/_catalog.json                              (各分割的列數、欄位、來源檔與使用的 map)
+
+- 匯入 (ingest_wave)：讀取 TIGPSw{波次}_{前綴}.csv，轉換值並以說明文字重新命名欄位 (與標註檔相同)，
+  寫成新的分割。只會新增分割，已存在的分割不會被改寫 (replace=True 時才重寫該分割)。
+- map 解析 (resolve_maps)：優先使用該波次的 tigps_w{波次}_{前綴}_*.json，
+  沒有時沿用最近一個較早波次的 map。
+- 讀取 (read_wave_table / cross_wave_long)：依目錄檔只開啟指定波次、且含有所需欄位的分割，
+  並只讀取需要的欄位。cross_wave_long 回傳以追蹤 ID (例如學生 ID) 為鍵的長格式跨波次資料。
+
+用法 (在 src/ 目錄下執行):
+    python wave_store.py ingest [--waves 1 2] [--prefixes s p ...] [--replace]
+    python wave_store.py list
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import time
+
+import pandas as pd
+
+from labeled_store import pq, to_columnar_frame
+from map_registry import load_map_json
+from value_mapping import CompiledValueMaps, translate_values
+
+STORE_DIRNAME = 'waves'
+CATALOG_FILENAME = '_catalog.json'
+DATASET_PREFIXES = ['s', 'p', 'f', 't', 'st', 'sc']
+# 各問卷跨波次追蹤的 ID 欄位 (說明文字)
+PANEL_KEYS = {
+    's': '學生 ID',
+    'p': '學生 ID',
+    'f': '學生 ID',
+    't': '教師 ID',
+    'st': '教師 ID',
+    'sc': '學校 ID',
+}
+
+
+# --- 路徑與 map 解析 ---
+def store_dir_for(data_dir):
+    return os.path.join(data_dir, STORE_DIRNAME)
+
+def raw_csv_path(data_dir, wave, prefix):
+    return os.path.join(data_dir, f'TIGPSw{wave}_{prefix}.csv')
+
+def wave_map_paths(map_dir, wave, prefix):
+    return (os.path.join(map_dir, f'tigps_w{wave}_{prefix}_id_map.json'),
+            os.path.join(map_dir, f'tigps_w{wave}_{prefix}_value_maps.json'))
+
+def discover_waves(data_dir, prefix=None):
+    """data_dir 中有原始 CSV 的波次 (遞增)；prefix 指定時只看該問卷"""
+    pattern = re.compile(r'^TIGPSw(?P<wave>\d+)_(?P<prefix>[a-z]+)\.csv$')
+    waves = set()
+    for filepath in glob.glob(os.path.join(data_dir, 'TIGPSw*_*.csv')):
+        match = pattern.match(os.path.basename(filepath))
+        if match and (prefix is None or match.group('prefix') == prefix):
+            waves.add(int(match.group('wave')))
+    return sorted(waves)
+
+def resolve_maps(map_dir, wave, prefix):
+    """
+    回傳 (id_map 路徑, value map 路徑, map 所屬波次)：該波次沒有自己的 map 時沿用最近一個較早波次的 map。
+    找不到任何波次的 map 時拋出 FileNotFoundError。
+    """
+    for map_wave in range(wave, 0, -1):
+        id_map_path, value_map_path = wave_map_paths(map_dir, map_wave, prefix)
+        if os.path.exists(id_map_path) and os.path.exists(value_map_path):
+            return id_map_path, value_map_path, map_wave
+    raise FileNotFoundError(f"找不到第 {wave} 波 (或更早波次) 問卷 {prefix} 的 map 檔 ({map_dir})")
+
+def _file_stamp(filepath):
+    file_stat = os.stat(filepath)
+    return {'path': os.path.abspath(filepath), 'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns}
+
+
+# --- 目錄檔 ---
+def load_catalog(store_dir):
+    """讀取目錄檔；尚未建立時回傳空的目錄 ({'partitions': []})"""
+    catalog_path = os.path.join(store_dir, CATALOG_FILENAME)
+    if not os.path.exists(catalog_path):
+        return {'partitions': []}
+    with open(catalog_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _write_catalog(store_dir, catalog):
+    """先寫入暫存檔再取代，避免中斷時留下不完整的目錄檔"""
+    catalog_path = os.path.join(store_dir, CATALOG_FILENAME)
+    temp_path = catalog_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(catalog, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, catalog_path)
+
+def find_partitions(catalog, waves=None, prefixes=None, columns=None):
+    """
+    依波次、問卷前綴與欄位篩選分割 (只看目錄檔，不開啟資料檔)。
+    columns 指定時只保留至少含有其中一個欄位的分割。
+    """
+    wanted_columns = set(columns) if columns is not None else None
+    return [entry for entry in catalog['partitions']
+            if (waves is None or entry['wave'] in waves)
+            and (prefixes is None or entry['prefix'] in prefixes)
+            and (wanted_columns is None or wanted_columns & set(entry['columns']))]
+
+
+# --- 匯入 ---
+def _label_frame(raw_df, id_map, compiled_maps):
+    """轉換所有欄位的值並以說明文字重新命名 (沒有說明的欄位保留原始代碼)，轉為欄式儲存的型別"""
+    labeled_columns = {}
+    for code in raw_df.columns:
+        combined_map = compiled_maps.for_column(code)
+        if combined_map:
+            labels, _ = translate_values(raw_df[code], combined_map)
+            labeled_columns[code] = pd.Series(labels, index=raw_df.index)
+        else:
+            labeled_columns[code] = raw_df[code]
+    labeled_df = pd.DataFrame(labeled_columns, index=raw_df.index)
+    labeled_df.columns = [str(id_map.get(str(code), code)) for code in raw_df.columns]
+    duplicated = labeled_df.columns[labeled_df.columns.duplicated()].unique()
+    if len(duplicated):
+        raise ValueError(f"id_map 說明文字衝突，重新命名後有重複欄位: {list(duplicated)} (見 schema_preflight.py)")
+    return to_columnar_frame(labeled_df)
+
+def _write_partition(df, partition_dir):
+    """寫出分割資料檔 (parquet；未安裝 pyarrow 時為 CSV)，回傳相對於 partition_dir 的檔名"""
+    os.makedirs(partition_dir, exist_ok=True)
+    filename = 'part-0.parquet' if pq is not None else 'part-0.csv'
+    filepath = os.path.join(partition_dir, filename)
+    temp_path = filepath + '.tmp'
+    if pq is not None:
+        df.to_parquet(temp_path, index=False)
+    else:
+        df.to_csv(temp_path, index=False, encoding='utf-8-sig')
+    os.replace(temp_path, filepath)
+    return filename
+
+def ingest_wave(wave, prefixes, data_dir, map_dir, store_dir=None, replace=False):
+    """
+    將一個波次的原始 CSV 匯入為新的分割。已存在的分割略過 (replace=True 時重寫)，其他分割不受影響。
+    回傳各前綴的狀態 {前綴: 'ingested' / 'exists' / 'missing'}。
+    """
+    store_dir = store_dir or store_dir_for(data_dir)
+    os.makedirs(store_dir, exist_ok=True)
+    catalog = load_catalog(store_dir)
+    statuses = {}
+    for prefix in prefixes:
+        csv_path = raw_csv_path(data_dir, wave, prefix)
+        existing = find_partitions(catalog, waves=[wave], prefixes=[prefix])
+        if existing and not replace:
+            print(f"第 {wave} 波 {prefix}: 分割已存在，不重寫 (需要重寫請指定 replace)。")
+            statuses[prefix] = 'exists'
+            continue
+        if not os.path.exists(csv_path):
+            print(f"第 {wave} 波 {prefix}: 找不到原始資料 {csv_path}，略過。")
+            statuses[prefix] = 'missing'
+            continue
+
+        start_time = time.time()
+        id_map_path, value_map_path, map_wave = resolve_maps(map_dir, wave, prefix)
+        if map_wave != wave:
+            print(f"第 {wave} 波 {prefix}: 沒有本波次的 map，沿用第 {map_wave} 波的 map。")
+        id_map = {str(code): description for code, description in load_map_json(id_map_path).items()}
+        value_maps = load_map_json(value_map_path)
+        compiled_maps = CompiledValueMaps(value_maps.get('general_options', {}), value_maps.get('value_maps', {}))
+        labeled_df = _label_frame(pd.read_csv(csv_path, low_memory=False), id_map, compiled_maps)
+
+        partition_dir = os.path.join(store_dir, f'wave={wave}', f'prefix={prefix}')
+        filename = _write_partition(labeled_df, partition_dir)
+        entry = {
+            'wave': wave,
+            'prefix': prefix,
+            'path': os.path.relpath(os.path.join(partition_dir, filename), store_dir),
+            'rows': len(labeled_df),
+            'columns': [str(col) for col in labeled_df.columns],
+            'map_wave': map_wave,
+            'sources': {'raw_csv': _file_stamp(csv_path), 'id_map': _file_stamp(id_map_path),
+                        'value_map': _file_stamp(value_map_path)},
+            'ingested_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        catalog['partitions'] = [e for e in catalog['partitions'] if e not in existing] + [entry]
+        catalog['partitions'].sort(key=lambda e: (e['wave'], e['prefix']))
+        _write_catalog(store_dir, catalog) # 每個分割寫完就更新目錄檔
+        print(f"第 {wave} 波 {prefix}: 已匯入 {len(labeled_df)} 列、{labeled_df.shape[1]} 欄 "
+              f"(耗時 {time.time() - start_time:.2f} 秒)")
+        statuses[prefix] = 'ingested'
+    return statuses
+
+def stale_partitions(catalog):
+    """來源檔 (原始 CSV 或 map) 在匯入後有變動的分割 (只比對大小與修改時間)"""
+    stale = []
+    for entry in catalog['partitions']:
+        for source in entry['sources'].values():
+            current = _file_stamp(source['path']) if os.path.exists(source['path']) else None
+            if current is None or (current['size'], current['mtime_ns']) != (source['size'], source['mtime_ns']):
+                stale.append(entry)
+                break
+    return stale
+
+
+# --- 讀取 ---
+def _read_partition(store_dir, entry, columns):
+    """只讀取分割中存在的 columns (依要求的順序)"""
+    present = [col for col in columns if col in entry['columns']]
+    filepath = os.path.join(store_dir, entry['path'])
+    if filepath.endswith('.parquet'):
+        return pd.read_parquet(filepath, columns=present)
+    wanted = set(present)
+    df = pd.read_csv(filepath, usecols=lambda col: col in wanted, low_memory=False)
+    return df[present]
+
+def read_wave_table(store_dir, prefix, columns=None, waves=None):
+    """
+    指定問卷在各波次的資料 (寬格式) 直接上下合併，加上 'wave' 欄位。
+    columns 為 None 時讀取全部欄位；某波次沒有的欄位為 NaN。categorical 欄位轉回 object
+    (各波次的選項可能不同)。
+    """
+    catalog = load_catalog(store_dir)
+    frames = []
+    for entry in find_partitions(catalog, waves=waves, prefixes=[prefix], columns=columns):
+        df = _read_partition(store_dir, entry, columns if columns is not None else entry['columns'])
+        category_cols = df.select_dtypes(include='category').columns
+        df[category_cols] = df[category_cols].astype(object)
+        df.insert(0, 'wave', entry['wave'])
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=['wave'] + list(columns or []))
+    return pd.concat(frames, ignore_index=True)
+
+def cross_wave_long(store_dir, prefix, variables, id_column=None, waves=None):
+    """
+    指定變項的跨波次長格式資料：欄位為 [追蹤 ID, wave, variable, value]，依 ID、變項、波次排序。
+    id_column 預設為 PANEL_KEYS[prefix]；沒有 ID 欄位或沒有任何指定變項的分割不會被讀取。
+    """
+    id_column = id_column or PANEL_KEYS[prefix]
+    catalog = load_catalog(store_dir)
+    frames = []
+    for entry in find_partitions(catalog, waves=waves, prefixes=[prefix], columns=variables):
+        present = [variable for variable in variables if variable in entry['columns']]
+        if id_column not in entry['columns']:
+            print(f"警告：第 {entry['wave']} 波 {prefix} 沒有追蹤 ID 欄位「{id_column}」，略過。")
+            continue
+        df = _read_partition(store_dir, entry, [id_column] + present)
+        long = df.astype({col: object for col in present}).melt(
+            id_vars=[id_column], value_vars=present, var_name='variable', value_name='value')
+        long.insert(1, 'wave', entry['wave'])
+        frames.append(long)
+    if not frames:
+        return pd.DataFrame(columns=[id_column, 'wave', 'variable', 'value'])
+    long = pd.concat(frames, ignore_index=True)
+    return long.sort_values([id_column, 'variable', 'wave'], kind='stable').reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    data_dir = '../data/'
+    map_dir = '../maps/'
+    parser = argparse.ArgumentParser(description="依波次分割的 TIGPS 標註資料庫")
+    parser.add_argument('action', choices=['ingest', 'list'], help="ingest: 匯入新波次；list: 列出已有的分割")
+    parser.add_argument('--waves', nargs='+', type=int, default=None,
+                        help="要匯入的波次 (預設: data/ 中所有有原始 CSV 的波次)")
+    parser.add_argument('--prefixes', nargs='+', default=DATASET_PREFIXES, help="要匯入的問卷前綴 (預設: 全部六個)")
+    parser.add_argument('--replace', action='store_true', help="重寫已存在的分割")
+    args = parser.parse_args()
+    store_dir = store_dir_for(data_dir)
+
+    if args.action == 'ingest':
+        for wave in args.waves or discover_waves(data_dir):
+            print(f"\n--- 匯入第 {wave} 波 ---")
+            ingest_wave(wave, args.prefixes, data_dir, map_dir, store_dir, replace=args.replace)
+
+    catalog = load_catalog(store_dir)
+    stale = stale_partitions(catalog)
+    print(f"\n{'波次':<6}{'前綴':<6}{'列數':>10}{'欄數':>8}  {'map':<6}匯入時間")
+    for entry in catalog['partitions']:
+        note = "  (來源已變動，可用 --replace 重新匯入)" if entry in stale else ""
+        print(f"{entry['wave']:<6}{entry['prefix']:<6}{entry['rows']:>10}{len(entry['columns']):>8}  "
+              f"w{entry['map_wave']:<5}{entry['ingested_at']}{note}")
+    print(f"目錄檔: {os.path.join(store_dir, CATALOG_FILENAME)}")
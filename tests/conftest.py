@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""src/ 內的模組以平面方式互相匯入 (在 src/ 目錄下執行)，測試時同樣將 src/ 加入匯入路徑"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+labeled_store.ColumnarChunkWriter：串流模式逐批寫出的 parquet 與一般模式 (to_columnar_frame) 的內容相同，
+包含欄位型別在批次間改變的情況 (第一批全為空白的欄位之後出現文字、整數欄位之後出現空白)。
+"""
+import pandas as pd
+import pytest
+
+from labeled_store import ColumnarChunkWriter, pq, to_columnar_frame
+
+pytestmark = pytest.mark.skipif(pq is None, reason="需要 pyarrow")
+
+
+def _write_streaming(chunks, csv_path, parquet_path):
+    """與 map_test 的串流模式相同：每批先附加寫入 CSV，再交給 ColumnarChunkWriter"""
+    writer = ColumnarChunkWriter(str(parquet_path), csv_path=str(csv_path), chunksize=2)
+    with open(csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(f, header=(i == 0), index=False)
+            writer.write(chunk)
+    writer.close()
+    return writer
+
+def _assert_same_as_in_memory(chunks, parquet_path):
+    expected = to_columnar_frame(pd.concat(chunks, ignore_index=True))
+    result = pd.read_parquet(parquet_path)
+    assert result.dtypes.to_dict().keys() == expected.dtypes.to_dict().keys()
+    for column in expected.columns:
+        if isinstance(expected[column].dtype, pd.CategoricalDtype):
+            # 類別順序依各批出現的順序而定，只比較值
+            assert isinstance(result[column].dtype, pd.CategoricalDtype)
+            pd.testing.assert_series_equal(result[column].astype(object), expected[column].astype(object))
+        else:
+            pd.testing.assert_series_equal(result[column], expected[column])
+
+def test_consistent_chunks_are_written_directly(tmp_path, capsys):
+    chunks = [pd.DataFrame({'label': ['很同意', '同意'], 'hours': ['1', '2']}),
+              pd.DataFrame({'label': ['不同意', '同意'], 'hours': ['3', '4']})]
+    writer = _write_streaming(chunks, tmp_path / 'a.csv', tmp_path / 'a.parquet')
+    assert not writer.failed
+    assert "重新寫出" not in capsys.readouterr().out
+    _assert_same_as_in_memory(chunks, tmp_path / 'a.parquet')
+
+def test_text_after_blank_first_chunk_keeps_parquet(tmp_path):
+    chunks = [pd.DataFrame({'free': ['nan', 'nan'], 'id': ['1', '2']}),
+              pd.DataFrame({'free': ['很同意', 'nan'], 'id': ['3', '4']})]
+    writer = _write_streaming(chunks, tmp_path / 'a.csv', tmp_path / 'a.parquet')
+    assert not writer.failed
+    _assert_same_as_in_memory(chunks, tmp_path / 'a.parquet')
+
+def test_blank_after_integer_first_chunk_keeps_parquet(tmp_path):
+    chunks = [pd.DataFrame({'hours': ['1', '2'], 'label': ['同意', '同意']}),
+              pd.DataFrame({'hours': ['nan', '5'], 'label': ['nan', 'nan']}),
+              pd.DataFrame({'hours': ['0.5', '3'], 'label': ['不同意', 'nan']})]
+    writer = _write_streaming(chunks, tmp_path / 'a.csv', tmp_path / 'a.parquet')
+    assert not writer.failed
+    _assert_same_as_in_memory(chunks, tmp_path / 'a.parquet')
+    assert pd.read_parquet(tmp_path / 'a.parquet')['hours'].dtype == 'float64'
+
+def test_without_csv_path_mismatch_discards_parquet(tmp_path):
+    parquet_path = tmp_path / 'a.parquet'
+    writer = ColumnarChunkWriter(str(parquet_path))
+    writer.write(pd.DataFrame({'free': ['nan', 'nan']}))
+    writer.write(pd.DataFrame({'free': ['很同意', 'nan']}))
+    writer.close()
+    assert writer.failed and not parquet_path.exists()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+向量化數值核心與 scipy / pandas 參考實作的比對 (固定亂數種子的隨機資料)：
+- association_matrix：由列聯表計算的 Spearman ρ、Kendall τ-b、Cramér's V (逐對排除遺漏值)
+- feature_screening.batched_anova：由次數表計算的單因子 ANOVA (含組內平方和為 0 的題目)
+- contingency_tests：固定邊際的超幾何抽樣、置換卡方檢定與 Fisher 精確檢定
+- join_store.left_join_positions：與 pd.merge(how='left') 的列對應
+
+執行方式 (在專案根目錄)：
+    python -m pytest -q tests
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.stats as stats
+from scipy.stats.contingency import association
+
+from association_matrix import association_matrices
+from feature_screening import batched_anova
+from contingency_tests import expected_frequencies, monte_carlo_chi2, random_tables, sparse_table_test
+from join_store import left_join_positions
+
+
+# --- association_matrix ---
+def _random_items(seed, rows=400, level_counts=(2, 3, 4, 5, 4), missing_rate=0.1):
+    """各題目的選項位置 (-1 為遺漏)；題目之間有相關，才不會所有係數都接近 0"""
+    rng = np.random.default_rng(seed)
+    latent = rng.normal(size=rows)
+    columns = []
+    for levels in level_counts:
+        score = latent + rng.normal(scale=1.5, size=rows)
+        codes = np.digitize(score, np.quantile(score, np.linspace(0, 1, levels + 1)[1:-1]))
+        codes[rng.random(rows) < missing_rate] = -1
+        columns.append(codes)
+    return np.column_stack(columns).astype(np.int64), np.asarray(level_counts)
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_association_matrices_match_scipy(seed):
+    level_codes, level_counts = _random_items(seed)
+    results = association_matrices(level_codes, level_counts, item_block=2) # 小區塊，也測到跨區塊的組合
+    items = len(level_counts)
+    for i in range(items):
+        for j in range(items):
+            valid = (level_codes[:, i] >= 0) & (level_codes[:, j] >= 0)
+            x, y = level_codes[valid, i], level_codes[valid, j]
+            assert results['n'][i, j] == valid.sum()
+            assert results['spearman'][i, j] == pytest.approx(stats.spearmanr(x, y).statistic, abs=1e-10)
+            assert results['kendall'][i, j] == pytest.approx(stats.kendalltau(x, y, variant='b').statistic, abs=1e-10)
+            observed = pd.crosstab(x, y).to_numpy()
+            assert results['cramers_v'][i, j] == pytest.approx(association(observed, method='cramer'), abs=1e-10)
+
+def test_association_constant_item_is_nan():
+    level_codes, level_counts = _random_items(3, level_counts=(3, 3))
+    level_codes[level_codes[:, 0] >= 0, 0] = 1 # 第一題只有一個選項有回答
+    results = association_matrices(level_codes, level_counts)
+    assert np.isnan(results['spearman'][0, 1]) and np.isnan(results['kendall'][0, 1])
+    assert np.isnan(results['cramers_v'][0, 1])
+
+
+# --- feature_screening ---
+def _anova_reference(counts, level_values):
+    """由次數表展開成各分群的分數，再呼叫 stats.f_oneway"""
+    groups = [np.repeat(level_values, row) for row in counts if row.sum() > 0]
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return stats.f_oneway(*groups)
+
+def test_batched_anova_matches_f_oneway():
+    rng = np.random.default_rng(0)
+    counts = rng.integers(0, 6, size=(300, 3, 4))
+    counts[rng.random(counts.shape) < 0.6] = 0 # 稀疏的次數表：部分題目的組內平方和為 0
+    counts[:5] = 0
+    counts[0, 0, 1], counts[0, 1, 3] = 4, 2 # 各分群內相同、分群之間不同 → F = inf
+    counts[1, :, 2] = 3 # 所有分數都相同 → NaN
+    level_values = np.tile(np.arange(1, 5, dtype=float), (300, 1))
+    f_statistic, _, _, p_values = batched_anova(counts, level_values)
+    for item in range(len(counts)):
+        if (counts[item].sum(axis=1) > 0).sum() < 2 or counts[item].sum() <= (counts[item].sum(axis=1) > 0).sum():
+            assert np.isnan(f_statistic[item]) # 少於兩個分群或沒有組內自由度
+            continue
+        reference = _anova_reference(counts[item], level_values[item])
+        np.testing.assert_allclose(f_statistic[item], reference.statistic, rtol=1e-9, equal_nan=True)
+        np.testing.assert_allclose(p_values[item], reference.pvalue, rtol=1e-7, atol=1e-300, equal_nan=True)
+    assert np.isinf(f_statistic[0]) and p_values[0] == 0
+    assert np.isnan(f_statistic[1])
+
+
+# --- contingency_tests ---
+def test_random_tables_keep_margins_and_hypergeometric_cells():
+    row_totals, col_totals = np.array([7, 12, 5]), np.array([4, 9, 3, 8])
+    tables = random_tables(row_totals, col_totals, 20_000, np.random.default_rng(0))
+    assert (tables >= 0).all()
+    assert (tables.sum(axis=2) == row_totals).all() and (tables.sum(axis=1) == col_totals).all()
+
+    # 每一格的邊際分佈為 Hypergeometric(總數, 欄總和, 列總和)
+    total = int(row_totals.sum())
+    for i, j in [(0, 0), (1, 2), (2, 3)]:
+        reference = stats.hypergeom(total, col_totals[j], row_totals[i])
+        cells = tables[:, i, j]
+        assert cells.mean() == pytest.approx(reference.mean(), abs=0.05)
+        assert cells.var() == pytest.approx(reference.var(), rel=0.05)
+    np.testing.assert_allclose(tables.mean(axis=0), expected_frequencies(tables[0]), atol=0.05)
+
+def test_monte_carlo_chi2_matches_scipy():
+    rng = np.random.default_rng(1)
+    table = rng.multinomial(300, np.full(12, 1 / 12)).reshape(3, 4) + np.array([[6, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 6]])
+    chi2, p_value, dof = monte_carlo_chi2(table, n_resamples=20_000, seed=7)
+    reference = stats.chi2_contingency(table, correction=False)
+    assert chi2 == pytest.approx(reference.statistic)
+    assert dof == reference.dof
+    assert p_value == pytest.approx(reference.pvalue, abs=0.02) # 期望頻率足夠時與卡方近似相近
+
+def test_monte_carlo_chi2_is_reproducible_across_workers():
+    table = np.array([[3, 0, 1], [1, 4, 0], [0, 1, 5], [0, 0, 0]]) # 含全為 0 的列
+    sequential = monte_carlo_chi2(table, n_resamples=3_000, seed=11, batch_size=1_000)
+    parallel = monte_carlo_chi2(table, n_resamples=3_000, seed=11, batch_size=1_000, max_workers=2)
+    assert sequential == parallel
+    assert sequential[2] == 4
+
+def test_sparse_table_test_uses_fisher_for_2x2():
+    table = np.array([[1, 9], [11, 3]])
+    name, p_value = sparse_table_test(table)
+    assert name.startswith("Fisher")
+    assert p_value == pytest.approx(stats.fisher_exact(table)[1])
+
+
+# --- join_store ---
+@pytest.mark.parametrize('seed', [0, 1])
+def test_left_join_positions_match_pandas_merge(seed):
+    rng = np.random.default_rng(seed)
+    left_keys = rng.integers(0, 60, 200).astype(float)
+    right_keys = rng.integers(20, 90, 150).astype(float)
+    left_keys[rng.random(200) < 0.1] = np.nan
+    right_keys[rng.random(150) < 0.1] = np.nan
+
+    left_pos, right_pos = left_join_positions(left_keys, right_keys)
+
+    # pd.merge 會讓遺漏的 ID 互相對應；left_join_positions 不會，因此參考結果先排除右邊遺漏的 ID
+    left = pd.DataFrame({'key': left_keys, 'left_pos': np.arange(200)})
+    right = pd.DataFrame({'key': right_keys, 'right_pos': np.arange(150)}).dropna(subset=['key'])
+    merged = left.merge(right, on='key', how='left')
+    np.testing.assert_array_equal(left_pos, merged['left_pos'].to_numpy())
+    np.testing.assert_array_equal(right_pos, merged['right_pos'].fillna(-1).astype(int).to_numpy())
+    assert left_pos.dtype == np.int32 and right_pos.dtype == np.int32
+
+def test_left_join_positions_string_keys():
+    left_pos, right_pos = left_join_positions(np.array(['b', 'a', 'c'], dtype=object),
+                                              np.array(['a', 'b', 'a'], dtype=object))
+    np.testing.assert_array_equal(left_pos, [0, 1, 1, 2])
+    np.testing.assert_array_equal(right_pos, [1, 0, 2, -1])